@@ -1,16 +1,49 @@
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.contrib.admin.widgets import AutocompleteSelect
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm as DjangoUserCreationForm, UserChangeForm
+from django.core.exceptions import PermissionDenied
 from django.utils.html import format_html
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q, Sum
+from django.db.models.functions import ExtractYear
+from django.http import FileResponse, Http404, JsonResponse
 from django.shortcuts import redirect
-from django.urls import reverse
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.http import urlencode
 from django import forms
-from unfold.admin import ModelAdmin, StackedInline
+from unfold.admin import ModelAdmin, StackedInline, TabularInline
 from unfold.forms import AdminPasswordChangeForm, UserCreationForm, UserChangeForm as UnfoldUserChangeForm
 from unfold.widgets import UnfoldAdminSplitDateTimeWidget, UnfoldAdminDateWidget
-from .models import Customer, Tour, Booking, UserProfile
+from crm.routers import replica_reads
+from . import payments, search
+from .exports import ExportAdminMixin
+from .filters import CachedAllValuesFieldListFilter, cached_lookups, with_count
+from .forms import CustomerAdminForm, CustomerImportUploadForm, GroupPaymentForm
+from .images import thumbnail_url
+from .importers import CustomerImporter, read_rows
+from .models import Customer, Tour, Booking, Payment, UserProfile
+from .pagination import KeysetPaginationMixin
+from .search import IndexedSearchMixin
 import datetime
+import os
+import re
+import uuid
+
+
+def avatar(photo):
+    """40px list avatar served from the photo's thumbnails"""
+    small = thumbnail_url(photo, 40)
+    return format_html(
+        '<img src="{}" srcset="{} 1x, {} 2x" width="40" height="40" loading="lazy" alt="" style="border-radius: 50%; object-fit: cover;" />',
+        small, small, thumbnail_url(photo, 80),
+    )
+
 
 # Unregister default User admin
 admin.site.unregister(User)
@@ -24,6 +57,53 @@ class UserCreationFormNoHelp(UserCreationForm):
             self.fields[field_name].help_text = None
 
 
+class ListOnlyMixin:
+    """Load only the ``list_only`` columns for the changelist rows"""
+    list_only = ()
+
+    def get_changelist(self, request, **kwargs):
+        changelist = super().get_changelist(request, **kwargs)
+        if not self.list_only:
+            return changelist
+        only = self.list_only
+
+        def get_results(self, request):
+            # Only the page rows; filters, counts and actions keep the full queryset
+            self.queryset = self.queryset.only(*only)
+            super(ListOnlyChangeList, self).get_results(request)
+
+        ListOnlyChangeList = type('ListOnlyChangeList', (changelist,), {'get_results': get_results})
+        return ListOnlyChangeList
+
+
+def is_autocomplete(request):
+    """Whether ``request`` is the admin's autocomplete endpoint (autocomplete_fields)"""
+    return getattr(request.resolver_match, 'url_name', None) == 'autocomplete'
+
+
+class BookingTourSelect(AutocompleteSelect):
+    """Tour autocomplete telling TourAdmin which booking is edited, so its tour stays listed"""
+    booking = None
+
+    def get_url(self):
+        url = super().get_url()
+        return f"{url}?{urlencode({'booking': self.booking})}" if self.booking else url
+
+
+class ReplicaChangelistMixin:
+    """GET changelists read from a replica when one is configured (crm.routers)"""
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super().changelist_view(request, extra_context)
+        with replica_reads():
+            response = super().changelist_view(request, extra_context)
+            # Render here so queries made by the template use the replica too
+            if hasattr(response, 'render'):
+                response.render()
+            return response
+
+
 class UserProfileInline(StackedInline):
     model = UserProfile
     can_delete = False
@@ -32,7 +112,7 @@ class UserProfileInline(StackedInline):
 
 
 @admin.register(User)
-class UserAdmin(DjangoUserAdmin, ModelAdmin):
+class UserAdmin(ListOnlyMixin, DjangoUserAdmin, ModelAdmin):
     add_form = UserCreationFormNoHelp
     form = UnfoldUserChangeForm
     change_password_form = AdminPasswordChangeForm
@@ -42,7 +122,12 @@ class UserAdmin(DjangoUserAdmin, ModelAdmin):
     list_filter = ['is_staff', 'is_superuser', 'is_active']
     search_fields = ['username', 'first_name', 'last_name', 'email']
     list_editable = ['is_active']
-    actions = ['edit_selected_user']
+    list_select_related = ['profile']
+    list_only = [
+        'username', 'first_name', 'last_name', 'email', 'date_joined',
+        'is_superuser', 'is_staff', 'is_active', 'profile__photo',
+    ]
+    actions = ['edit_selected_user', 'activate_users', 'deactivate_users']
 
     # Add user fieldsets
     add_fieldsets = (
@@ -62,7 +147,7 @@ class UserAdmin(DjangoUserAdmin, ModelAdmin):
 
     def get_photo(self, obj):
         if hasattr(obj, 'profile') and obj.profile.photo:
-            return format_html('<img src="{}" width="40" height="40" style="border-radius: 50%; object-fit: cover;" />', obj.profile.photo.url)
+            return avatar(obj.profile.photo)
         return format_html('<div style="width: 40px; height: 40px; border-radius: 50%; background: #D4AF37; display: flex; align-items: center; justify-content: center; color: white; font-weight: bold;">{}</div>',
                           obj.username[0].upper() if obj.username else '?')
     get_photo.short_description = 'Photo'
@@ -89,7 +174,24 @@ class UserAdmin(DjangoUserAdmin, ModelAdmin):
         super().save_model(request, obj, form, change)
         if hasattr(obj, 'profile'):
             obj.profile.status = 'active' if obj.is_active else 'passive'
-            obj.profile.save()
+            obj.profile.save_if_changed()
+
+    def set_active(self, request, queryset, is_active):
+        # One UPDATE per table however many users are selected; profiles go first
+        # because a changelist filtered on is_active no longer matches afterwards
+        UserProfile.objects.filter(user__in=queryset.values('pk')).update(
+            status='active' if is_active else 'passive', updated_at=timezone.now()
+        )
+        count = queryset.update(is_active=is_active)
+        self.message_user(request, f'{count} user(s) {"activated" if is_active else "deactivated"}.')
+
+    def activate_users(self, request, queryset):
+        self.set_active(request, queryset, True)
+    activate_users.short_description = 'Activate selected users'
+
+    def deactivate_users(self, request, queryset):
+        self.set_active(request, queryset, False)
+    deactivate_users.short_description = 'Deactivate selected users'
 
     def edit_selected_user(self, request, queryset):
         if queryset.count() != 1:
@@ -106,8 +208,11 @@ class SeasonListFilter(admin.SimpleListFilter):
     parameter_name = 'season'
 
     def lookups(self, request, model_admin):
-        years = set([d.year for d in Customer.objects.dates('created_at', 'year')])
-        return [(year, str(year)) for year in sorted(years, reverse=True)]
+        years = cached_lookups('customer:season', lambda: list(
+            Customer.objects.annotate(year=ExtractYear('created_at')).values('year')
+            .annotate(count=Count('pk')).order_by('-year').values_list('year', 'count')
+        ))
+        return [(year, with_count(str(year), count)) for year, count in years]
 
     def queryset(self, request, queryset):
         if self.value():
@@ -118,37 +223,104 @@ class SeasonListFilter(admin.SimpleListFilter):
 class TourListFilter(admin.SimpleListFilter):
     title = 'Tur'
     parameter_name = 'tour'
+    template = 'admin/accounts/tour_filter.html'
+    # With more tours than this the options are searched instead of listed
+    inline_limit = 10
 
     def lookups(self, request, model_admin):
-        tours = Tour.objects.all().values_list('id', 'name')
-        return [(tour[0], tour[1]) for tour in tours]
+        def tour_options():
+            tours = list(Tour.objects.values_list('id', 'name')[:self.inline_limit + 1])
+            if len(tours) > self.inline_limit:
+                return {'lazy': True, 'tours': []}
+            customers = dict(
+                Booking.objects.filter(tour__in=[pk for pk, name in tours]).values('tour')
+                .annotate(count=Count('customer', distinct=True)).values_list('tour', 'count')
+            )
+            return {'lazy': False, 'tours': [(pk, name, customers.get(pk, 0)) for pk, name in tours]}
+
+        options = cached_lookups('customer:tour', tour_options)
+        self.lazy = options['lazy']
+        if self.lazy:
+            # Only the selected tour is listed, the others are found with the search box
+            if str(self.value() or '').isdigit():
+                return list(Tour.objects.filter(pk=self.value()).values_list('id', 'name'))
+            return []
+        return [(pk, with_count(name, count)) for pk, name, count in options['tours']]
+
+    def has_output(self):
+        return self.lazy or super().has_output()
+
+    def choices(self, changelist):
+        self.options_url = reverse('admin:accounts_customer_tour_filter_options')
+        self.option_query_string = changelist.get_query_string({self.parameter_name: '__tour__'})
+        return super().choices(changelist)
 
     def queryset(self, request, queryset):
         if self.value():
-            # Filter customers who have bookings for this tour
-            return queryset.filter(bookings__tour_id=self.value()).distinct()
+            # EXISTS stops at the first booking and needs no DISTINCT over joined rows
+            return queryset.filter(Exists(Booking.objects.filter(customer=OuterRef('pk'), tour_id=self.value())))
         return queryset
 
 
-class CustomerAdminForm(forms.ModelForm):
-    class Meta:
-        model = Customer
-        fields = '__all__'
-        widgets = {
-            'birth_date': UnfoldAdminDateWidget(),
-            'passport_issue_date': UnfoldAdminDateWidget(),
-            'passport_expiry_date': UnfoldAdminDateWidget(),
-        }
+class OutstandingBalanceListFilter(admin.SimpleListFilter):
+    title = 'amount owed'
+    parameter_name = 'owed'
+    # Ranges on booking_outstanding_idx
+    thresholds = (100, 500, 1000)
+
+    def lookups(self, request, model_admin):
+        return [
+            ('none', 'Nothing owed'),
+            ('any', 'Anything owed'),
+            *[(str(amount), f'€{amount:,} or more') for amount in self.thresholds],
+        ]
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value == 'none':
+            return queryset.filter(outstanding_balance__lte=0)
+        if value == 'any':
+            return queryset.filter(outstanding_balance__gt=0)
+        if value and value.isdigit():
+            return queryset.filter(outstanding_balance__gte=int(value))
+        return queryset
+
 
 @admin.register(Customer)
-class CustomerAdmin(ModelAdmin):
+class CustomerAdmin(ReplicaChangelistMixin, IndexedSearchMixin, ExportAdminMixin, ListOnlyMixin, KeysetPaginationMixin, ModelAdmin):
     form = CustomerAdminForm
     list_display = ['get_photo', 'customer_number', 'first_name', 'last_name', 'email', 'phone', 'nationality', 'created_at']
-    list_filter = [SeasonListFilter, TourListFilter, 'country', 'city', 'gender', 'nationality']
+    list_filter = [
+        SeasonListFilter,
+        TourListFilter,
+        ('country', CachedAllValuesFieldListFilter),
+        ('city', CachedAllValuesFieldListFilter),
+        'gender',
+        ('nationality', CachedAllValuesFieldListFilter),
+    ]
     search_fields = ['first_name', 'last_name', 'email', 'phone', 'customer_number', 'passport_number']
+    search_index = {'pk': 'customer'}
+    keyset_ordering = ['-created_at', '-pk']
     readonly_fields = ['customer_number', 'created_at', 'updated_at', 'photo_preview']
-    actions = ['delete_selected', 'edit_selected_customer']
+    actions = ['delete_selected', 'edit_selected_customer', 'export_csv', 'export_xlsx']
     list_display_links = ['customer_number', 'first_name', 'last_name']  # Clickable fields for view mode
+    list_only = ['photo', 'customer_number', 'first_name', 'last_name', 'email', 'phone', 'nationality', 'created_at']
+    export_columns = [
+        ('Customer Number', 'customer_number'),
+        ('First Name', 'first_name'),
+        ('Last Name', 'last_name'),
+        ('Email', 'email'),
+        ('Phone', 'phone'),
+        ('Passport Number', 'passport_number'),
+        ('Identity Number', 'identity_number'),
+        ('Birth Date', 'birth_date'),
+        ('Birth Date Estimated', 'birth_date_estimated'),
+        ('Gender', 'gender'),
+        ('Nationality', 'nationality'),
+        ('Country', 'country'),
+        ('City', 'city'),
+        ('Created', 'created_at'),
+    ]
 
     fieldsets = (
         ('General Information', {
@@ -157,6 +329,7 @@ class CustomerAdmin(ModelAdmin):
                 ('first_name', 'last_name'),
                 ('passport_number', 'identity_number'),
                 ('birth_date', 'birth_place'),
+                'birth_date_estimated',
                 ('mother_name', 'father_name'),
                 ('phone', 'email'),
                 ('nationality', 'gender'),
@@ -187,7 +360,7 @@ class CustomerAdmin(ModelAdmin):
 
     def get_photo(self, obj):
         if obj.photo:
-            return format_html('<img src="{}" width="40" height="40" style="border-radius: 50%; object-fit: cover;" />', obj.photo.url)
+            return avatar(obj.photo)
         return format_html('<div style="width: 40px; height: 40px; border-radius: 50%; background: #D4AF37; display: flex; align-items: center; justify-content: center; color: white; font-weight: bold;">{}</div>',
                           obj.first_name[0].upper() if obj.first_name else '?')
     get_photo.short_description = 'Photo'
@@ -196,9 +369,12 @@ class CustomerAdmin(ModelAdmin):
         if obj.photo:
             return format_html(
                 '<div style="margin-top: 10px;">'
-                '<img src="{}" style="max-width: 600px; max-height: 800px; border: 1px solid #ddd; border-radius: 4px; padding: 5px;" />'
+                '<a href="{}" target="_blank">'
+                '<img src="{}" loading="lazy" style="max-width: 600px; max-height: 800px; border: 1px solid #ddd; border-radius: 4px; padding: 5px;" />'
+                '</a>'
                 '</div>',
-                obj.photo.url
+                obj.photo.url,
+                thumbnail_url(obj.photo, 600),
             )
         return "No passport image uploaded"
     photo_preview.short_description = 'Passport Image'
@@ -212,6 +388,71 @@ class CustomerAdmin(ModelAdmin):
         return redirect(url)
     edit_selected_customer.short_description = 'Edit selected customer'
 
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='accounts_customer_import'),
+            path('import/report/<uuid:token>/', self.admin_site.admin_view(self.import_report_view),
+                 name='accounts_customer_import_report'),
+            path('tour-filter-options/', self.admin_site.admin_view(self.tour_filter_options_view),
+                 name='accounts_customer_tour_filter_options'),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        """Upload a CSV/XLSX file of customers, optionally as a dry run"""
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+
+        result = report_token = None
+        form = CustomerImportUploadForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            report_token = uuid.uuid4()
+            os.makedirs(settings.CUSTOMER_IMPORT_REPORT_DIR, exist_ok=True)
+            with open(self.import_report_path(report_token), 'w', newline='', encoding='utf-8') as report:
+                importer = CustomerImporter(
+                    batch_size=settings.CUSTOMER_IMPORT_BATCH_SIZE,
+                    dry_run=form.cleaned_data['dry_run'],
+                    report=report,
+                )
+                result = importer.run(read_rows(upload.file, upload.name))
+            if not result.failed:
+                os.remove(self.import_report_path(report_token))
+                report_token = None
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import customers',
+            'form': form,
+            'result': result,
+            'report_token': report_token,
+        }
+        return TemplateResponse(request, 'admin/accounts/customer/import.html', context)
+
+    def import_report_view(self, request, token):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        report_path = self.import_report_path(token)
+        if not os.path.exists(report_path):
+            raise Http404('Import report not found')
+        return FileResponse(open(report_path, 'rb'), as_attachment=True, filename='customer-import-errors.csv')
+
+    @staticmethod
+    def import_report_path(token):
+        return os.path.join(settings.CUSTOMER_IMPORT_REPORT_DIR, f'{token}.csv')
+
+    def tour_filter_options_view(self, request):
+        """Tours matching ``q`` for TourListFilter's search box"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        tours = Tour.objects.all()
+        term = request.GET.get('q', '')
+        if search.query_terms(term):
+            tours = search.search_queryset(tours, {'pk': 'tour'}, term)
+        with replica_reads():
+            results = [{'id': pk, 'text': name} for pk, name in tours.values_list('id', 'name')[:20]]
+        return JsonResponse({'results': results})
+
     # def changelist_view(self, request, extra_context=None):
     #     # Ensure has_add_permission is True for changelist
     #     extra_context = extra_context or {}
@@ -278,14 +519,183 @@ class CustomerAdmin(ModelAdmin):
         return fieldsets
 
 @admin.register(Tour)
-class TourAdmin(ModelAdmin):
-    list_display = ['name', 'destination', 'duration_days', 'price', 'start_date', 'end_date', 'status']
-    list_filter = ['status', 'destination', 'start_date']
+class TourAdmin(ReplicaChangelistMixin, ModelAdmin):
+    list_display = ['name', 'destination', 'duration_days', 'price', 'start_date', 'end_date', 'seats_booked', 'max_participants', 'status']
+    list_filter = ['status', ('destination', CachedAllValuesFieldListFilter), 'start_date']
     search_fields = ['name', 'destination', 'description']
 
+    def get_search_results(self, request, queryset, search_term):
+        if not is_autocomplete(request):
+            return super().get_search_results(request, queryset, search_term)
+        # Booking form: upcoming tours, soonest first, found by name, destination
+        # (search index) or start date ("2026-07" or "2026-07-14"). A booking
+        # being changed keeps its own tour on offer once that has started.
+        offered = Q(start_date__gte=timezone.localdate())
+        booking = request.GET.get('booking', '')
+        if booking.isdigit():
+            offered |= Q(pk__in=Booking.objects.filter(pk=booking).values('tour_id'))
+        queryset = queryset.filter(offered).order_by('start_date', 'pk')
+        words = []
+        for term in search_term.split():
+            try:
+                start = datetime.date.fromisoformat(term)
+            except ValueError:
+                if re.fullmatch(r'\d{4}-\d{2}', term):
+                    year, month = map(int, term.split('-'))
+                    queryset = queryset.filter(start_date__year=year, start_date__month=month)
+                else:
+                    words.append(term)
+            else:
+                queryset = queryset.filter(start_date=start)
+        if search.query_terms(' '.join(words)):
+            queryset = search.search_queryset(queryset, {'pk': 'tour'}, ' '.join(words))
+        return queryset, False
+
+class PaymentInline(TabularInline):
+    """Payments of a booking; recorded ones are read-only, corrections are new entries"""
+    model = Payment
+    extra = 0
+    can_delete = False
+    fields = ['amount', 'method', 'paid_at', 'note']
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Booking)
-class BookingAdmin(ModelAdmin):
-    list_display = ['customer', 'tour', 'number_of_participants', 'total_price', 'amount_paid', 'payment_status', 'booking_date']
-    list_filter = ['payment_status', 'booking_date', 'tour']
+class BookingAdmin(ReplicaChangelistMixin, IndexedSearchMixin, ExportAdminMixin, ListOnlyMixin, KeysetPaginationMixin, ModelAdmin):
+    list_display = [
+        'customer', 'tour', 'number_of_participants', 'total_price', 'amount_paid', 'outstanding_balance',
+        'payment_status', 'booking_date',
+    ]
+    list_filter = ['payment_status', OutstandingBalanceListFilter, 'booking_date', 'tour']
     search_fields = ['customer__first_name', 'customer__last_name', 'tour__name']
-    readonly_fields = ['accounts_receivable']
+    search_index = {'customer': 'customer', 'tour': 'tour'}
+    # Searched selects instead of every customer and tour rendered as <option>s
+    autocomplete_fields = ['customer', 'tour']
+    keyset_ordering = ['-booking_date', '-pk']
+    # customer and tour are displayed through __str__
+    list_select_related = ['customer', 'tour']
+    list_only = [
+        'number_of_participants', 'total_price', 'amount_paid', 'outstanding_balance', 'payment_status', 'booking_date',
+        'customer__first_name', 'customer__last_name', 'tour__name', 'tour__destination',
+    ]
+    # Moved by the payment ledger (accounts.payments), Booking.save() never writes them
+    readonly_fields = ['amount_paid', 'payment_status', 'accounts_receivable']
+    inlines = [PaymentInline]
+    actions = ['record_payments', 'export_csv', 'export_xlsx']
+    export_columns = [
+        ('Customer Number', 'customer__customer_number'),
+        ('First Name', 'customer__first_name'),
+        ('Last Name', 'customer__last_name'),
+        ('Tour', 'tour__name'),
+        ('Tour Start', 'tour__start_date'),
+        ('Participants', 'number_of_participants'),
+        ('Total Price', 'total_price'),
+        ('Amount Paid', 'amount_paid'),
+        ('Outstanding', 'outstanding_balance'),
+        ('Payment Status', 'payment_status'),
+        ('Booking Date', 'booking_date'),
+    ]
+    # Rows on the top debtors page
+    top_debtors_limit = 50
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'tour':
+            kwargs['widget'] = BookingTourSelect(db_field, self.admin_site, using=kwargs.get('using'))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        if obj is not None and 'tour' in form.base_fields:
+            form.base_fields['tour'].widget.widget.booking = obj.pk
+        return form
+
+    @admin.action(description='Record a payment on the selected bookings', permissions=['change'])
+    def record_payments(self, request, queryset):
+        """One payment per selected booking, e.g. a group tour paid by its organizer"""
+        form = GroupPaymentForm(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            data = form.cleaned_data
+            with transaction.atomic():
+                bookings = list(
+                    Booking.objects.select_for_update().filter(pk__in=queryset.values('pk'))
+                    .only('amount_paid', 'outstanding_balance').order_by('pk')
+                )
+                if data['pay'] == 'balance':
+                    entries = [(booking, booking.outstanding_balance) for booking in bookings if booking.outstanding_balance > 0]
+                elif data['pay'] == 'refund':
+                    entries = [(booking, -booking.amount_paid) for booking in bookings if booking.amount_paid > 0]
+                else:
+                    entries = [(booking, data['amount']) for booking in bookings]
+                recorded = payments.record_payments(entries, data['method'], data['paid_at'], data['note'])
+            total = sum(payment.amount for payment in recorded)
+            self.message_user(request, f'{len(recorded)} payment(s) recorded, €{total:,.2f} in total.')
+            return None
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Record payments',
+            'form': form,
+            'summary': queryset.order_by().aggregate(bookings=Count('pk'), owed=Sum('outstanding_balance')),
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            'select_across': request.POST.get('select_across', '0'),
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        }
+        return TemplateResponse(request, 'admin/accounts/booking/record_payments.html', context)
+
+    def get_urls(self):
+        return [
+            path('top-debtors/', self.admin_site.admin_view(self.top_debtors_view),
+                 name='accounts_booking_top_debtors'),
+        ] + super().get_urls()
+
+    def top_debtors_view(self, request):
+        """Customers owing the most over their bookings"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        with replica_reads():
+            # Only bookings with a balance are read, a range of booking_outstanding_idx
+            debts = list(
+                Booking.objects.filter(outstanding_balance__gt=0).order_by().values('customer')
+                .annotate(owed=Sum('outstanding_balance'), bookings=Count('pk'))
+                .order_by('-owed', 'customer')[:self.top_debtors_limit]
+            )
+            customers = Customer.objects.only('first_name', 'last_name', 'customer_number', 'email', 'phone').in_bulk(
+                [debt['customer'] for debt in debts]
+            )
+        changelist_url = reverse('admin:accounts_booking_changelist')
+        rows = [
+            {
+                **debt,
+                'customer': customers[debt['customer']],
+                'bookings_url': f"{changelist_url}?customer={debt['customer']}&owed=any",
+            }
+            for debt in debts if debt['customer'] in customers
+        ]
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Top debtors',
+            'rows': rows,
+        }
+        return TemplateResponse(request, 'admin/accounts/booking/top_debtors.html', context)
+
+
+@admin.register(Payment)
+class PaymentAdmin(IndexedSearchMixin, ModelAdmin):
+    """The ledger is append-only: entries are added, never changed or deleted"""
+    list_display = ['paid_at', 'booking', 'amount', 'method', 'note']
+    list_filter = ['method', 'paid_at']
+    search_fields = ['booking__customer__first_name', 'booking__customer__last_name', 'booking__tour__name']
+    search_index = {'booking__customer': 'customer', 'booking__tour': 'tour'}
+    list_select_related = ['booking__customer', 'booking__tour']
+    autocomplete_fields = ['booking']
+    date_hierarchy = 'paid_at'
+
+    def has_change_permission(self, request, obj=None):
+        return obj is None and super().has_change_permission(request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,81 @@
+"""
+Customer ages and age groups, derived from birth_date.
+
+Ages are never stored: an age group is a birth_date range relative to today
+("26-35" is born after today - 36 years and on or before today - 26 years),
+so counts stay right as customers get older and are answered from
+customer_birth_date_idx. Customer.age is only what was entered with the
+customer; backfill_birth_dates estimates a birth date from it where none is
+recorded and flags it as birth_date_estimated.
+"""
+import datetime
+
+from django.db.models import Func, IntegerField, Q, Subquery
+from django.utils import timezone
+
+# (label, minimum age, maximum age) - a maximum of None means open ended
+AGE_GROUPS = [
+    ('18-25', 18, 25),
+    ('26-35', 26, 35),
+    ('36-45', 36, 45),
+    ('46-55', 46, 55),
+    ('56+', 56, None),
+]
+
+
+def years_before(day, years):
+    """``day`` ``years`` years earlier; 29 February becomes 28 February"""
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        return day.replace(year=day.year - years, day=28)
+
+
+def age_on(birth_date, day):
+    """Completed years of someone born on ``birth_date`` at ``day``"""
+    return day.year - birth_date.year - ((day.month, day.day) < (birth_date.month, birth_date.day))
+
+
+def birth_date_range(min_age, max_age, today):
+    """(earliest, latest) birth dates, ``earliest`` exclusive and None when open ended"""
+    latest = years_before(today, min_age)
+    earliest = None if max_age is None else years_before(today, max_age + 1)
+    return earliest, latest
+
+
+def age_group_condition(min_age, max_age, today, field='birth_date'):
+    earliest, latest = birth_date_range(min_age, max_age, today)
+    condition = Q(**{f'{field}__lte': latest})
+    if earliest is not None:
+        condition &= Q(**{f'{field}__gt': earliest})
+    return condition
+
+
+def age_group_counts(queryset=None, today=None):
+    """
+    {label: customers} for every AGE_GROUPS label in one statement: a COUNT
+    subquery per group, each a range scan of the birth_date index.
+    """
+    if queryset is None:
+        from .models import Customer
+        queryset = Customer.objects.all()
+    today = today or timezone.localdate()
+
+    counts = {
+        f'group_{index}': Subquery(
+            queryset.filter(age_group_condition(min_age, max_age, today)).order_by()
+            .annotate(count=Func('pk', function='COUNT', output_field=IntegerField())).values('count')
+        )
+        for index, (label, min_age, max_age) in enumerate(AGE_GROUPS)
+    }
+    # Any one row carries the subqueries; without customers every group is empty
+    row = queryset.model._base_manager.values(**counts).first()
+    return {
+        label: row[f'group_{index}'] if row else 0
+        for index, (label, min_age, max_age) in enumerate(AGE_GROUPS)
+    }
+
+
+def estimated_birth_date(age, recorded_on):
+    """Middle of the year of birth dates giving ``age`` on ``recorded_on``"""
+    return years_before(recorded_on, age) - datetime.timedelta(days=182)
@@ -0,0 +1,62 @@
+"""
+Cached changelist filter options.
+
+Option lists and their row counts are computed once per filter_cache version
+instead of on every changelist render; Customer/Tour/Booking saves and
+deletes invalidate the cache. They are read from the primary even within a
+replica-routed changelist, as a replica behind the invalidating write would
+cache the old options. Counts are over the unfiltered changelist.
+"""
+from django.contrib import admin
+from django.contrib.admin.utils import reverse_field_path
+from django.db.models import Count
+
+from crm.cache import VersionedCache
+from crm.routers import primary_reads
+
+# Invalidated by Customer/Tour/Booking save and delete signals (accounts.models)
+filter_cache = VersionedCache('filter_lookups', 'FILTER_LOOKUP_CACHE')
+
+
+def cached_lookups(key, compute):
+    """``compute()`` through filter_cache, reading from the primary (crm.routers)"""
+    return filter_cache.get_or_set(key, primary_reads()(compute))
+
+
+def with_count(label, count):
+    """``label`` followed by ``count`` when FILTER_LOOKUP_CACHE['COUNTS'] is on"""
+    if filter_cache.config.get('COUNTS'):
+        return f'{label} ({count:,})'
+    return label
+
+
+class CachedAllValuesFieldListFilter(admin.AllValuesFieldListFilter):
+    """AllValuesFieldListFilter reading its options from filter_cache"""
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        super().__init__(field, request, params, model, model_admin, field_path)
+        parent_model, reverse_path = reverse_field_path(model, field_path)
+        if model == parent_model:
+            queryset = model_admin.get_queryset(request)
+        else:
+            queryset = parent_model._default_manager.all()
+        # One GROUP BY gives the distinct values and their counts
+        self.option_counts = cached_lookups(
+            f'{parent_model._meta.label_lower}:{field.name}',
+            lambda: list(
+                queryset.order_by(field.name).values(field.name).annotate(count=Count('pk'))
+                .values_list(field.name, 'count')
+            ),
+        )
+        self.lookup_choices = [value for value, count in self.option_counts]
+
+    def choices(self, changelist):
+        counts = {
+            self.empty_value_display if value is None else str(value): count
+            for value, count in self.option_counts
+        }
+        for index, choice in enumerate(super().choices(changelist)):
+            # The first choice is "All"
+            if index:
+                choice['display'] = with_count(choice['display'], counts.get(choice['display'], 0))
+            yield choice
@@ -0,0 +1,79 @@
+from django import forms
+from django.utils import timezone
+from unfold.widgets import (
+    UnfoldAdminDateWidget, UnfoldAdminDecimalFieldWidget, UnfoldAdminFileFieldWidget, UnfoldAdminRadioSelectWidget,
+    UnfoldAdminSelectWidget, UnfoldAdminSplitDateTimeWidget, UnfoldAdminTextInputWidget, UnfoldBooleanSwitchWidget,
+)
+from .models import Customer, Payment
+
+
+class CustomerAdminForm(forms.ModelForm):
+    class Meta:
+        model = Customer
+        fields = '__all__'
+        widgets = {
+            'birth_date': UnfoldAdminDateWidget(),
+            'passport_issue_date': UnfoldAdminDateWidget(),
+            'passport_expiry_date': UnfoldAdminDateWidget(),
+        }
+
+    def clean(self):
+        data = super().clean()
+        # An edited birth date is the real one, unless the flag was set along with it
+        if 'birth_date' in self.changed_data and 'birth_date_estimated' not in self.changed_data:
+            data['birth_date_estimated'] = False
+        return data
+
+
+class CustomerImportForm(CustomerAdminForm):
+    """CustomerAdminForm's field rules for one imported row; uniqueness is checked per chunk"""
+
+    class Meta(CustomerAdminForm.Meta):
+        fields = None
+        exclude = ['customer_number', 'photo']
+
+    def validate_unique(self):
+        # The importer checks unique emails for a whole chunk in one query
+        pass
+
+
+class CustomerImportUploadForm(forms.Form):
+    file = forms.FileField(
+        label='CSV or XLSX file',
+        widget=UnfoldAdminFileFieldWidget(attrs={'accept': '.csv,.xlsx'}),
+    )
+    dry_run = forms.BooleanField(
+        label='Dry run (validate only, do not save)',
+        required=False,
+        widget=UnfoldBooleanSwitchWidget(),
+    )
+
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        if not upload.name.lower().endswith(('.csv', '.xlsx')):
+            raise forms.ValidationError('Upload a .csv or .xlsx file.')
+        return upload
+
+
+class GroupPaymentForm(forms.Form):
+    """Payment recorded on every selected booking (BookingAdmin.record_payments)"""
+    AMOUNT_CHOICES = [
+        ('balance', 'The outstanding balance of each booking'),
+        ('fixed', 'The same amount on each booking'),
+        ('refund', 'A refund of everything paid on each booking'),
+    ]
+
+    pay = forms.ChoiceField(choices=AMOUNT_CHOICES, initial='balance', widget=UnfoldAdminRadioSelectWidget())
+    amount = forms.DecimalField(
+        max_digits=10, decimal_places=2, required=False, widget=UnfoldAdminDecimalFieldWidget(),
+        help_text='Per booking; negative for a refund.',
+    )
+    method = forms.ChoiceField(choices=Payment.METHOD_CHOICES, widget=UnfoldAdminSelectWidget())
+    paid_at = forms.SplitDateTimeField(initial=timezone.now, widget=UnfoldAdminSplitDateTimeWidget())
+    note = forms.CharField(max_length=200, required=False, widget=UnfoldAdminTextInputWidget())
+
+    def clean(self):
+        data = super().clean()
+        if data.get('pay') == 'fixed' and not data.get('amount'):
+            self.add_error('amount', 'Enter the amount paid on each booking.')
+        return data
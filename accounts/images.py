@@ -0,0 +1,125 @@
+"""
+Processing of customer and user photos.
+
+Uploads are normalized before they reach storage: EXIF orientation applied,
+metadata dropped, the longest side capped and the image re-encoded with the
+PHOTO_UPLOAD settings, so a 15MB phone photo is stored as a few hundred KB.
+
+Each photo then gets fixed-size JPEG derivatives stored next to it
+("customer_photos/scan.jpg" -> "customer_photos/scan_40.jpg"), so admin lists
+load a few kilobytes per row instead of the full passport scan. Both run when
+a photo is saved (accounts.models); thumbnails of older photos are backfilled
+with the generate_thumbnails command.
+"""
+import json
+import logging
+import os
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from PIL import Image, ImageOps
+
+logger = logging.getLogger('accounts.images')
+
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png'}
+
+# key: (bounding box, crop to fill). 40/80 are the 1x/2x list avatars, 600 is
+# the change form preview
+THUMBNAILS = {
+    40: ((40, 40), True),
+    80: ((80, 80), True),
+    600: ((600, 800), False),
+}
+JPEG_QUALITY = 85
+
+
+def thumbnail_name(name, key):
+    root, ext = os.path.splitext(name)
+    return f'{root}_{key}.jpg'
+
+
+def thumbnail_url(fieldfile, key):
+    return fieldfile.storage.url(thumbnail_name(fieldfile.name, key))
+
+
+def render_thumbnail(image, size, crop):
+    if crop:
+        thumbnail = ImageOps.fit(image, size, Image.LANCZOS)
+    else:
+        thumbnail = image.copy()
+        thumbnail.thumbnail(size, Image.LANCZOS)
+    if thumbnail.mode not in ('RGB', 'L'):
+        thumbnail = thumbnail.convert('RGB')
+    output = BytesIO()
+    thumbnail.save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def generate_thumbnails(fieldfile, source=None):
+    """
+    Write every THUMBNAILS size of ``fieldfile``. ``source`` is a file already
+    holding the image (the upload being saved), which spares a storage read.
+    """
+    storage = fieldfile.storage
+    if source is None:
+        source = fieldfile.open('rb')
+    source.seek(0)
+    with Image.open(source) as image:
+        # Let the JPEG decoder downscale while decoding; it stays at least this large
+        image.draft('RGB', max(size for size, crop in THUMBNAILS.values()))
+        image = ImageOps.exif_transpose(image)
+        for key, (size, crop) in THUMBNAILS.items():
+            name = thumbnail_name(fieldfile.name, key)
+            # Storages that do not overwrite would otherwise save under another name
+            storage.delete(name)
+            storage.save(name, ContentFile(render_thumbnail(image, size, crop)))
+    source.seek(0)
+
+
+def normalize_upload(upload):
+    """
+    Re-encoded copy of the uploaded image ``upload``, or None when it cannot
+    be read as an image. The copy is spooled to a temporary file past
+    FILE_UPLOAD_MAX_MEMORY_SIZE and storages read it back in chunks.
+    """
+    config = settings.PHOTO_UPLOAD
+    max_dimension = config['MAX_DIMENSION']
+    upload.seek(0)
+    try:
+        image = Image.open(upload)
+        original_size = image.size
+        # Decode large JPEGs at a reduced scale that still covers the cap
+        image.draft('RGB', (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(image)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning(json.dumps({'event': 'photo_not_normalized', 'name': upload.name, 'error': str(e)}))
+        upload.seek(0)
+        return None
+
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    output = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    # Saved without exif=, so EXIF (GPS, device) is dropped; the color profile is kept
+    options = {'quality': config['QUALITY'], 'icc_profile': image.info.get('icc_profile')}
+    if config['FORMAT'] == 'JPEG':
+        options.update(optimize=True, progressive=True)
+    image.save(output, config['FORMAT'], **options)
+    output.seek(0, os.SEEK_END)
+    normalized_bytes = output.tell()
+    output.seek(0)
+
+    root = os.path.splitext(os.path.basename(upload.name))[0]
+    normalized = File(output, name=f"{root}.{EXTENSIONS.get(config['FORMAT'], config['FORMAT'].lower())}")
+    logger.info(json.dumps({
+        'event': 'photo_normalized',
+        'name': upload.name,
+        'original_bytes': upload.size,
+        'normalized_bytes': normalized_bytes,
+        'original_size': list(original_size),
+        'normalized_size': list(image.size),
+    }))
+    return normalized
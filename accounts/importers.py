@@ -0,0 +1,182 @@
+"""
+Streaming customer import from CSV/XLSX files.
+
+Rows are read one at a time and validated in chunks with CustomerImportForm
+(CustomerAdminForm's field rules). Valid rows of a chunk are inserted with a
+single bulk_create using a pre-allocated block of customer numbers, so memory
+stays bounded by the chunk size whatever the size of the file.
+"""
+import csv
+import datetime
+import io
+from dataclasses import dataclass
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import BooleanField
+from django.db.models.functions import Lower
+
+from crm.dashboard import dashboard_cache
+from . import rollups, search
+from .filters import filter_cache
+from .forms import CustomerImportForm
+from .models import Customer, CustomerNumberSequence
+
+REPORT_COLUMNS = ['row', 'email', 'errors']
+FALSE_VALUES = {'', '0', 'false', 'no', 'n', 'off'}
+
+
+@dataclass
+class ImportResult:
+    rows: int = 0
+    created: int = 0
+    failed: int = 0
+    dry_run: bool = False
+
+
+def normalize_header(name):
+    """Accept field names and verbose names ("First Name", "first_name")"""
+    name = str(name or '').strip().lower()
+    for field in Customer._meta.get_fields():
+        if name in (field.name, str(getattr(field, 'verbose_name', '')).lower()):
+            return field.name
+    return name.replace(' ', '_')
+
+
+def normalize_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        # Spreadsheets store phone and ID numbers as floats
+        return str(int(value))
+    return str(value).strip()
+
+
+def read_csv(file):
+    stream = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    reader = csv.reader(stream)
+    header = [normalize_header(name) for name in next(reader, [])]
+    for row in reader:
+        if any(row):
+            yield reader.line_num, dict(zip(header, map(normalize_value, row)))
+
+
+def read_xlsx(file):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [normalize_header(name) for name in next(rows, [])]
+        for line, row in enumerate(rows, start=2):
+            if any(cell not in (None, '') for cell in row):
+                yield line, dict(zip(header, map(normalize_value, row)))
+    finally:
+        workbook.close()
+
+
+def read_rows(file, filename):
+    """Yield (line number, row dict) from a binary CSV or XLSX file"""
+    if filename.lower().endswith('.xlsx'):
+        return read_xlsx(file)
+    return read_csv(file)
+
+
+class CustomerImporter:
+
+    def __init__(self, batch_size=500, dry_run=False, report=None):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.report = csv.writer(report) if report is not None else None
+        if self.report:
+            self.report.writerow(REPORT_COLUMNS)
+        self.result = ImportResult(dry_run=dry_run)
+        self.errors = []
+        # Earlier chunks are not in the database during a dry run
+        self.dry_run_emails = set()
+
+    def run(self, rows):
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, self.batch_size))
+            if not chunk:
+                break
+            self.import_chunk(chunk)
+            self.write_errors()
+        if self.result.created:
+            transaction.on_commit(dashboard_cache.invalidate)
+            transaction.on_commit(filter_cache.invalidate)
+        return self.result
+
+    def error(self, line, data, messages):
+        self.result.failed += 1
+        self.errors.append([line, data.get('email', ''), '; '.join(messages)])
+
+    def write_errors(self):
+        if self.report:
+            self.report.writerows(sorted(self.errors))
+        self.errors = []
+
+    def import_chunk(self, chunk):
+        self.result.rows += len(chunk)
+        valid = []
+        for line, data in chunk:
+            form = CustomerImportForm(data=self.clean_row(data))
+            if form.is_valid():
+                valid.append((line, data, form.instance))
+            else:
+                self.error(line, data, [
+                    f'{field}: {message}' for field, messages in form.errors.items() for message in messages
+                ])
+
+        emails = [customer.email.lower() for line, data, customer in valid]
+        # Stored emails keep the case they were entered with
+        taken = set(
+            Customer.objects.annotate(email_lower=Lower('email')).filter(email_lower__in=emails)
+            .values_list('email_lower', flat=True)
+        )
+
+        customers = []
+        for line, data, customer in valid:
+            email = customer.email.lower()
+            if email in taken or email in self.dry_run_emails:
+                self.error(line, data, ['email: Customer with this Email already exists.'])
+                continue
+            taken.add(email)
+            customers.append(customer)
+
+        if self.dry_run:
+            self.dry_run_emails.update(customer.email.lower() for customer in customers)
+            self.result.created += len(customers)
+            return
+        if not customers:
+            return
+
+        with transaction.atomic():
+            numbers = CustomerNumberSequence.allocate(len(customers))
+            for customer, number in zip(customers, numbers):
+                customer.customer_number = number
+            Customer.objects.bulk_create(customers)
+            rollups.record_created(customer.get_tracked_values() for customer in customers)
+            # MySQL does not return primary keys from bulk_create
+            search.index_objects('customer', Customer.objects.filter(customer_number__in=numbers).order_by())
+        self.result.created += len(customers)
+
+    @staticmethod
+    def clean_row(data):
+        """Accept choice labels ("Male", "Mr.") and yes/no style booleans"""
+        data = dict(data)
+        for field in Customer._meta.fields:
+            value = data.get(field.name)
+            if isinstance(field, BooleanField):
+                data[field.name] = 'false' if str(value or '').lower() in FALSE_VALUES else 'true'
+            elif field.choices and value:
+                for choice, label in field.choices:
+                    if value.lower() in (str(choice).lower(), str(label).lower()):
+                        data[field.name] = choice
+                        break
+        return data
@@ -0,0 +1,112 @@
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.backends.base import SessionBase
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.http import QueryDict
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from crm.dashboard import compute_dashboard_metrics
+
+
+def explain(sql, tables):
+    """(table, detail, is_full_scan) for every step of the plan of ``sql``"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            steps = []
+            for row in cursor.fetchall():
+                detail = row[-1]
+                words = detail.split()
+                table = words[1] if len(words) > 1 and words[0] in ('SCAN', 'SEARCH') else ''
+                # Scans of subqueries and CTEs are not table scans
+                full_scan = words[0] == 'SCAN' and 'INDEX' not in detail and table in tables
+                steps.append((table, detail, full_scan))
+            return steps
+
+        cursor.execute(f'EXPLAIN {sql}')
+        columns = [column[0].lower() for column in cursor.description]
+        steps = []
+        for row in cursor.fetchall():
+            row = dict(zip(columns, row))
+            detail = f"type={row.get('type')} key={row.get('key')} rows={row.get('rows')} extra={row.get('extra')}"
+            steps.append((row.get('table') or '', detail, row.get('type') == 'ALL'))
+        return steps
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the queries issued by the admin changelists and the dashboard and flag full table scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail-on-scan', action='store_true', help='Exit non-zero when a full table scan is found')
+        parser.add_argument('--ignore-table', action='append', default=[],
+                            help='Table whose full scans are expected (small lookup tables); repeatable')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan, not only flagged ones')
+
+    def make_request(self, path, params=None):
+        request = RequestFactory().get(path, params or {})
+        # An unsaved superuser passes every permission check without touching the database
+        request.user = User(username='query-plan-audit', is_active=True, is_staff=True, is_superuser=True)
+        request.session = SessionBase()
+        request._messages = FallbackStorage(request)
+        return request
+
+    def changelist_scenarios(self, model_admin):
+        """The default changelist, a search and each list filter with its first option"""
+        opts = model_admin.model._meta
+        path = f'/admin/{opts.app_label}/{opts.model_name}/'
+        yield f'{opts.model_name} changelist', path, {}
+        if model_admin.search_fields:
+            yield f'{opts.model_name} search', path, {'q': 'a'}
+
+        changelist = model_admin.get_changelist_instance(self.make_request(path))
+        for spec in changelist.filter_specs:
+            choices = [choice for choice in spec.choices(changelist) if not choice.get('selected')]
+            if choices:
+                # URL-decoded, so values with spaces or non-ASCII text filter as in the browser
+                params = dict(QueryDict(choices[0]['query_string'].lstrip('?')).lists())
+                yield f'{opts.model_name} filter {spec.title}', path, params
+
+    def capture(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        return [query['sql'] for query in queries if query['sql'].lstrip().upper().startswith('SELECT')]
+
+    def handle(self, *args, **options):
+        ignored = set(options['ignore_table'])
+        scenarios = [('dashboard', compute_dashboard_metrics)]
+        for model, model_admin in admin.site._registry.items():
+            if model._meta.app_label not in ('accounts', 'auth'):
+                continue
+            for name, path, params in self.changelist_scenarios(model_admin):
+                def view(model_admin=model_admin, path=path, params=params):
+                    response = model_admin.changelist_view(self.make_request(path, params))
+                    if hasattr(response, 'render'):
+                        response.render()
+                scenarios.append((name, view))
+
+        tables = set(connection.introspection.table_names())
+        flagged = 0
+        seen = set()
+        for name, func in scenarios:
+            for sql in self.capture(func):
+                if sql in seen:
+                    continue
+                seen.add(sql)
+                steps = explain(sql, tables)
+                scans = [step for step in steps if step[2] and step[0].strip('`"') not in ignored]
+                if not scans and not options['verbose_plans']:
+                    continue
+                flagged += bool(scans)
+                style = self.style.ERROR if scans else self.style.SUCCESS
+                self.stdout.write(style(f'[{name}] {"FULL SCAN" if scans else "ok"}'))
+                self.stdout.write(f'  {sql}')
+                for table, detail, full_scan in steps:
+                    self.stdout.write(f'    {"!" if full_scan else " "} {detail}')
+
+        summary = f'{len(seen)} distinct queries from {len(scenarios)} views, {flagged} with full table scans'
+        if flagged and options['fail_on_scan']:
+            raise CommandError(summary)
+        self.stdout.write(self.style.WARNING(summary) if flagged else self.style.SUCCESS(summary))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from accounts import ages
+from accounts.models import Customer
+from crm.dashboard import dashboard_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'One-time: give customers with a stored age but no birth date an estimated birth date '
+        '(the middle of the possible range when the customer was created, flagged as estimated), '
+        'so they count in age groups'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many customers would get a birth date')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        # Implausible ages stay without a birth date
+        missing = Customer.objects.filter(birth_date__isnull=True, age__isnull=False, age__lte=120)
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'{missing.count()} customers would get an estimated birth date'))
+            return
+
+        filled = 0
+        while True:
+            with transaction.atomic():
+                # Filled rows leave the queryset, so each batch starts from the front
+                batch = list(missing.only('age', 'created_at').order_by('pk')[:options['batch_size']])
+                for customer in batch:
+                    customer.birth_date = ages.estimated_birth_date(customer.age, timezone.localdate(customer.created_at))
+                    customer.birth_date_estimated = True
+                # bulk_update skips save(): birth_date feeds no rollup or search index
+                Customer.objects.bulk_update(batch, ['birth_date', 'birth_date_estimated'])
+            filled += len(batch)
+            if len(batch) < options['batch_size']:
+                break
+
+        dashboard_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(f'{filled} customers got an estimated birth date'))
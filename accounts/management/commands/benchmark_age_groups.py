@@ -0,0 +1,106 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts import ages
+
+TABLE = 'age_group_benchmark'
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the age group counts from the stored age column (one query per group) with the '
+        'birth_date ranges of accounts.ages (one statement) on a synthetic temporary table'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per variant, the fastest is reported')
+        parser.add_argument('--stale-years', type=int, default=2,
+                            help='Years ago the synthetic ages were entered')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE TEMPORARY TABLE {TABLE} (id INTEGER PRIMARY KEY, age INTEGER NULL, birth_date DATE NULL)')
+            try:
+                self.populate(cursor, options, today)
+                self.stdout.write(f"{options['rows']:,} rows, ages entered {options['stale_years']} years ago")
+
+                old = self.benchmark(cursor, self.stored_age_queries(), options['repeat'])
+                new = self.benchmark(cursor, self.birth_date_queries(today), options['repeat'])
+            finally:
+                cursor.execute(f'DROP TABLE {TABLE}')
+
+        old_counts = [count for row in old['rows'] for count in row]
+        new_counts = list(new['rows'][0])
+        self.stdout.write(f"{'group':<8}{'stored age':>12}{'birth_date':>12}")
+        for (label, min_age, max_age), stored, actual in zip(ages.AGE_GROUPS, old_counts, new_counts):
+            self.stdout.write(f'{label:<8}{stored:>12,}{actual:>12,}')
+        self.stdout.write(f"stored age: {len(old['rows'])} queries, {old['seconds'] * 1000:.1f} ms")
+        self.stdout.write(f"birth_date: {len(new['rows'])} query, {new['seconds'] * 1000:.1f} ms")
+        # Lower bound: a customer moving up a group is one count too many in one and too few in another
+        moved = sum(abs(stored - actual) for stored, actual in zip(old_counts, new_counts)) // 2
+        self.stdout.write(self.style.SUCCESS(f'The stored age puts at least {moved:,} customers in the wrong group'))
+
+    def populate(self, cursor, options, today):
+        generator = random.Random(options['seed'])
+        entered_on = ages.years_before(today, options['stale_years'])
+        with transaction.atomic():
+            batch = []
+            for pk in range(1, options['rows'] + 1):
+                birth_date = age = None
+                # Like real data, some customers have no birth date
+                if generator.random() >= 0.05:
+                    birth_date = today - datetime.timedelta(days=generator.randint(0, 90 * 365))
+                    age = ages.age_on(birth_date, entered_on)
+                    age = age if age >= 0 else None
+                batch.append((pk, age, birth_date))
+                if len(batch) == 10_000:
+                    cursor.executemany(f'INSERT INTO {TABLE} (id, age, birth_date) VALUES (%s, %s, %s)', batch)
+                    batch = []
+            if batch:
+                cursor.executemany(f'INSERT INTO {TABLE} (id, age, birth_date) VALUES (%s, %s, %s)', batch)
+        # The indexes Customer.age would need and customer_birth_date_idx
+        cursor.execute(f'CREATE INDEX {TABLE}_age ON {TABLE} (age)')
+        cursor.execute(f'CREATE INDEX {TABLE}_birth_date ON {TABLE} (birth_date)')
+
+    def stored_age_queries(self):
+        """The old way: one COUNT per group on the stored age"""
+        queries = []
+        for label, min_age, max_age in ages.AGE_GROUPS:
+            if max_age is None:
+                queries.append((f'SELECT COUNT(*) FROM {TABLE} WHERE age >= %s', [min_age]))
+            else:
+                queries.append((f'SELECT COUNT(*) FROM {TABLE} WHERE age >= %s AND age <= %s', [min_age, max_age]))
+        return queries
+
+    def birth_date_queries(self, today):
+        """As accounts.ages.age_group_counts(): one statement, a birth_date range COUNT per group"""
+        subqueries, params = [], []
+        for label, min_age, max_age in ages.AGE_GROUPS:
+            earliest, latest = ages.birth_date_range(min_age, max_age, today)
+            if earliest is None:
+                subqueries.append(f'(SELECT COUNT(*) FROM {TABLE} WHERE birth_date <= %s)')
+                params.append(latest)
+            else:
+                subqueries.append(f'(SELECT COUNT(*) FROM {TABLE} WHERE birth_date > %s AND birth_date <= %s)')
+                params.extend([earliest, latest])
+        return [(f"SELECT {', '.join(subqueries)}", params)]
+
+    def benchmark(self, cursor, queries, repeat):
+        best = None
+        for run in range(repeat):
+            rows = []
+            started = time.perf_counter()
+            for sql, params in queries:
+                cursor.execute(sql, params)
+                rows.append(cursor.fetchone())
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return {'seconds': best, 'rows': rows}
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from accounts.images import generate_thumbnails, thumbnail_name
+from accounts.models import Customer, UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Generate photo thumbnails for existing customers and user profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing', action='store_true',
+                            help='Skip photos whose smallest thumbnail already exists')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        for model in (Customer, UserProfile):
+            photos = model.objects.exclude(photo='').exclude(photo__isnull=True).only('pk', 'photo').order_by()
+            generated = skipped = failed = 0
+            for obj in photos.iterator(chunk_size=options['batch_size']):
+                if options['missing'] and obj.photo.storage.exists(thumbnail_name(obj.photo.name, 40)):
+                    skipped += 1
+                    continue
+                try:
+                    generate_thumbnails(obj.photo)
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'{model._meta.model_name} {obj.pk} ({obj.photo.name}): {e}')
+                else:
+                    generated += 1
+                finally:
+                    obj.photo.close()
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}: {generated} generated, {skipped} skipped, {failed} failed'
+            )
+        self.stdout.write(self.style.SUCCESS('Thumbnails done'))
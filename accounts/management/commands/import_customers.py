@@ -0,0 +1,37 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.importers import CustomerImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Import customers from a CSV or XLSX file in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file with a header row of customer fields')
+        parser.add_argument('--dry-run', action='store_true', help='Validate every row without saving anything')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows validated and inserted per batch')
+        parser.add_argument('--report', help='Where to write the per-row error report (default: <path>.errors.csv)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not path.lower().endswith(('.csv', '.xlsx')):
+            raise CommandError('Only .csv and .xlsx files can be imported')
+        report_path = options['report'] or f'{path}.errors.csv'
+
+        with open(path, 'rb') as file, open(report_path, 'w', newline='', encoding='utf-8') as report:
+            importer = CustomerImporter(
+                batch_size=options['batch_size'],
+                dry_run=options['dry_run'],
+                report=report,
+            )
+            result = importer.run(read_rows(file, path))
+
+        verb = 'would be created' if result.dry_run else 'created'
+        self.stdout.write(f'{result.rows} rows read, {result.created} customers {verb}, {result.failed} failed')
+        if result.failed:
+            self.stdout.write(self.style.WARNING(f'Error report written to {report_path}'))
+        else:
+            os.remove(report_path)
+            self.stdout.write(self.style.SUCCESS('No errors'))
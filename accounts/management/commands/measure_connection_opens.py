@@ -0,0 +1,72 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+
+from crm.db.pool import pool_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Run simulated requests (one query each, with the request_started/request_finished '
+        'connection handling) and count the database connections they open'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--threads', type=int, default=1,
+                            help='Worker threads sharing the requests, like a threaded server')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        threads = max(options['threads'], 1)
+        connects = []
+
+        def count_connect(sender, connection, **kwargs):
+            if connection.alias == alias:
+                connects.append(1)
+
+        def serve(count):
+            for _ in range(count):
+                request_started.send(sender=self.__class__)
+                with connections[alias].cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                request_finished.send(sender=self.__class__)
+            connections[alias].close()
+
+        opened_before = pool_stats().get(alias, {}).get('opened', 0)
+        connection_created.connect(count_connect)
+        start = time.perf_counter()
+        try:
+            per_thread, extra = divmod(options['requests'], threads)
+            workers = [
+                threading.Thread(target=serve, args=(per_thread + (index < extra),))
+                for index in range(threads)
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            connection_created.disconnect(count_connect)
+        elapsed = time.perf_counter() - start
+
+        stats = pool_stats().get(alias)
+        # Pooled backends report physical opens, a checkout also sends connection_created
+        opened = stats['opened'] - opened_before if stats else len(connects)
+        settings_dict = connections[alias].settings_dict
+        self.stdout.write(
+            f"{options['requests']} requests on {alias!r} ({settings_dict['ENGINE']}, "
+            f"CONN_MAX_AGE={settings_dict['CONN_MAX_AGE']}, {threads} threads) in {elapsed:.2f}s: "
+            f"{len(connects)} connects, {opened} connections opened"
+        )
+        if options['requests']:
+            self.stdout.write(self.style.SUCCESS(
+                f"{opened * 1000 / options['requests']:.1f} connections opened per 1,000 requests"
+            ))
+        if stats:
+            self.stdout.write('Pool: ' + ', '.join(f'{name}={value}' for name, value in stats.items()))
@@ -0,0 +1,76 @@
+import os
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts import photos
+from accounts.models import Customer, StoredPhoto, UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Point customer and user photos with identical content at one file and delete the copies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the duplicates that would be merged')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        models = (Customer, UserProfile)
+        storage = Customer._meta.get_field('photo').storage
+        hashes = dict(StoredPhoto.objects.exclude(sha256='').values_list('name', 'sha256'))
+
+        computed = {}
+        names_by_hash = defaultdict(set)
+        failed = 0
+        for model in models:
+            names = model.objects.exclude(photo='').exclude(photo__isnull=True).order_by().values_list(
+                'photo', flat=True
+            ).distinct()
+            for name in names.iterator(chunk_size=options['batch_size']):
+                if name not in hashes:
+                    try:
+                        with storage.open(name) as file:
+                            hashes[name] = computed[name] = photos.content_hash(file)
+                    except OSError as e:
+                        failed += 1
+                        self.stderr.write(f'{model._meta.model_name} photo {name}: {e}')
+                        continue
+                names_by_hash[hashes[name]].add(name)
+
+        merged = freed = 0
+        copies = []
+        for digest, names in names_by_hash.items():
+            # Keep a content-addressed name when there is one
+            keep = min(names, key=lambda name: (os.path.splitext(os.path.basename(name))[0] != digest, name))
+            duplicates = sorted(names - {keep})
+            if not duplicates:
+                continue
+            merged += len(duplicates)
+            for name in duplicates:
+                freed += storage.size(name)
+            self.stdout.write(f'{keep}: {len(duplicates)} duplicates')
+            if not options['dry_run']:
+                with transaction.atomic():
+                    for model in models:
+                        model.objects.filter(photo__in=duplicates).update(photo=keep)
+                copies.extend(duplicates)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f'{merged} duplicate photos would be merged, {freed} bytes freed ({failed} unreadable)'
+            ))
+            return
+
+        photos.rebuild(models)
+        for name, digest in computed.items():
+            StoredPhoto.objects.filter(name=name).update(sha256=digest)
+        for name in copies:
+            # Still referenced when a row was pointed at it since the merge
+            if not StoredPhoto.objects.filter(name=name, references__gt=0).exists():
+                StoredPhoto.objects.filter(name=name).delete()
+                photos.delete_files(name, storage)
+        self.stdout.write(self.style.SUCCESS(
+            f'{merged} duplicate photos merged, {freed} bytes freed ({failed} unreadable)'
+        ))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import rollups
+from crm.dashboard import dashboard_cache
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the customer demographic rollups from the customer table, or check them for drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report counts that differ from the customer table and exit non-zero on drift',
+        )
+
+    def handle(self, *args, **options):
+        drift = rollups.find_drift()
+        for (dimension, value), (stored, actual) in sorted(drift.items()):
+            self.stdout.write(f'{dimension}={value!r}: stored {stored}, actual {actual}')
+
+        if options['check']:
+            if drift:
+                raise CommandError(f'{len(drift)} rollup counts have drifted')
+            self.stdout.write(self.style.SUCCESS('Customer rollups are up to date'))
+            return
+
+        counts = rollups.rebuild()
+        dashboard_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {len(counts)} customer rollups ({len(drift)} had drifted)'
+        ))
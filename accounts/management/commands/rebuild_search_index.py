@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from accounts import search
+from accounts.models import Customer, Tour
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the customer and tour search index from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        for kind, model in (('customer', Customer), ('tour', Tour)):
+            search.rebuild(kind, model.objects.all(), batch_size=options['batch_size'])
+            self.stdout.write(f'Indexed {model.objects.count()} {kind}s')
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt with {type(backend).__name__}'))
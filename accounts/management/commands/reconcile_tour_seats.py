@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from accounts.models import Booking, Tour
+
+
+class Command(BaseCommand):
+    help = 'Recount Tour.seats_booked from the bookings, or check it for drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report tours whose count differs from their bookings and exit non-zero on drift',
+        )
+
+    def handle(self, *args, **options):
+        booked = Booking.objects.filter(tour=OuterRef('pk')).order_by().values('tour').annotate(
+            seats=Sum('number_of_participants')
+        ).values('seats')
+        actual = Coalesce(Subquery(booked), Value(0))
+
+        drift = Tour.objects.annotate(actual=actual).exclude(seats_booked=actual).order_by('pk')
+        drifted = 0
+        for tour in drift.only('name', 'destination', 'seats_booked', 'max_participants'):
+            drifted += 1
+            over = ' (over capacity)' if tour.actual > tour.max_participants else ''
+            self.stdout.write(f'{tour}: stored {tour.seats_booked}, actual {tour.actual}{over}')
+
+        if options['check']:
+            if drifted:
+                raise CommandError(f'{drifted} tour seat counts have drifted')
+            self.stdout.write(self.style.SUCCESS('Tour seat counts are up to date'))
+            return
+
+        # Increments made meanwhile are part of the recount, not lost
+        Tour.objects.update(seats_booked=actual)
+        self.stdout.write(self.style.SUCCESS(f'Recounted tour seats ({drifted} had drifted)'))
@@ -0,0 +1,22 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from accounts import payments
+
+
+class Command(BaseCommand):
+    help = 'Add the daily payment ledger snapshots up to yesterday (run once a day), or rebuild them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--until', type=datetime.date.fromisoformat,
+                            help='Last day to snapshot (YYYY-MM-DD), yesterday by default')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Drop every snapshot and take them again from the ledger')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            added = payments.rebuild_snapshots(options['until'])
+        else:
+            added = payments.take_snapshots(options['until'])
+        self.stdout.write(self.style.SUCCESS(f'{added} daily snapshots added'))
@@ -0,0 +1,115 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:55
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Case, CharField, Count, Q, Value, When
+
+# Frozen copy of accounts.rollups as of this migration: the live module keeps
+# changing (age groups left the rollups in 0012) and must not change history.
+AGE_GROUPS = [
+    ("18-25", 18, 25),
+    ("26-35", 26, 35),
+    ("36-45", 36, 45),
+    ("46-55", 46, 55),
+    ("56+", 56, None),
+]
+
+
+def age_group_case():
+    whens = []
+    for label, min_age, max_age in AGE_GROUPS:
+        condition = Q(age__gte=min_age)
+        if max_age is not None:
+            condition &= Q(age__lte=max_age)
+        whens.append(When(condition, then=Value(label)))
+    return Case(*whens, default=None, output_field=CharField())
+
+
+def build_rollups(apps, schema_editor):
+    Customer = apps.get_model("accounts", "Customer")
+    CustomerRollup = apps.get_model("accounts", "CustomerRollup")
+
+    counts = Counter()
+    customers = Customer.objects.order_by()
+    for dimension in ("country", "city", "gender"):
+        for row in customers.values(dimension).annotate(count=Count("id")):
+            counts[(dimension, row[dimension])] = row["count"]
+    age_rows = (
+        customers.annotate(age_group=age_group_case())
+        .filter(age_group__isnull=False)
+        .values("age_group")
+        .annotate(count=Count("id"))
+    )
+    for row in age_rows:
+        counts[("age_group", row["age_group"])] = row["count"]
+
+    CustomerRollup.objects.all().delete()
+    CustomerRollup.objects.bulk_create(
+        [
+            CustomerRollup(dimension=dimension, value=value, count=count)
+            for (dimension, value), count in counts.items()
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0003_customer_emergency_contact_phone"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="customer",
+            name="photo",
+            field=models.ImageField(
+                blank=True,
+                null=True,
+                upload_to="customer_photos/",
+                verbose_name="Passport Image",
+            ),
+        ),
+        migrations.CreateModel(
+            name="CustomerRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "dimension",
+                    models.CharField(
+                        choices=[
+                            ("country", "Country"),
+                            ("city", "City"),
+                            ("gender", "Gender"),
+                            ("age_group", "Age Group"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("value", models.CharField(blank=True, max_length=100)),
+                ("count", models.IntegerField(default=0)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["dimension", "-count"], name="customer_rollup_top_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="customerrollup",
+            constraint=models.UniqueConstraint(
+                fields=("dimension", "value"), name="unique_customer_rollup"
+            ),
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:56
+
+import re
+
+from django.db import migrations, models
+
+
+def seed_sequences(apps, schema_editor):
+    Customer = apps.get_model("accounts", "Customer")
+    CustomerNumberSequence = apps.get_model("accounts", "CustomerNumberSequence")
+
+    pattern = re.compile(r"^cust-(\d{4})-(\d{2})-(\d+)$")
+    last_values = {}
+    numbers = Customer.objects.filter(customer_number__startswith="cust-").values_list(
+        "customer_number", flat=True
+    )
+    for number in numbers.iterator():
+        match = pattern.match(number)
+        if match:
+            key = (int(match.group(1)), int(match.group(2)))
+            last_values[key] = max(last_values.get(key, 0), int(match.group(3)))
+
+    CustomerNumberSequence.objects.bulk_create(
+        CustomerNumberSequence(year=year, month=month, last_value=last_value)
+        for (year, month), last_value in last_values.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0004_customerrollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CustomerNumberSequence",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("year", models.IntegerField()),
+                ("month", models.IntegerField()),
+                ("last_value", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="customernumbersequence",
+            constraint=models.UniqueConstraint(
+                fields=("year", "month"), name="unique_customer_number_sequence"
+            ),
+        ),
+        migrations.RunPython(seed_sequences, migrations.RunPython.noop),
+    ]
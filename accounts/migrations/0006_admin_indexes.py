@@ -0,0 +1,73 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0005_customernumbersequence"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(fields=["-booking_date"], name="booking_date_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(
+                fields=["payment_status", "-booking_date"], name="booking_status_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(
+                fields=["tour", "-booking_date"], name="booking_tour_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(fields=["-created_at"], name="customer_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(
+                fields=["country", "-created_at"], name="customer_country_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(
+                fields=["city", "-created_at"], name="customer_city_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(
+                fields=["gender", "-created_at"], name="customer_gender_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(
+                fields=["nationality", "-created_at"], name="customer_nationality_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tour",
+            index=models.Index(fields=["-start_date"], name="tour_start_date_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="tour",
+            index=models.Index(
+                fields=["status", "-start_date"], name="tour_status_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tour",
+            index=models.Index(
+                fields=["destination", "-start_date"], name="tour_destination_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,113 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:01
+
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Frozen copy of the accounts.search folding and indexing as of this
+# migration; the live module is free to change how it tokenizes.
+SEARCH_FIELDS = {
+    "customer": ["first_name", "last_name", "email", "phone", "customer_number", "passport_number"],
+    "tour": ["name", "destination"],
+}
+
+TRANSLITERATIONS = str.maketrans({
+    "ı": "i", "İ": "i", "ø": "o", "Ø": "o", "đ": "d", "Đ": "d", "ł": "l", "Ł": "l",
+    "æ": "ae", "Æ": "ae", "œ": "oe", "Œ": "oe", "ß": "ss",
+    "ʿ": "", "ʾ": "", "'": "", "’": "", "‘": "", "`": "",
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ة": "ه", "ى": "ي", "ؤ": "و", "ئ": "ي", "ـ": "",
+})
+
+MAX_TOKEN_LENGTH = 64
+
+FTS_KINDS = {"customer": 1, "tour": 2}
+
+
+def fold(text):
+    text = unicodedata.normalize("NFKD", str(text or "").translate(TRANSLITERATIONS))
+    return "".join(char for char in text if not unicodedata.combining(char)).casefold()
+
+
+def tokenize(text):
+    text = fold(text)
+    tokens = re.findall(r"\w+", text)
+    tokens += [word.replace("-", "") for word in re.findall(r"\w+(?:-\w+)+", text)]
+    return list(dict.fromkeys(token[:MAX_TOKEN_LENGTH] for token in tokens))
+
+
+def document(kind, obj):
+    return " ".join(str(getattr(obj, name) or "") for name in SEARCH_FIELDS[kind])
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS accounts_search_fts "
+            "USING fts5(kind UNINDEXED, object_id UNINDEXED, body)"
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS accounts_search_fts")
+
+
+def build_index(apps, schema_editor):
+    SearchToken = apps.get_model("accounts", "SearchToken")
+    backend = getattr(settings, "SEARCH_BACKEND", "auto")
+    use_fts = schema_editor.connection.vendor == "sqlite" and backend in ("auto", "accounts.search.FTS5Backend")
+
+    for kind, model_name in (("customer", "Customer"), ("tour", "Tour")):
+        objects = apps.get_model("accounts", model_name).objects.only("pk", *SEARCH_FIELDS[kind]).order_by()
+        for obj in objects.iterator(chunk_size=1000):
+            tokens = tokenize(document(kind, obj))
+            if use_fts:
+                schema_editor.execute(
+                    "INSERT INTO accounts_search_fts (rowid, kind, object_id, body) VALUES (%s, %s, %s, %s)",
+                    [obj.pk * 16 + FTS_KINDS[kind], kind, obj.pk, " ".join(tokens)],
+                )
+            else:
+                SearchToken.objects.bulk_create(
+                    [SearchToken(kind=kind, object_id=obj.pk, token=token) for token in tokens]
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0006_admin_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchToken",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("kind", models.CharField(max_length=20)),
+                ("object_id", models.BigIntegerField()),
+                ("token", models.CharField(max_length=64)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["kind", "token", "object_id"], name="search_token_idx"
+                    ),
+                    models.Index(
+                        fields=["kind", "object_id"], name="search_token_object_idx"
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+        migrations.RunPython(build_index, migrations.RunPython.noop),
+    ]
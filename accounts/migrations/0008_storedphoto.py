@@ -0,0 +1,57 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:24
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_references(apps, schema_editor):
+    # Frozen copy of accounts.photos.rebuild() as of this migration
+    StoredPhoto = apps.get_model("accounts", "StoredPhoto")
+    counts = Counter()
+    for model_name in ("Customer", "UserProfile"):
+        rows = (
+            apps.get_model("accounts", model_name)
+            .objects.exclude(photo="")
+            .exclude(photo__isnull=True)
+            .order_by()
+        )
+        counts.update(dict(rows.values_list("photo").annotate(count=Count("pk"))))
+    StoredPhoto.objects.bulk_create(
+        [StoredPhoto(name=name, references=count) for name, count in counts.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0007_searchtoken"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StoredPhoto",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("sha256", models.CharField(blank=True, max_length=64)),
+                ("references", models.IntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["sha256"], name="stored_photo_sha256_idx")
+                ],
+            },
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:38
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def count_booked_seats(apps, schema_editor):
+    Tour = apps.get_model("accounts", "Tour")
+    Booking = apps.get_model("accounts", "Booking")
+    booked = (
+        Booking.objects.filter(tour=OuterRef("pk")).order_by().values("tour")
+        .annotate(seats=Sum("number_of_participants")).values("seats")
+    )
+    Tour.objects.update(seats_booked=Coalesce(Subquery(booked), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0008_storedphoto"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tour",
+            name="seats_booked",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_booked_seats, migrations.RunPython.noop),
+    ]
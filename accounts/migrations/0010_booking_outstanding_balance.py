@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:42
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import F
+
+
+def compute_outstanding_balance(apps, schema_editor):
+    Booking = apps.get_model("accounts", "Booking")
+    Booking.objects.update(outstanding_balance=F("total_price") - F("amount_paid"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0009_tour_seats_booked"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="booking",
+            name="outstanding_balance",
+            field=models.DecimalField(
+                decimal_places=2, default=Decimal("0.00"), editable=False, max_digits=10
+            ),
+        ),
+        migrations.RunPython(compute_outstanding_balance, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(
+                fields=["-outstanding_balance"], name="booking_outstanding_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(
+                fields=["payment_status", "outstanding_balance", "amount_paid"],
+                name="booking_balance_idx",
+            ),
+        ),
+    ]
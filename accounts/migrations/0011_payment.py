@@ -0,0 +1,103 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def open_ledger(apps, schema_editor):
+    # amount_paid already includes these, only the ledger entries are added
+    Booking = apps.get_model("accounts", "Booking")
+    Payment = apps.get_model("accounts", "Payment")
+    bookings = Booking.objects.exclude(amount_paid=0).values_list("pk", "amount_paid", "booking_date")
+    batch = []
+    for pk, amount_paid, booking_date in bookings.iterator(chunk_size=2000):
+        batch.append(Payment(
+            booking_id=pk, amount=amount_paid, method="other", paid_at=booking_date, note="Opening balance",
+        ))
+        if len(batch) >= 2000:
+            Payment.objects.bulk_create(batch)
+            batch = []
+    Payment.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0010_booking_outstanding_balance"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PaymentSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(unique=True)),
+                ("total", models.DecimalField(decimal_places=2, max_digits=14)),
+            ],
+            options={
+                "ordering": ["-date"],
+            },
+        ),
+        migrations.CreateModel(
+            name="Payment",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("amount", models.DecimalField(decimal_places=2, max_digits=10)),
+                (
+                    "method",
+                    models.CharField(
+                        choices=[
+                            ("cash", "Cash"),
+                            ("card", "Card"),
+                            ("bank_transfer", "Bank transfer"),
+                            ("other", "Other"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("paid_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("note", models.CharField(blank=True, max_length=200)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "booking",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="payments",
+                        to="accounts.booking",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-paid_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["paid_at", "amount"], name="payment_paid_at_idx"
+                    ),
+                    models.Index(
+                        fields=["booking", "-paid_at"], name="payment_booking_idx"
+                    ),
+                    models.Index(
+                        fields=["method", "-paid_at"], name="payment_method_idx"
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
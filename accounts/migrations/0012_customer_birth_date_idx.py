@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:51
+
+from django.db import migrations, models
+
+
+def drop_age_group_rollups(apps, schema_editor):
+    # Stored-age counts; age groups are now computed from birth_date
+    CustomerRollup = apps.get_model("accounts", "CustomerRollup")
+    CustomerRollup.objects.filter(dimension="age_group").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0011_payment"),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_age_group_rollups, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="customerrollup",
+            name="dimension",
+            field=models.CharField(
+                choices=[
+                    ("country", "Country"),
+                    ("city", "City"),
+                    ("gender", "Gender"),
+                ],
+                max_length=20,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(fields=["birth_date"], name="customer_birth_date_idx"),
+        ),
+    ]
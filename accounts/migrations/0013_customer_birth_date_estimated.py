@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:28
+
+import datetime
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def estimated_birth_date(age, recorded_on):
+    # Frozen copy of accounts.ages.estimated_birth_date as backfill_birth_dates used it
+    try:
+        day = recorded_on.replace(year=recorded_on.year - age)
+    except ValueError:
+        day = recorded_on.replace(year=recorded_on.year - age, day=28)
+    return day - datetime.timedelta(days=182)
+
+
+def flag_backfilled(apps, schema_editor):
+    # Birth dates an earlier backfill_birth_dates run estimated are exactly its estimate
+    Customer = apps.get_model("accounts", "Customer")
+    rows = Customer.objects.filter(birth_date__isnull=False, age__isnull=False, age__lte=120)
+    estimated = [
+        pk
+        for pk, birth_date, age, created_at in rows.values_list("pk", "birth_date", "age", "created_at").iterator()
+        if birth_date == estimated_birth_date(age, timezone.localdate(created_at))
+    ]
+    for start in range(0, len(estimated), 1000):
+        Customer.objects.filter(pk__in=estimated[start:start + 1000]).update(birth_date_estimated=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0012_customer_birth_date_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customer",
+            name="birth_date_estimated",
+            field=models.BooleanField(
+                default=False,
+                help_text="Estimated from the age entered. Cleared when the birth date is edited.",
+                verbose_name="Birth date is estimated",
+            ),
+        ),
+        migrations.RunPython(flag_backfilled, migrations.RunPython.noop),
+    ]
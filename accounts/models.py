@@ -1,12 +1,58 @@
-from django.db import models
+from django.db import models, transaction
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models import F, Value
+from django.db.models.fields.files import FieldFile
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
+from collections import Counter
 from decimal import Decimal
+from crm.dashboard import dashboard_cache
+from . import images, payments, photos, rollups, search
+from .filters import filter_cache
+
+
+class TrackedFieldsMixin:
+    """Remember the database values of ``tracked_fields`` so saves can tell what changed"""
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.snapshot_tracked_fields()
+        return instance
+
+    def snapshot_tracked_fields(self):
+        # Read __dict__ directly so deferred fields are not loaded
+        self._loaded_values = {
+            name: self.__dict__[name] for name in self.tracked_fields if name in self.__dict__
+        }
+
+    def get_loaded_values(self):
+        """Tracked values as last read from or written to the database"""
+        values = getattr(self, '_loaded_values', {})
+        missing = [name for name in self.tracked_fields if name not in values]
+        if missing and self.pk is not None:
+            row = type(self)._base_manager.filter(pk=self.pk).values(*missing).first()
+            values = {**values, **(row or {})}
+        return values
+
+    def get_tracked_values(self):
+        values = {name: getattr(self, name) for name in self.tracked_fields}
+        # Files are compared by name, a FieldFile is renamed in place when saved
+        return {name: value.name if isinstance(value, FieldFile) else value for name, value in values.items()}
+
+    def get_changed_fields(self):
+        """Tracked fields whose value differs from the database"""
+        loaded = self.get_loaded_values()
+        return [name for name, value in self.get_tracked_values().items() if loaded.get(name) != value]
+
+
+class UserProfile(TrackedFieldsMixin, models.Model):
+    tracked_fields = ('photo', 'birth_date', 'phone', 'gender', 'status')
 
-
-class UserProfile(models.Model):
     GENDER_CHOICES = [
         ('M', 'Male'),
         ('F', 'Female'),
@@ -29,6 +75,29 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
+    def save(self, *args, **kwargs):
+        # Atomic like Customer.save: a photo reference claimed in pre_save is
+        # given back when the write fails
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        saved = {
+            name: value for name, value in self.get_tracked_values().items()
+            if update_fields is None or name in update_fields
+        }
+        self._loaded_values = {**getattr(self, '_loaded_values', {}), **saved}
+
+    def save_if_changed(self):
+        """Write only the tracked fields that changed; return whether anything was written"""
+        if self._state.adding:
+            self.save()
+            return True
+        changed = self.get_changed_fields()
+        if not changed:
+            return False
+        self.save(update_fields=[*changed, 'updated_at'])
+        return True
+
     class Meta:
         verbose_name = 'User Profile'
         verbose_name_plural = 'User Profiles'
@@ -41,12 +110,54 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    if hasattr(instance, 'profile'):
-        instance.profile.save()
+def save_user_profile(sender, instance, update_fields=None, **kwargs):
+    # Saves limited to some columns (login() updating last_login) never touch the
+    # profile, and a profile that was not loaded cannot have been changed
+    if update_fields is not None:
+        return
+    profile = User.profile.related.get_cached_value(instance, default=None)
+    if profile is not None:
+        profile.save_if_changed()
+
+
+class CustomerNumberSequence(models.Model):
+    """Last customer number handed out for each month"""
+    year = models.IntegerField()
+    month = models.IntegerField()
+    last_value = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.year}-{self.month:02d}: {self.last_value}"
+
+    @staticmethod
+    def format_number(year, month, value):
+        return f"cust-{year}-{month:02d}-{value}"
+
+    @classmethod
+    def allocate(cls, count=1, when=None):
+        """Reserve ``count`` consecutive customer numbers for the month of ``when``"""
+        when = timezone.localtime(when)
+        sequence = cls.objects.filter(year=when.year, month=when.month)
+        with transaction.atomic():
+            # The UPDATE takes the row lock, so the read below sees only our increment
+            if not sequence.update(last_value=F('last_value') + count):
+                cls.objects.get_or_create(year=when.year, month=when.month)
+                sequence.update(last_value=F('last_value') + count)
+            last_value = sequence.values_list('last_value', flat=True).get()
+        return [
+            cls.format_number(when.year, when.month, value)
+            for value in range(last_value - count + 1, last_value + 1)
+        ]
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['year', 'month'], name='unique_customer_number_sequence'),
+        ]
+
 
+class Customer(TrackedFieldsMixin, models.Model):
+    tracked_fields = (*rollups.TRACKED_FIELDS, 'photo')
 
-class Customer(models.Model):
     GENDER_CHOICES = [
         ('M', 'Male'),
         ('F', 'Female'),
@@ -84,6 +195,11 @@ class Customer(models.Model):
     identity_number = models.CharField(max_length=50)
     photo = models.ImageField(upload_to='customer_photos/', blank=True, null=True, verbose_name='Passport Image')
     birth_date = models.DateField(blank=True, null=True)
+    # Set by backfill_birth_dates: birth_date is a guess from the age entered
+    birth_date_estimated = models.BooleanField(
+        'Birth date is estimated', default=False,
+        help_text='Estimated from the age entered. Cleared when the birth date is edited.',
+    )
     birth_place = models.CharField(max_length=100, blank=True)
     mother_name = models.CharField(max_length=100, blank=True)
     father_name = models.CharField(max_length=100, blank=True)
@@ -93,6 +209,7 @@ class Customer(models.Model):
     emergency_contact_name = models.CharField(max_length=200, blank=True)
     emergency_contact_phone = models.CharField(max_length=20, blank=True)
     gender = models.CharField(max_length=1, choices=GENDER_CHOICES)
+    # As entered, never updated; age groups are computed from birth_date (accounts.ages)
     age = models.IntegerField(validators=[MinValueValidator(0)], blank=True, null=True)
 
     # Address Information
@@ -128,27 +245,38 @@ class Customer(models.Model):
         return f"{self.first_name} {self.last_name}"
 
     def save(self, *args, **kwargs):
-        # Auto-generate customer number if not provided
-        if not self.customer_number:
-            from datetime import datetime
-            now = datetime.now()
-            year = now.year
-            month = now.month
-
-            # Get the count of customers created in the current month
-            month_customers = Customer.objects.filter(
-                created_at__year=year,
-                created_at__month=month
-            ).count()
-
-            # Increment for the new customer
-            sequential_number = month_customers + 1
-
-            self.customer_number = f"cust-{year}-{month:02d}-{sequential_number}"
-        super().save(*args, **kwargs)
+        previous = None if self._state.adding else self.get_loaded_values()
+        update_fields = kwargs.get('update_fields')
+
+        with transaction.atomic():
+            # Auto-generate customer number if not provided
+            if not self.customer_number:
+                self.customer_number = CustomerNumberSequence.allocate()[0]
+            super().save(*args, **kwargs)
+            # Read after saving: an uploaded photo gets its stored name on save
+            current = self.get_tracked_values()
+            if previous is not None and update_fields is not None:
+                # Fields left out of update_fields keep their stored value
+                current = {name: current[name] if name in update_fields else previous[name] for name in current}
+            rollups.record_saved(previous, current)
+        self._loaded_values = current
 
     class Meta:
         ordering = ['-created_at']
+        # Changelist filters, each paired with the default -created_at ordering
+        indexes = [
+            models.Index(fields=['-created_at'], name='customer_created_idx'),
+            models.Index(fields=['country', '-created_at'], name='customer_country_idx'),
+            models.Index(fields=['city', '-created_at'], name='customer_city_idx'),
+            models.Index(fields=['gender', '-created_at'], name='customer_gender_idx'),
+            models.Index(fields=['nationality', '-created_at'], name='customer_nationality_idx'),
+            # Age groups are birth_date ranges (accounts.ages)
+            models.Index(fields=['birth_date'], name='customer_birth_date_idx'),
+        ]
+
+class TourCapacityError(ValidationError):
+    """A booking would take a tour over its max_participants"""
+
 
 class Tour(models.Model):
     STATUS_CHOICES = [
@@ -166,6 +294,10 @@ class Tour(models.Model):
     start_date = models.DateField()
     end_date = models.DateField()
     max_participants = models.IntegerField(validators=[MinValueValidator(1)])
+    # Sum of the bookings' number_of_participants, kept by Booking.save()/delete
+    seats_booked = models.IntegerField(default=0, editable=False)
+    # Owned by change_seats(), never written by save() on update
+    COUNTER_FIELDS = ('seats_booked',)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='scheduled')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -173,22 +305,130 @@ class Tour(models.Model):
     def __str__(self):
         return f"{self.name} - {self.destination}"
 
+    @property
+    def seats_available(self):
+        return self.max_participants - self.seats_booked
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            # Writing back the seats_booked loaded with this instance would undo
+            # bookings made since, and let the tour be overbooked
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+            kwargs['update_fields'] = [name for name in update_fields if name not in self.COUNTER_FIELDS]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def change_seats(cls, deltas):
+        """
+        Apply {tour_id: seats} to seats_booked, atomically refusing with
+        TourCapacityError any increase past max_participants.
+        """
+        with transaction.atomic():
+            # Sorted so concurrent bookings lock tour rows in the same order
+            for tour_id, seats in sorted(deltas.items()):
+                if not seats:
+                    continue
+                tours = cls.objects.filter(pk=tour_id)
+                if seats > 0:
+                    # Checked and incremented in one UPDATE, under the row lock
+                    tours = tours.filter(seats_booked__lte=F('max_participants') - seats)
+                if not tours.update(seats_booked=F('seats_booked') + seats) and seats > 0:
+                    tour = cls.objects.filter(pk=tour_id).first()
+                    if tour is not None:
+                        raise tour.capacity_error()
+
+    def capacity_error(self):
+        return TourCapacityError(
+            'Only %(available)s seats left on %(tour)s.',
+            code='capacity',
+            params={'available': max(self.seats_available, 0), 'tour': self},
+        )
+
     class Meta:
         ordering = ['-start_date']
+        indexes = [
+            models.Index(fields=['-start_date'], name='tour_start_date_idx'),
+            models.Index(fields=['status', '-start_date'], name='tour_status_idx'),
+            models.Index(fields=['destination', '-start_date'], name='tour_destination_idx'),
+        ]
+
+
+class SearchToken(models.Model):
+    """Folded word of a searchable object, used by accounts.search.TokenTableBackend"""
+    kind = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    token = models.CharField(max_length=64)
+
+    def __str__(self):
+        return f"{self.kind}:{self.object_id} {self.token}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'token', 'object_id'], name='search_token_idx'),
+            models.Index(fields=['kind', 'object_id'], name='search_token_object_idx'),
+        ]
+
+
+class StoredPhoto(models.Model):
+    """A customer or user photo file and the number of rows referencing it (accounts.photos)"""
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, blank=True)
+    references = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.references})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sha256'], name='stored_photo_sha256_idx'),
+        ]
+
+
+class CustomerRollup(models.Model):
+    """Customer count per demographic value, maintained by accounts.rollups"""
+    DIMENSION_CHOICES = [
+        ('country', 'Country'),
+        ('city', 'City'),
+        ('gender', 'Gender'),
+    ]
+
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    value = models.CharField(max_length=100, blank=True)
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.dimension}={self.value}: {self.count}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'value'], name='unique_customer_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['dimension', '-count'], name='customer_rollup_top_idx'),
+        ]
+
+class Booking(TrackedFieldsMixin, models.Model):
+    tracked_fields = ('tour_id', 'number_of_participants')
 
-class Booking(models.Model):
     PAYMENT_STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('partial', 'Partial'),
         ('paid', 'Paid'),
         ('refunded', 'Refunded'),
     ]
+    # Owned by the payment ledger (accounts.payments), never written by save() on update
+    LEDGER_FIELDS = ('amount_paid', 'outstanding_balance', 'payment_status')
 
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='bookings')
     tour = models.ForeignKey(Tour, on_delete=models.CASCADE, related_name='bookings')
     number_of_participants = models.IntegerField(validators=[MinValueValidator(1)])
     total_price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
     amount_paid = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    # total_price - amount_paid, kept by save() so it can be filtered, sorted and summed in SQL
+    outstanding_balance = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'), editable=False)
     payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS_CHOICES, default='pending')
     booking_date = models.DateTimeField(auto_now_add=True)
     notes = models.TextField(blank=True)
@@ -197,10 +437,231 @@ class Booking(models.Model):
 
     @property
     def accounts_receivable(self):
+        # Unset on the add form
+        if self.total_price is None:
+            return None
         return self.total_price - self.amount_paid
 
     def __str__(self):
         return f"{self.customer} - {self.tour.name}"
 
+    def clean(self):
+        # Friendly form error; save() is what actually refuses an overbooking
+        if self.tour_id is None or self.number_of_participants is None:
+            return
+        tour = Tour.objects.filter(pk=self.tour_id).first()
+        if tour is None:
+            return
+        seats = self.number_of_participants
+        if not self._state.adding:
+            loaded = self.get_loaded_values()
+            if loaded['tour_id'] == self.tour_id:
+                seats -= loaded['number_of_participants']
+        if seats > tour.seats_available:
+            raise ValidationError({'number_of_participants': tour.capacity_error()})
+
+    def save(self, *args, **kwargs):
+        previous = None if self._state.adding else self.get_loaded_values()
+        current = self.get_tracked_values()
+        update_fields = kwargs.get('update_fields')
+        repriced = False
+        opening = Decimal('0.00')
+        if previous is None:
+            # An amount paid when the booking is taken goes through the ledger as
+            # its opening entry, which also sets the status
+            opening, self.amount_paid, self.payment_status = self.amount_paid or opening, Decimal('0.00'), 'pending'
+            if self.total_price is not None:
+                self.outstanding_balance = self.total_price
+        else:
+            # The ledger columns are moved by payments.apply(); writing the values
+            # loaded with this instance back would undo payments recorded meanwhile
+            if update_fields is None:
+                update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+            update_fields = [name for name in update_fields if name not in self.LEDGER_FIELDS]
+            repriced = 'total_price' in update_fields
+            if repriced:
+                # Against the stored amount_paid, in the same UPDATE
+                self.outstanding_balance = Value(self.total_price) - F('amount_paid')
+                self.payment_status = payments.status_case(F('amount_paid'), Value(self.total_price))
+                update_fields += ['outstanding_balance', 'payment_status']
+            kwargs['update_fields'] = update_fields
+        if previous is not None and update_fields is not None:
+            current = {
+                name: current[name] if name in update_fields or name.removesuffix('_id') in update_fields else previous[name]
+                for name in current
+            }
+
+        seats = Counter()
+        if previous is not None:
+            seats[previous['tour_id']] -= previous['number_of_participants']
+        seats[current['tour_id']] += current['number_of_participants']
+        with transaction.atomic():
+            Tour.change_seats(seats)
+            super().save(*args, **kwargs)
+            if opening:
+                payments.record_payments([(self, opening)], 'other', note='Opening balance')
+            if repriced or opening:
+                self.refresh_from_db(fields=self.LEDGER_FIELDS)
+        self._loaded_values = current
+
     class Meta:
         ordering = ['-booking_date']
+        indexes = [
+            models.Index(fields=['-booking_date'], name='booking_date_idx'),
+            models.Index(fields=['payment_status', '-booking_date'], name='booking_status_idx'),
+            models.Index(fields=['tour', '-booking_date'], name='booking_tour_idx'),
+            # Amount owed sorting/filtering and the top debtors list
+            models.Index(fields=['-outstanding_balance'], name='booking_outstanding_idx'),
+            # Covers the dashboard's revenue and receivables aggregate
+            models.Index(fields=['payment_status', 'outstanding_balance', 'amount_paid'], name='booking_balance_idx'),
+        ]
+
+
+class Payment(models.Model):
+    """Append-only ledger entry; refunds and corrections are negative amounts (accounts.payments)"""
+    METHOD_CHOICES = [
+        ('cash', 'Cash'),
+        ('card', 'Card'),
+        ('bank_transfer', 'Bank transfer'),
+        ('other', 'Other'),
+    ]
+
+    # A booking with payments is kept, the ledger never loses entries
+    booking = models.ForeignKey(Booking, on_delete=models.PROTECT, related_name='payments')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    method = models.CharField(max_length=20, choices=METHOD_CHOICES)
+    paid_at = models.DateTimeField(default=timezone.now)
+    note = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.amount} ({self.get_method_display()}) - {self.booking_id}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Payments cannot be changed, record a correcting payment instead.')
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            payments.apply([self])
+
+    def delete(self, *args, **kwargs):
+        raise ValueError('Payments cannot be deleted, record a correcting payment instead.')
+
+    class Meta:
+        ordering = ['-paid_at']
+        indexes = [
+            models.Index(fields=['paid_at', 'amount'], name='payment_paid_at_idx'),
+            models.Index(fields=['booking', '-paid_at'], name='payment_booking_idx'),
+            models.Index(fields=['method', '-paid_at'], name='payment_method_idx'),
+        ]
+
+
+class PaymentSnapshot(models.Model):
+    """Running total of the payment ledger at the end of ``date``"""
+    date = models.DateField(unique=True)
+    total = models.DecimalField(max_digits=14, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.date}: {self.total}"
+
+    class Meta:
+        ordering = ['-date']
+
+
+@receiver(post_delete, sender=Booking)
+def release_booked_seats(sender, instance, **kwargs):
+    # Runs in the deletion transaction, also for bookings cascading from a customer
+    values = {**instance.get_tracked_values(), **getattr(instance, '_loaded_values', {})}
+    Tour.change_seats({values['tour_id']: -values['number_of_participants']})
+
+
+@receiver(pre_delete, sender=Customer)
+def remove_customer_from_rollups(sender, instance, **kwargs):
+    # pre_delete runs inside the deletion transaction while the row still exists
+    rollups.record_deleted(instance.get_loaded_values())
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=Tour)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_objects(sender._meta.model_name, [instance])
+
+
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=Tour)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.remove_objects(sender._meta.model_name, [instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Customer)
+@receiver([post_save, post_delete], sender=Tour)
+@receiver([post_save, post_delete], sender=Booking)
+def invalidate_dashboard_cache(sender, **kwargs):
+    # Bump after commit so a recompute never caches uncommitted data
+    transaction.on_commit(dashboard_cache.invalidate)
+
+
+@receiver([post_save, post_delete], sender=Customer)
+@receiver([post_save, post_delete], sender=Tour)
+@receiver([post_save, post_delete], sender=Booking)
+def invalidate_filter_lookups(sender, **kwargs):
+    transaction.on_commit(filter_cache.invalidate)
+
+
+@receiver(pre_save, sender=Customer)
+@receiver(pre_save, sender=UserProfile)
+def process_photo_upload(sender, instance, update_fields=None, raw=False, **kwargs):
+    instance._photo_upload = instance._photo_change = None
+    if raw or (update_fields is not None and 'photo' not in update_fields):
+        return
+    previous = None if instance._state.adding else instance.get_loaded_values().get('photo')
+    digest, claimed = '', False
+
+    # The upload is only reachable before FileField.pre_save commits it to storage
+    photo = instance.photo
+    if photo and not photo._committed:
+        normalized = images.normalize_upload(photo.file)
+        if normalized is not None:
+            instance.photo = normalized
+            photo = instance.photo
+        digest = photos.content_hash(photo.file)
+        # Counted before the row is written; Customer.save and UserProfile.save
+        # are atomic, so the count is rolled back with a failed write
+        stored_name = photos.claim(digest)
+        if stored_name is not None:
+            # Same content already stored: reference it instead of uploading
+            instance.photo = stored_name
+            claimed = True
+        else:
+            photo.name = photos.content_name(digest, photo.name)
+            # An upload that is not a readable image is stored as it is, without thumbnails
+            if normalized is not None:
+                instance._photo_upload = photo.file
+    instance._photo_change = (previous or None, digest, claimed)
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=UserProfile)
+def generate_photo_thumbnails(sender, instance, raw=False, **kwargs):
+    upload = getattr(instance, '_photo_upload', None)
+    instance._photo_upload = None
+    if upload is not None and not raw:
+        images.generate_thumbnails(instance.photo, source=upload)
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=UserProfile)
+def count_photo_references(sender, instance, raw=False, **kwargs):
+    change = getattr(instance, '_photo_change', None)
+    instance._photo_change = None
+    if change is not None and not raw:
+        previous, digest, claimed = change
+        photos.record_saved(previous, instance.photo.name or None, instance.photo.storage, digest, claimed)
+
+
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=UserProfile)
+def release_photo(sender, instance, **kwargs):
+    if instance.photo:
+        photos.release(instance.photo.name, instance.photo.storage)
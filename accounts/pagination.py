@@ -0,0 +1,199 @@
+"""
+Pagination for large admin changelists.
+
+EstimatedCountPaginator never counts a whole table: an unfiltered changelist
+takes the row estimate from the table statistics (MySQL, PostgreSQL) and a
+filtered one counts at most ADMIN_COUNT_CAP rows, shown as "10,000+".
+
+KeysetPaginationMixin pages a changelist on its default ordering with
+``after``/``before`` cursors (WHERE created_at < ... instead of OFFSET), so
+page 500 costs the same as page 1. Sorting by a column header falls back to
+numbered pages.
+"""
+from django.conf import settings
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ORDER_VAR
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from unfold.views import ChangeList
+
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+CURSOR_SEPARATOR = '~'
+
+
+def estimated_row_count(model, using='default'):
+    """Row count from the table statistics, or None when the database keeps none"""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                [table],
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    # PostgreSQL reports -1 for a table that was never analyzed
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator whose count is exact, estimated or capped (see ``count_label``)"""
+
+    def __init__(self, *args, count_cap=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_cap = count_cap or settings.ADMIN_COUNT_CAP
+        self.count_kind = 'exact'
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            # Small tables are counted exactly; InnoDB estimates are only rough
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.count_cap:
+                self.count_kind = 'estimate'
+                return estimate
+        count = queryset.values('pk').order_by()[:self.count_cap + 1].count()
+        if count > self.count_cap:
+            self.count_kind = 'capped'
+            return self.count_cap
+        return count
+
+    @property
+    def count_label(self):
+        count = self.count
+        if self.count_kind == 'estimate':
+            return f'~{count:,}'
+        if self.count_kind == 'capped':
+            return f'{count:,}+'
+        return f'{count:,}'
+
+
+class KeysetChangeList(ChangeList):
+    """ChangeList paged by cursors while the model admin's ``keyset_ordering`` applies"""
+    keyset = False
+    next_cursor = previous_cursor = None
+
+    def __init__(self, request, *args, **kwargs):
+        super().__init__(request, *args, **kwargs)
+        # Filter, search and sort links start again from the first page
+        for params in (self.params, getattr(self, 'filter_params', {})):
+            params.pop(AFTER_VAR, None)
+            params.pop(BEFORE_VAR, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(AFTER_VAR, None)
+        lookup_params.pop(BEFORE_VAR, None)
+        return lookup_params
+
+    @property
+    def keyset_fields(self):
+        """(field, descending) pairs of ``keyset_ordering``"""
+        fields = []
+        for name in self.model_admin.keyset_ordering:
+            field_name = name.lstrip('-')
+            field = self.opts.pk if field_name == 'pk' else self.opts.get_field(field_name)
+            fields.append((field_name, field, name.startswith('-')))
+        return fields
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, name) for name, field, descending in self.keyset_fields]
+        return CURSOR_SEPARATOR.join(
+            value.isoformat() if hasattr(value, 'isoformat') else str(value) for value in values
+        )
+
+    def cursor_filter(self, cursor, backwards=False):
+        """Rows after ``cursor`` in keyset order (before it when ``backwards``)"""
+        parts = cursor.split(CURSOR_SEPARATOR)
+        if len(parts) != len(self.keyset_fields):
+            raise IncorrectLookupParameters('Invalid cursor')
+        condition = Q()
+        equal = {}
+        for (name, field, descending), part in zip(self.keyset_fields, parts):
+            try:
+                value = field.to_python(part)
+            except ValidationError as e:
+                raise IncorrectLookupParameters(e)
+            lookup = 'lt' if descending != backwards else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def get_results(self, request):
+        self.keyset = bool(
+            self.model_admin.keyset_ordering
+            and ORDER_VAR not in self.params
+            and not self.show_all
+            and not self.list_editable
+        )
+        if not self.keyset:
+            return super().get_results(request)
+
+        ordering = list(self.model_admin.keyset_ordering)
+        after, before = request.GET.get(AFTER_VAR), request.GET.get(BEFORE_VAR)
+        if before:
+            reversed_ordering = [name[1:] if name.startswith('-') else f'-{name}' for name in ordering]
+            queryset = self.queryset.filter(self.cursor_filter(before, backwards=True)).order_by(*reversed_ordering)
+        elif after:
+            queryset = self.queryset.filter(self.cursor_filter(after)).order_by(*ordering)
+        else:
+            queryset = self.queryset.order_by(*ordering)
+
+        # One extra row tells whether there is a page beyond this one
+        rows = list(queryset[:self.list_per_page + 1])
+        has_more = len(rows) > self.list_per_page
+        rows = rows[:self.list_per_page]
+        if before:
+            rows.reverse()
+            has_previous, has_next = has_more, bool(rows)
+        else:
+            has_previous, has_next = bool(after and rows), has_more
+        self.previous_cursor = self.encode_cursor(rows[0]) if has_previous else None
+        self.next_cursor = self.encode_cursor(rows[-1]) if has_next else None
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = paginator.count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = rows
+        self.can_show_all = False
+        self.multi_page = has_previous or has_next
+        self.paginator = paginator
+
+    @property
+    def first_page_url(self):
+        return self.get_query_string()
+
+    @property
+    def previous_page_url(self):
+        return self.previous_cursor and self.get_query_string({BEFORE_VAR: self.previous_cursor})
+
+    @property
+    def next_page_url(self):
+        return self.next_cursor and self.get_query_string({AFTER_VAR: self.next_cursor})
+
+
+class KeysetPaginationMixin:
+    """
+    Opt-in for large changelists: estimated/capped counts and cursor pages on
+    ``keyset_ordering``, which must list non-null fields ending with a unique
+    one, e.g. ('-created_at', '-pk').
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    keyset_ordering = ()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
@@ -0,0 +1,176 @@
+"""
+Payment ledger and revenue snapshots.
+
+Payments are append-only: a correction or refund is a new (negative) entry;
+one that gives back everything paid marks the booking 'refunded'.
+Recording payments moves Booking.amount_paid, outstanding_balance and
+payment_status with F() increments in the same transaction, so concurrent
+payments on one booking never overwrite each other. Booking.save() leaves
+these columns out of its UPDATE for the same reason.
+
+PaymentSnapshot holds the running total of the ledger at the end of each day
+(the snapshot_payments command adds the days elapsed since the last one).
+revenue_between() reads the snapshot before each end of the range and sums
+only the payments after it. A payment dated on or before a snapshot day
+increments that snapshot and the later ones as it is recorded.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.db.models.lookups import GreaterThan, LessThanOrEqual
+from django.utils import timezone
+
+from crm.dashboard import dashboard_cache
+
+from .filters import filter_cache
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def status_case(paid, total=F('total_price'), refund=False):
+    """
+    payment_status of a booking that has ``paid`` of ``total`` (expressions), set
+    in the same UPDATE. A ``refund`` (negative entry) taking a booking that had
+    paid something back to nothing makes it 'refunded'.
+    """
+    whens = [
+        When(LessThanOrEqual(total, paid), then=Value('paid')),
+        When(GreaterThan(paid, 0), then=Value('partial')),
+        When(payment_status='refunded', then=Value('refunded')),
+    ]
+    if refund:
+        # amount_paid is still the amount before the refund
+        whens.append(When(amount_paid__gt=0, then=Value('refunded')))
+    return Case(*whens, default=Value('pending'))
+
+
+def record_payments(entries, method, paid_at=None, note=''):
+    """
+    Append a payment of ``amount`` to each booking of ``entries`` (booking,
+    amount) pairs, e.g. one per booking of a group tour. Returns the payments.
+    """
+    from .models import Payment
+
+    paid_at = paid_at or timezone.now()
+    payments = [
+        Payment(booking=booking, amount=amount, method=method, paid_at=paid_at, note=note)
+        for booking, amount in entries if amount
+    ]
+    with transaction.atomic():
+        Payment.objects.bulk_create(payments)
+        apply(payments)
+    return payments
+
+
+def apply(payments):
+    """Move the bookings and snapshots by the newly inserted ``payments``, in their transaction"""
+    from .models import Booking, PaymentSnapshot
+
+    # Bookings paying the same amount (a group tour) take one UPDATE
+    bookings_by_amount = defaultdict(list)
+    for payment in payments:
+        bookings_by_amount[payment.amount].append(payment.booking_id)
+    for amount, booking_ids in bookings_by_amount.items():
+        paid = F('amount_paid') + amount
+        Booking.objects.filter(pk__in=sorted(booking_ids)).update(
+            # First: MySQL evaluates SET left to right, so this reads the old amount_paid
+            payment_status=status_case(paid, refund=amount < 0),
+            amount_paid=paid,
+            outstanding_balance=F('outstanding_balance') - amount,
+        )
+
+    # Backdated payments change the running totals of the days already snapshotted.
+    # The lock take_snapshots() holds: a snapshot it is adding either counts these
+    # payments or is committed before we read the latest date
+    by_day = defaultdict(Decimal)
+    for payment in payments:
+        by_day[timezone.localdate(payment.paid_at)] += payment.amount
+    latest = PaymentSnapshot.objects.select_for_update().order_by('-date').values_list('date', flat=True).first()
+    if latest is not None:
+        for day, amount in sorted(by_day.items()):
+            if day <= latest:
+                PaymentSnapshot.objects.filter(date__gte=day).update(total=F('total') + amount)
+
+    # The bookings were updated without their save signals
+    transaction.on_commit(dashboard_cache.invalidate)
+    transaction.on_commit(filter_cache.invalidate)
+
+
+def ledger_total(start, end):
+    """Sum of the payments made from ``start`` (inclusive) to ``end`` (exclusive)"""
+    from .models import Payment
+
+    payments = Payment.objects.all()
+    if start is not None:
+        payments = payments.filter(paid_at__gte=start)
+    return payments.filter(paid_at__lt=end).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+
+
+def total_through(day):
+    """Running total of the ledger at the end of ``day``"""
+    from .models import PaymentSnapshot
+
+    snapshot = PaymentSnapshot.objects.filter(date__lte=day).order_by('-date').first()
+    if snapshot is None:
+        return ledger_total(None, start_of_day(day + datetime.timedelta(days=1)))
+    if snapshot.date == day:
+        return snapshot.total
+    # The tail since the snapshot, a range of payment_paid_at_idx
+    return snapshot.total + ledger_total(
+        start_of_day(snapshot.date + datetime.timedelta(days=1)),
+        start_of_day(day + datetime.timedelta(days=1)),
+    )
+
+
+def revenue_between(start, end):
+    """Payments received from day ``start`` through day ``end``, both inclusive"""
+    return total_through(end) - total_through(start - datetime.timedelta(days=1))
+
+
+def take_snapshots(until=None):
+    """
+    Snapshot every day after the latest snapshot through ``until`` (default
+    yesterday: today can still take payments). Returns the number added.
+    """
+    from .models import Payment, PaymentSnapshot
+
+    until = until or timezone.localdate() - datetime.timedelta(days=1)
+    with transaction.atomic():
+        latest = PaymentSnapshot.objects.select_for_update().order_by('-date').first()
+        if latest is None:
+            first = Payment.objects.order_by('paid_at').values_list('paid_at', flat=True).first()
+            if first is None:
+                return 0
+            day, total = timezone.localdate(first), Decimal('0.00')
+        else:
+            day, total = latest.date + datetime.timedelta(days=1), latest.total
+
+        # The days since the last snapshot in one grouped read of the ledger
+        daily = dict(
+            Payment.objects.filter(
+                paid_at__gte=start_of_day(day), paid_at__lt=start_of_day(until + datetime.timedelta(days=1)),
+            ).annotate(day=TruncDate('paid_at')).order_by().values('day').annotate(amount=Sum('amount'))
+            .values_list('day', 'amount')
+        )
+        snapshots = []
+        while day <= until:
+            total += daily.get(day, 0)
+            snapshots.append(PaymentSnapshot(date=day, total=total))
+            day += datetime.timedelta(days=1)
+        PaymentSnapshot.objects.bulk_create(snapshots)
+    return len(snapshots)
+
+
+def rebuild_snapshots(until=None):
+    """Drop the snapshots and take them again from the ledger"""
+    from .models import PaymentSnapshot
+
+    with transaction.atomic():
+        PaymentSnapshot.objects.all().delete()
+        return take_snapshots(until)
@@ -0,0 +1,128 @@
+"""
+Content-addressed storage of customer and user photos.
+
+An upload is stored under the SHA-256 of its (normalized) bytes
+("customer_photos/<sha256>.jpg"). Before writing, the digest is looked up in
+StoredPhoto: when the same scan is already stored - a re-edit, family members
+sharing a document photo, a re-import - the row points at the existing file
+and nothing is uploaded.
+
+StoredPhoto also counts the customer and profile rows referencing each file.
+Saves and deletes move references with F() expressions; a file and its
+thumbnails are deleted after commit, and only if its count is still zero at
+that point. Photos stored before this, and paths that bypass the model signals
+(queryset.update), are merged and recounted by the merge_duplicate_photos
+command.
+"""
+import hashlib
+import os
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .images import THUMBNAILS, thumbnail_name
+
+
+def content_hash(file):
+    """SHA-256 hex digest of ``file``, read in chunks"""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(64 * 1024), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def content_name(digest, name):
+    """File name for content ``digest``, keeping the extension of ``name``"""
+    return f'{digest}{os.path.splitext(name)[1].lower()}'
+
+
+def claim(digest):
+    """Name of a stored photo with this content after adding a reference to it, or None"""
+    from .models import StoredPhoto
+
+    for name in StoredPhoto.objects.filter(sha256=digest, references__gt=0).values_list('name', flat=True)[:1]:
+        # A count that dropped to zero meanwhile is being deleted, so it is not reused
+        if StoredPhoto.objects.filter(name=name, references__gt=0).update(references=F('references') + 1):
+            return name
+    return None
+
+
+def add_reference(name, digest=''):
+    from .models import StoredPhoto
+
+    rows = StoredPhoto.objects.filter(name=name)
+    if not rows.update(references=F('references') + 1):
+        StoredPhoto.objects.get_or_create(name=name, defaults={'sha256': digest})
+        rows.update(references=F('references') + 1)
+
+
+def release(name, storage):
+    """Drop a reference to ``name``; the file goes once nothing references it"""
+    from .models import StoredPhoto
+
+    if StoredPhoto.objects.filter(name=name, references__gt=0).update(references=F('references') - 1):
+        transaction.on_commit(lambda: delete_unreferenced(name, storage))
+
+
+def delete_unreferenced(name, storage):
+    from .models import StoredPhoto
+
+    # Conditional delete: a claim() since the release keeps the file
+    deleted, _ = StoredPhoto.objects.filter(name=name, references__lte=0).delete()
+    if deleted:
+        delete_files(name, storage)
+    return bool(deleted)
+
+
+def delete_files(name, storage):
+    storage.delete(name)
+    for key in THUMBNAILS:
+        storage.delete(thumbnail_name(name, key))
+
+
+def record_saved(previous, current, storage, digest='', claimed=False):
+    """
+    Move a row's reference from ``previous`` to ``current`` photo name (either
+    may be empty). ``claimed`` means claim() already counted ``current``.
+    """
+    if previous == current and not claimed:
+        return
+    with transaction.atomic():
+        if current and not claimed:
+            add_reference(current, digest)
+        if previous:
+            release(previous, storage)
+
+
+def count_references(models=None):
+    """Rows referencing each photo name, counted from the customer and profile tables"""
+    if models is None:
+        from .models import Customer, UserProfile
+        models = (Customer, UserProfile)
+
+    counts = Counter()
+    for model in models:
+        rows = model.objects.exclude(photo='').exclude(photo__isnull=True).order_by()
+        counts.update(dict(rows.values_list('photo').annotate(count=Count('pk'))))
+    return counts
+
+
+def rebuild(models=None, stored_photo_model=None):
+    """Reset every StoredPhoto count; returns the names nothing references any more"""
+    if stored_photo_model is None:
+        from .models import StoredPhoto as stored_photo_model
+
+    counts = count_references(models)
+    with transaction.atomic():
+        stored = set(stored_photo_model.objects.values_list('name', flat=True))
+        for name, count in counts.items():
+            if name in stored:
+                stored_photo_model.objects.filter(name=name).update(references=count)
+            else:
+                stored_photo_model.objects.create(name=name, references=count)
+        unreferenced = stored - set(counts)
+        stored_photo_model.objects.filter(name__in=unreferenced).update(references=0)
+    return unreferenced
@@ -0,0 +1,108 @@
+"""
+Customer demographic counts kept in CustomerRollup.
+
+Every customer counts once towards its country, city and gender. Age groups
+are not rolled up, they change as customers get older (see accounts.ages).
+Saves and deletes apply +1/-1 deltas with F() expressions so the dashboard
+reads a handful of rows instead of grouping the whole customer table.
+Paths that bypass Customer.save() (bulk_create, queryset.update) must call
+record_saved()/record_deleted() themselves or run rebuild_customer_rollups.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+
+TRACKED_FIELDS = ('country', 'city', 'gender')
+
+
+def rollup_keys(values):
+    """(dimension, value) pairs a customer with these field values counts towards"""
+    return [(dimension, values[dimension]) for dimension in TRACKED_FIELDS]
+
+
+def apply_deltas(deltas):
+    from .models import CustomerRollup
+
+    # Sorted so concurrent writers lock rows in the same order
+    for (dimension, value), delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        rows = CustomerRollup.objects.filter(dimension=dimension, value=value)
+        if not rows.update(count=F('count') + delta):
+            CustomerRollup.objects.get_or_create(dimension=dimension, value=value)
+            rows.update(count=F('count') + delta)
+
+
+def record_saved(previous, current):
+    """Move a customer's counts from ``previous`` values (None when created) to ``current``"""
+    deltas = Counter()
+    if previous is not None:
+        deltas.subtract(rollup_keys(previous))
+    deltas.update(rollup_keys(current))
+    apply_deltas(deltas)
+
+
+def record_created(values_list):
+    deltas = Counter()
+    for values in values_list:
+        deltas.update(rollup_keys(values))
+    apply_deltas(deltas)
+
+
+def record_deleted(values):
+    deltas = Counter()
+    deltas.subtract(rollup_keys(values))
+    apply_deltas(deltas)
+
+
+def count_customers(customer_model=None):
+    """Exact counts grouped straight from the customer table"""
+    if customer_model is None:
+        from .models import Customer as customer_model
+
+    counts = Counter()
+    customers = customer_model.objects.order_by()
+    for dimension in TRACKED_FIELDS:
+        for row in customers.values(dimension).annotate(count=Count('id')):
+            counts[(dimension, row[dimension])] = row['count']
+    return counts
+
+
+def stored_counts(rollup_model=None):
+    if rollup_model is None:
+        from .models import CustomerRollup as rollup_model
+
+    return Counter({
+        (row.dimension, row.value): row.count
+        for row in rollup_model.objects.filter(count__gt=0)
+    })
+
+
+def find_drift():
+    """{(dimension, value): (stored, actual)} for every count that disagrees"""
+    actual = count_customers()
+    stored = stored_counts()
+    return {
+        key: (stored[key], actual[key])
+        for key in set(actual) | set(stored)
+        if stored[key] != actual[key]
+    }
+
+
+def rebuild(customer_model=None, rollup_model=None):
+    if rollup_model is None:
+        from .models import CustomerRollup as rollup_model
+
+    with transaction.atomic():
+        # Locked before counting: a customer save in the meantime waits on its
+        # rollup rows and applies its delta over the rebuilt counts, instead of
+        # committing between the count and the rewrite and being lost
+        list(rollup_model.objects.select_for_update().values_list('pk', flat=True))
+        counts = count_customers(customer_model)
+        rollup_model.objects.all().delete()
+        rollup_model.objects.bulk_create([
+            rollup_model(dimension=dimension, value=value, count=count)
+            for (dimension, value), count in counts.items()
+        ])
+    return counts
@@ -0,0 +1,200 @@
+"""
+Indexed search for the admin changelists.
+
+Searchable text is folded (lowercase, accents and Turkish/Arabic letter
+variants removed) and split into words, so "Şükrü", "sukru" and "ŞÜKRÜ" or
+"ʿAbd al-Raḥman" and "abd alrahman" find the same customer. Every search term
+is a prefix match and all terms must match.
+
+Two backends maintain the index on save/delete:
+
+* FTS5Backend - an SQLite FTS5 virtual table, the default on SQLite.
+* TokenTableBackend - the SearchToken table with a (kind, token) B-tree
+  index, the default on other databases (MySQL in production).
+
+SEARCH_BACKEND may name either class (or another implementation) explicitly.
+"""
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+
+SEARCH_FIELDS = {
+    'customer': ['first_name', 'last_name', 'email', 'phone', 'customer_number', 'passport_number'],
+    'tour': ['name', 'destination'],
+}
+
+# Letters that do not decompose into a base letter plus combining marks
+TRANSLITERATIONS = str.maketrans({
+    'ı': 'i', 'İ': 'i', 'ø': 'o', 'Ø': 'o', 'đ': 'd', 'Đ': 'd', 'ł': 'l', 'Ł': 'l',
+    'æ': 'ae', 'Æ': 'ae', 'œ': 'oe', 'Œ': 'oe', 'ß': 'ss',
+    # Apostrophe-like marks used for ayn/hamza in Arabic transliterations
+    'ʿ': '', 'ʾ': '', "'": '', '’': '', '‘': '', '`': '',
+    # Arabic letter variants
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ة': 'ه', 'ى': 'ي', 'ؤ': 'و', 'ئ': 'ي', 'ـ': '',
+})
+
+MAX_TOKEN_LENGTH = 64
+
+
+def fold(text):
+    text = unicodedata.normalize('NFKD', str(text or '').translate(TRANSLITERATIONS))
+    # Dropping combining marks removes Latin accents and Arabic harakat alike
+    return ''.join(char for char in text if not unicodedata.combining(char)).casefold()
+
+
+def tokenize(text):
+    """Folded words of ``text``, plus joined forms of hyphenated words ("al-rahman" -> "alrahman")"""
+    text = fold(text)
+    tokens = re.findall(r'\w+', text)
+    tokens += [word.replace('-', '') for word in re.findall(r'\w+(?:-\w+)+', text)]
+    return list(dict.fromkeys(token[:MAX_TOKEN_LENGTH] for token in tokens))
+
+
+def query_terms(search_term):
+    """Search terms; a hyphenated term is looked up in its joined form only"""
+    return [
+        word.replace('-', '')[:MAX_TOKEN_LENGTH]
+        for word in re.findall(r'\w+(?:-\w+)*', fold(search_term))
+    ]
+
+
+def document(kind, obj):
+    return ' '.join(str(getattr(obj, name) or '') for name in SEARCH_FIELDS[kind])
+
+
+class TokenTableBackend:
+    """One SearchToken row per distinct word of each object"""
+
+    def index(self, kind, objects):
+        from .models import SearchToken
+
+        objects = list(objects)
+        SearchToken.objects.filter(kind=kind, object_id__in=[obj.pk for obj in objects]).delete()
+        SearchToken.objects.bulk_create([
+            SearchToken(kind=kind, object_id=obj.pk, token=token)
+            for obj in objects
+            for token in tokenize(document(kind, obj))
+        ])
+
+    def remove(self, kind, object_ids):
+        from .models import SearchToken
+
+        SearchToken.objects.filter(kind=kind, object_id__in=object_ids).delete()
+
+    def clear(self, kind):
+        from .models import SearchToken
+
+        SearchToken.objects.filter(kind=kind).delete()
+
+    def matching_ids(self, kind, terms):
+        from .models import SearchToken
+
+        ids = None
+        for term in terms:
+            if connection.vendor == 'sqlite':
+                # SQLite only uses an index for LIKE on NOCASE columns; a range works everywhere
+                prefix = Q(token__gte=term, token__lt=term + '\uffff')
+            else:
+                prefix = Q(token__istartswith=term)
+            term_ids = SearchToken.objects.filter(prefix, kind=kind).values('object_id')
+            ids = term_ids if ids is None else SearchToken.objects.filter(
+                prefix, kind=kind, object_id__in=ids
+            ).values('object_id')
+        return ids
+
+
+class FTS5Backend:
+    """SQLite FTS5 table created by migration 0007; rowids encode the kind"""
+    table = 'accounts_search_fts'
+    kinds = {'customer': 1, 'tour': 2}
+
+    def rowid(self, kind, object_id):
+        return object_id * 16 + self.kinds[kind]
+
+    def index(self, kind, objects):
+        rows = [(self.rowid(kind, obj.pk), kind, obj.pk, ' '.join(tokenize(document(kind, obj)))) for obj in objects]
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [row[:1] for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, kind, object_id, body) VALUES (%s, %s, %s, %s)', rows
+            )
+
+    def remove(self, kind, object_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {self.table} WHERE rowid = %s',
+                [(self.rowid(kind, object_id),) for object_id in object_ids],
+            )
+
+    def clear(self, kind):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE kind = %s', [kind])
+
+    def matching_ids(self, kind, terms):
+        match = 'body : (' + ' '.join(f'"{term}"*' for term in terms) + ')'
+        return RawSQL(
+            f'SELECT object_id FROM {self.table} WHERE {self.table} MATCH %s AND kind = %s',
+            [match, kind],
+        )
+
+
+def get_backend():
+    path = getattr(settings, 'SEARCH_BACKEND', 'auto')
+    if path == 'auto':
+        return FTS5Backend() if connection.vendor == 'sqlite' else TokenTableBackend()
+    return import_string(path)()
+
+
+def index_objects(kind, objects):
+    get_backend().index(kind, objects)
+
+
+def remove_objects(kind, object_ids):
+    get_backend().remove(kind, object_ids)
+
+
+def rebuild(kind, queryset, batch_size=1000):
+    backend = get_backend()
+    backend.clear(kind)
+    batch = []
+    for obj in queryset.only('pk', *SEARCH_FIELDS[kind]).order_by().iterator(chunk_size=batch_size):
+        batch.append(obj)
+        if len(batch) == batch_size:
+            backend.index(kind, batch)
+            batch = []
+    if batch:
+        backend.index(kind, batch)
+
+
+def search_queryset(queryset, lookups, search_term):
+    """
+    Filter ``queryset`` so every term of ``search_term`` prefix-matches one of
+    ``lookups``, a {field: kind} map such as {'pk': 'customer'}.
+    """
+    terms = query_terms(search_term)
+    backend = get_backend()
+    if len(lookups) == 1:
+        (field, kind), = lookups.items()
+        return queryset.filter(**{f'{field}__in': backend.matching_ids(kind, terms)})
+    for term in terms:
+        condition = Q()
+        for field, kind in lookups.items():
+            condition |= Q(**{f'{field}__in': backend.matching_ids(kind, [term])})
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+class IndexedSearchMixin:
+    """Route the changelist search box through the search index (``search_index`` = {field: kind})"""
+    search_index = {}
+
+    def get_search_results(self, request, queryset, search_term):
+        if not self.search_index or not query_terms(search_term):
+            return super().get_search_results(request, queryset, search_term)
+        return search_queryset(queryset, self.search_index, search_term), False
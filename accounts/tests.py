@@ -1,3 +1,1784 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from datetime import date, datetime
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.forms.models import model_to_dict
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from crm import routers
+from crm.cache import VersionedCache
+from crm.db.backends.sqlite3.base import DatabaseWrapper as PooledSQLiteWrapper
+from crm.db.pool import ConnectionPool, PooledDatabaseWrapperMixin, PoolTimeout, pool_stats
+from crm.dashboard import compute_dashboard_metrics, dashboard_cache, dashboard_callback
+from crm.lazyloads import LazyLoadError, forbid_lazy_loads
+from crm.routers import ReplicaRouter
+from crm.storage import SignedURLCacheStorage
+from . import ages, images, payments, photos, rollups, search
+from .admin import BookingAdmin, CustomerAdmin, TourAdmin
+from .filters import cached_lookups, filter_cache
+from .forms import CustomerAdminForm
+from .management.commands.audit_query_plans import Command as AuditQueryPlansCommand
+from .importers import CustomerImporter, read_rows
+from .models import Customer, CustomerNumberSequence, CustomerRollup, Payment, PaymentSnapshot, StoredPhoto, Tour, TourCapacityError, Booking, UserProfile
+
+
+def born(age):
+    """A birth date making someone ``age`` today"""
+    return ages.years_before(timezone.localdate(), age)
+
+
+def make_customer(index, **kwargs):
+    data = {
+        'first_name': f'First{index}',
+        'last_name': f'Last{index}',
+        'passport_number': f'P{index:06d}',
+        'identity_number': f'I{index:06d}',
+        'phone': f'+90555{index:06d}',
+        'email': f'customer{index}@example.com',
+        'gender': 'M' if index % 2 else 'F',
+        'birth_date': born(18 + (index * 7) % 50),
+        'country': 'Turkey' if index % 3 else 'Germany',
+        'city': 'Istanbul' if index % 4 else 'Berlin',
+    }
+    data.update(kwargs)
+    return Customer.objects.create(**data)
+
+
+def make_tour(index=1, **kwargs):
+    data = {
+        'name': f'Tour {index}',
+        'description': 'Description',
+        'destination': 'Cappadocia',
+        'duration_days': 3,
+        'price': Decimal('100.00'),
+        'start_date': date(2026, 5, 1),
+        'end_date': date(2026, 5, 4),
+        'max_participants': 50,
+    }
+    data.update(kwargs)
+    return Tour.objects.create(**data)
+
+
+def make_booking(customer, tour, **kwargs):
+    data = {
+        'number_of_participants': 1,
+        'total_price': Decimal('100.00'),
+    }
+    data.update(kwargs)
+    return Booking.objects.create(customer=customer, tour=tour, **data)
+
+
+class DashboardMetricsTests(TestCase):
+    # Customers 4, bookings 1, tours 1, revenue this month 4 (no snapshots yet)
+    DASHBOARD_QUERIES = 10
+
+    def populate(self, start, stop):
+        tour = make_tour(start, max_participants=2 * (stop - start))
+        for index in range(start, stop):
+            customer = make_customer(index)
+            make_booking(customer, tour, amount_paid=Decimal('40.00'), payment_status='partial')
+            make_booking(customer, tour, amount_paid=Decimal('100.00'), payment_status='paid')
+
+    def test_metrics_values(self):
+        tour = make_tour()
+        a = make_customer(1, age=20, birth_date=None, gender='M', country='Turkey', city='Izmir')
+        b = make_customer(2, age=30, birth_date=None, gender='F', country='Turkey', city='Izmir')
+        make_customer(3, age=60, birth_date=None, gender='F', country='Turkey', city='Berlin')
+        make_customer(4, age=10, birth_date=None, gender='F', country='Germany', city='Munich')
+        make_booking(a, tour, amount_paid=Decimal('100.00'), payment_status='paid')
+        make_booking(b, tour, total_price=Decimal('250.00'), amount_paid=Decimal('50.00'), payment_status='partial')
+        # Age groups come from birth dates; entered ages get one from the backfill
+        call_command('backfill_birth_dates', stdout=StringIO())
+
+        metrics = compute_dashboard_metrics()
+
+        self.assertEqual(metrics['dashboard_stats'], {
+            'total_customers': 4,
+            'total_tours': 1,
+            'total_revenue': '€100.00',
+            'accounts_receivable': '€200.00',
+        })
+        self.assertEqual(metrics['age_groups'], {'18-25': 1, '26-35': 1, '36-45': 0, '46-55': 0, '56+': 1})
+        self.assertEqual(metrics['gender_stats'], [{'gender': 'M', 'count': 1}, {'gender': 'F', 'count': 3}])
+        self.assertEqual(metrics['customers_by_country'][0], {'country': 'Turkey', 'count': 3})
+        self.assertEqual(metrics['customers_by_city'][0], {'city': 'Izmir', 'count': 2})
+
+    def test_metrics_query_count_is_constant(self):
+        self.populate(0, 3)
+        with self.assertNumQueries(self.DASHBOARD_QUERIES):
+            compute_dashboard_metrics()
+
+        self.populate(3, 33)
+        with self.assertNumQueries(self.DASHBOARD_QUERIES):
+            compute_dashboard_metrics()
+
+    def test_admin_index_query_count_is_constant(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+
+        self.populate(0, 2)
+        dashboard_cache.invalidate()
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.get('/admin/')
+        self.assertEqual(response.status_code, 200)
+
+        self.populate(2, 42)
+        dashboard_cache.invalidate()
+        with CaptureQueriesContext(connection) as large:
+            self.client.get('/admin/')
+        self.assertEqual(len(small), len(large))
+
+
+class DashboardCacheTests(TestCase):
+
+    def setUp(self):
+        dashboard_cache.cache.clear()
+
+    def test_cached_until_a_model_changes(self):
+        make_customer(1)
+        context = dashboard_callback(None, {})
+        self.assertEqual(context['dashboard_stats']['total_customers'], 1)
+
+        with self.assertNumQueries(0):
+            dashboard_callback(None, {})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_customer(2)
+        context = dashboard_callback(None, {})
+        self.assertEqual(context['dashboard_stats']['total_customers'], 2)
+
+    def test_invalidated_by_tour_and_booking_changes(self):
+        customer = make_customer(1)
+        dashboard_callback(None, {})
+        with self.captureOnCommitCallbacks(execute=True):
+            tour = make_tour()
+            spare = make_tour(2)
+        self.assertEqual(dashboard_callback(None, {})['dashboard_stats']['total_tours'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_booking(customer, tour, amount_paid=Decimal('100.00'), payment_status='paid')
+        self.assertEqual(dashboard_callback(None, {})['dashboard_stats']['total_revenue'], '€100.00')
+
+        # A tour whose bookings have payments is kept with the ledger
+        with self.captureOnCommitCallbacks(execute=True):
+            spare.delete()
+        self.assertEqual(dashboard_callback(None, {})['dashboard_stats']['total_tours'], 1)
+
+    def test_stale_value_served_while_another_worker_recomputes(self):
+        make_customer(1)
+        dashboard_callback(None, {})
+        dashboard_cache.invalidate()
+
+        # Simulate another worker holding the recompute lock for the new version
+        lock_key = dashboard_cache._key('metrics', 'lock', dashboard_cache.version())
+        dashboard_cache.cache.add(lock_key, 1)
+        with self.assertNumQueries(0):
+            context = dashboard_callback(None, {})
+        self.assertEqual(context['dashboard_stats']['total_customers'], 1)
+
+    def test_file_based_backend(self):
+        with tempfile.TemporaryDirectory() as location:
+            caches = {
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'files': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+            }
+            with override_settings(CACHES=caches, DASHBOARD_CACHE={'ALIAS': 'files'}):
+                cache = VersionedCache('test', 'DASHBOARD_CACHE')
+                calls = []
+                compute = lambda: calls.append(1) or len(calls)
+
+                self.assertEqual(cache.get_or_set('value', compute), 1)
+                self.assertEqual(cache.get_or_set('value', compute), 1)
+                cache.invalidate()
+                self.assertEqual(cache.get_or_set('value', compute), 2)
+
+
+class CustomerRollupTests(TestCase):
+
+    def counts(self, dimension):
+        return dict(CustomerRollup.objects.filter(dimension=dimension, count__gt=0).values_list('value', 'count'))
+
+    def test_create_edit_delete(self):
+        a = make_customer(1, country='Turkey', city='Izmir', gender='M')
+        make_customer(2, country='Turkey', city='Ankara', gender='F')
+        self.assertEqual(self.counts('country'), {'Turkey': 2})
+
+        a.country = 'Germany'
+        a.save()
+        self.assertEqual(self.counts('country'), {'Turkey': 1, 'Germany': 1})
+
+        a = Customer.objects.get(pk=a.pk)
+        a.city = 'Berlin'
+        a.country = 'Austria'
+        a.save(update_fields=['city'])
+        self.assertEqual(self.counts('country'), {'Turkey': 1, 'Germany': 1})
+        self.assertEqual(self.counts('city'), {'Berlin': 1, 'Ankara': 1})
+
+        Customer.objects.get(pk=a.pk).delete()
+        self.assertEqual(self.counts('country'), {'Turkey': 1})
+        self.assertEqual(self.counts('gender'), {'F': 1})
+        self.assertEqual(rollups.find_drift(), {})
+
+    def test_deferred_instance_fetches_previous_values(self):
+        customer = make_customer(1, country='Turkey')
+        customer = Customer.objects.only('id', 'first_name').get(pk=customer.pk)
+        customer.country = 'Germany'
+        customer.save()
+        self.assertEqual(self.counts('country'), {'Germany': 1})
+
+    def test_rebuild_command_fixes_drift(self):
+        make_customer(1, country='Turkey')
+        Customer.objects.update(country='Germany')
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_customer_rollups', '--check', stdout=StringIO())
+        call_command('rebuild_customer_rollups', stdout=StringIO())
+        self.assertEqual(self.counts('country'), {'Germany': 1})
+        call_command('rebuild_customer_rollups', '--check', stdout=StringIO())
+
+    def test_rebuild_counts_inside_its_transaction(self):
+        make_customer(1)
+        with CaptureQueriesContext(connection) as queries:
+            rollups.rebuild()
+        statements = [query['sql'] for query in queries]
+        savepoint = next(index for index, sql in enumerate(statements) if sql.startswith('SAVEPOINT'))
+        lock = next(index for index, sql in enumerate(statements) if 'FROM "accounts_customerrollup"' in sql)
+        count = next(index for index, sql in enumerate(statements) if 'FROM "accounts_customer" ' in sql)
+        self.assertLess(savepoint, lock)
+        self.assertLess(lock, count)
+
+
+class AgeGroupTests(TestCase):
+
+    def test_groups_follow_birth_dates(self):
+        today = date(2026, 10, 17)
+        for index, birth_date in enumerate([
+            date(2008, 10, 17),  # 18 today
+            date(2008, 10, 18),  # 18 tomorrow
+            date(1990, 10, 18),  # 35
+            date(1990, 10, 17),  # 36 today
+            date(1950, 1, 1),
+        ]):
+            make_customer(index, birth_date=birth_date, age=99)
+        make_customer(5, birth_date=None)
+
+        with self.assertNumQueries(1):
+            counts = ages.age_group_counts(today=today)
+        self.assertEqual(counts, {'18-25': 1, '26-35': 1, '36-45': 1, '46-55': 0, '56+': 1})
+        self.assertEqual(ages.age_group_counts(today=date(2026, 10, 18))['18-25'], 2)
+        self.assertEqual(ages.age_group_counts(Customer.objects.filter(birth_date__year=1950), today), {
+            '18-25': 0, '26-35': 0, '36-45': 0, '46-55': 0, '56+': 1,
+        })
+
+    def test_leap_day(self):
+        self.assertEqual(ages.years_before(date(2028, 2, 29), 18), date(2010, 2, 28))
+        self.assertEqual(ages.age_on(date(2008, 2, 29), date(2026, 2, 28)), 17)
+        self.assertEqual(ages.age_on(date(2008, 2, 29), date(2026, 3, 1)), 18)
+
+    def test_backfill_birth_dates(self):
+        customer = make_customer(1, birth_date=None, age=30)
+        make_customer(2, birth_date=date(1980, 5, 5), age=30)
+        make_customer(3, birth_date=None, age=None)
+        created = timezone.localdate(customer.created_at)
+
+        output = StringIO()
+        call_command('backfill_birth_dates', '--dry-run', stdout=output)
+        self.assertIn('1 customers would get', output.getvalue())
+        call_command('backfill_birth_dates', stdout=StringIO())
+
+        customer.refresh_from_db()
+        self.assertEqual(ages.age_on(customer.birth_date, created), 30)
+        self.assertEqual(
+            list(Customer.objects.order_by('pk').values_list('birth_date', 'birth_date_estimated'))[1:],
+            [(date(1980, 5, 5), False), (None, False)],
+        )
+        self.assertTrue(customer.birth_date_estimated)
+
+        # Shown on the form and in exports; entering the real date clears it
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        self.assertContains(self.client.get(f'/admin/accounts/customer/{customer.pk}/change/'), 'name="birth_date_estimated"')
+        rows = list(csv.reader(StringIO(b''.join(self.client.get('/admin/accounts/customer/export/csv/').streaming_content).decode('utf-8-sig'))))
+        column = rows[0].index('Birth Date Estimated')
+        self.assertEqual(sorted(row[column] for row in rows[1:]), ['False', 'False', 'True'])
+
+        form = CustomerAdminForm({**model_to_dict(customer, exclude=['photo']), 'birth_date': '1995-04-01'}, instance=customer)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        customer.refresh_from_db()
+        self.assertEqual((customer.birth_date, customer.birth_date_estimated), (date(1995, 4, 1), False))
+
+    def test_benchmark_command(self):
+        output = StringIO()
+        call_command('benchmark_age_groups', '--rows', '2000', '--repeat', '1', stdout=output)
+        self.assertIn('birth_date: 1 query', output.getvalue())
+
+
+class CustomerNumberSequenceTests(TestCase):
+
+    def test_customers_get_consecutive_numbers(self):
+        prefix = timezone.localtime().strftime('cust-%Y-%m-')
+        first = make_customer(1)
+        second = make_customer(2)
+        self.assertEqual(first.customer_number, f'{prefix}1')
+        self.assertEqual(second.customer_number, f'{prefix}2')
+
+        # Deleting a customer no longer makes the next insert reuse a number
+        first.delete()
+        self.assertEqual(make_customer(3).customer_number, f'{prefix}3')
+
+    def test_block_allocation_is_one_round_trip(self):
+        when = timezone.make_aware(datetime(2026, 3, 15))
+        self.assertEqual(CustomerNumberSequence.allocate(2, when), ['cust-2026-03-1', 'cust-2026-03-2'])
+        with CaptureQueriesContext(connection) as queries:
+            numbers = CustomerNumberSequence.allocate(500, when)
+        statements = [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(numbers[0], 'cust-2026-03-3')
+        self.assertEqual(numbers[-1], 'cust-2026-03-502')
+
+    def test_months_are_independent(self):
+        march = timezone.make_aware(datetime(2026, 3, 31))
+        april = timezone.make_aware(datetime(2026, 4, 1))
+        CustomerNumberSequence.allocate(5, march)
+        self.assertEqual(CustomerNumberSequence.allocate(1, april), ['cust-2026-04-1'])
+
+
+IMPORT_HEADER = 'First Name,Last Name,Passport Number,Identity Number,Phone,Email,Gender,Country,City,Birth Date,Is Student\n'
+
+
+def import_csv(*lines):
+    return (IMPORT_HEADER + ''.join(line + '\n' for line in lines)).encode()
+
+
+class CustomerImportTests(TestCase):
+
+    def run_import(self, data, filename='customers.csv', **kwargs):
+        report = StringIO()
+        result = CustomerImporter(report=report, **kwargs).run(read_rows(BytesIO(data), filename))
+        return result, report.getvalue().splitlines()
+
+    def test_valid_rows_are_bulk_created(self):
+        data = import_csv(
+            'Ali,Yilmaz,P1,I1,555,ali@example.com,Male,Turkey,Izmir,1990-01-31,yes',
+            'Ayse,Kaya,P2,I2,556,ayse@example.com,F,Turkey,Ankara,,no',
+        )
+        result, report = self.run_import(data)
+
+        self.assertEqual((result.rows, result.created, result.failed), (2, 2, 0))
+        ali = Customer.objects.get(email='ali@example.com')
+        self.assertEqual(ali.gender, 'M')
+        self.assertEqual(ali.birth_date, date(1990, 1, 31))
+        self.assertTrue(ali.is_student)
+        self.assertFalse(Customer.objects.get(email='ayse@example.com').is_student)
+        self.assertEqual(
+            sorted(Customer.objects.values_list('customer_number', flat=True)),
+            [timezone.localtime().strftime('cust-%Y-%m-') + n for n in '12'],
+        )
+        self.assertEqual(rollups.find_drift(), {})
+
+    def test_reimported_mixed_case_email_is_a_failed_row(self):
+        data = import_csv('Ann,Lee,P1,I1,555,Ann@Example.com,F,Turkey,Izmir,,')
+        self.run_import(data)
+
+        result, report = self.run_import(import_csv('Ann,Lee,P1,I1,555,Ann@Example.com,F,Turkey,Izmir,,'))
+        self.assertEqual((result.created, result.failed), (0, 1))
+        self.assertIn('already exists', report[1])
+        self.assertEqual(Customer.objects.count(), 1)
+
+    def test_invalid_and_duplicate_rows_are_reported(self):
+        make_customer(1, email='taken@example.com')
+        data = import_csv(
+            'Ali,Yilmaz,P1,I1,555,taken@example.com,M,Turkey,Izmir,,',
+            'Ayse,Kaya,P2,I2,556,not-an-email,F,Turkey,Ankara,,',
+            'Can,Demir,P3,I3,557,can@example.com,X,Turkey,Bursa,,',
+            'Can,Demir,P3,I3,557,new@example.com,M,Turkey,Bursa,,',
+            'Can,Demir,P3,I3,557,NEW@example.com,M,Turkey,Bursa,,',
+        )
+        result, report = self.run_import(data, batch_size=2)
+
+        self.assertEqual((result.rows, result.created, result.failed), (5, 1, 4))
+        self.assertEqual(report[0], 'row,email,errors')
+        self.assertEqual([line.split(',')[0] for line in report[1:]], ['2', '3', '4', '6'])
+        self.assertIn('already exists', report[1])
+        self.assertIn('gender', report[3])
+
+    def test_dry_run_saves_nothing(self):
+        data = import_csv(
+            'Ali,Yilmaz,P1,I1,555,ali@example.com,M,Turkey,Izmir,,',
+            'Ali,Yilmaz,P1,I1,555,ali@example.com,M,Turkey,Izmir,,',
+        )
+        result, report = self.run_import(data, dry_run=True, batch_size=1)
+        self.assertEqual((result.created, result.failed), (1, 1))
+        self.assertFalse(Customer.objects.exists())
+
+    def test_query_count_per_batch_does_not_depend_on_rows(self):
+        def rows(count):
+            return import_csv(*(
+                f'First,Last,P{i},I{i},555,batch{count}-{i}@example.com,M,Turkey,Izmir,,' for i in range(count)
+            ))
+
+        # Creates the rollup rows and the month's sequence
+        self.run_import(rows(1), batch_size=100)
+
+        with CaptureQueriesContext(connection) as small:
+            self.run_import(rows(5), batch_size=100)
+        with CaptureQueriesContext(connection) as large:
+            # Stays under SQLite's bound-parameter limit so bulk_create is one INSERT
+            self.run_import(rows(20), batch_size=100)
+        self.assertEqual(len(small), len(large))
+
+    def test_xlsx(self):
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['first_name', 'last_name', 'passport_number', 'identity_number', 'phone', 'email',
+                      'gender', 'country', 'city', 'birth_date'])
+        sheet.append(['Ali', 'Yilmaz', 'P1', 'I1', 905551112233, 'ali@example.com', 'M', 'Turkey', 'Izmir',
+                      datetime(1990, 1, 31)])
+        data = BytesIO()
+        workbook.save(data)
+
+        result, report = self.run_import(data.getvalue(), filename='customers.xlsx')
+        self.assertEqual(result.created, 1)
+        customer = Customer.objects.get()
+        self.assertEqual(customer.phone, '905551112233')
+        self.assertEqual(customer.birth_date, date(1990, 1, 31))
+
+    def test_admin_upload_and_report_download(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+
+        upload = SimpleUploadedFile('customers.csv', import_csv(
+            'Ali,Yilmaz,P1,I1,555,ali@example.com,M,Turkey,Izmir,,',
+            'Ayse,Kaya,P2,I2,556,broken,F,Turkey,Ankara,,',
+        ))
+        response = self.client.post('/admin/accounts/customer/import/', {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['result'].created, 1)
+
+        token = response.context['report_token']
+        response = self.client.get(f'/admin/accounts/customer/import/report/{token}/')
+        self.assertIn(b'broken', b''.join(response.streaming_content))
+
+
+@override_settings(EXPORT_CHUNK_SIZE=2)
+class ExportTests(TestCase):
+
+    def setUp(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+
+    def read_csv(self, response):
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        return list(csv.reader(StringIO(content)))
+
+    def test_customer_export_respects_filters(self):
+        for index in range(5):
+            make_customer(index, country='Germany' if index % 2 else 'Turkey')
+
+        rows = self.read_csv(self.client.get('/admin/accounts/customer/export/csv/?country=Turkey'))
+        self.assertEqual(rows[0][:3], ['Customer Number', 'First Name', 'Last Name'])
+        self.assertEqual(sorted(row[1] for row in rows[1:]), ['First0', 'First2', 'First4'])
+
+    def test_booking_export_selects_joined_columns_in_chunks(self):
+        tour = make_tour(name='Cappadocia Balloons')
+        for index in range(5):
+            make_booking(make_customer(index), tour, amount_paid=Decimal('100.00') if index < 3 else 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            rows = self.read_csv(self.client.get('/admin/accounts/booking/export/csv/?payment_status__exact=paid'))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][3], 'Cappadocia Balloons')
+        selects = [query['sql'] for query in queries if 'accounts_booking' in query['sql']]
+        # Two full chunks, one partial and the empty one that ends the export
+        self.assertEqual(len(selects), 3)
+        self.assertNotIn('"accounts_booking"."notes"', selects[0])
+
+    def test_changelist_buttons_keep_active_filters(self):
+        response = self.client.get('/admin/accounts/customer/?country=Turkey')
+        self.assertContains(response, '/admin/accounts/customer/export/csv/?country=Turkey')
+        response = self.client.get('/admin/accounts/booking/')
+        self.assertContains(response, '/admin/accounts/booking/export/xlsx/')
+
+    def test_export_action_and_xlsx(self):
+        from openpyxl import load_workbook
+
+        customers = [make_customer(index) for index in range(3)]
+        response = self.client.post('/admin/accounts/customer/', {
+            'action': 'export_xlsx',
+            '_selected_action': [customers[0].pk, customers[2].pk],
+        })
+        self.assertEqual(response.status_code, 200)
+        workbook = load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True)
+        names = [row[1] for row in workbook.active.iter_rows(min_row=2, values_only=True)]
+        self.assertEqual(sorted(names), ['First0', 'First2'])
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_xlsx_is_streamed_while_rows_are_read(self):
+        from openpyxl import load_workbook
+
+        for index in range(5):
+            make_customer(index, last_name=f'Last{index} <&>\x07')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/accounts/customer/export/xlsx/')
+        self.assertFalse([query for query in queries if '"accounts_customer"."first_name"' in query['sql']])
+
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 2)
+        workbook = load_workbook(BytesIO(b''.join(chunks)), read_only=True)
+        rows = list(workbook.active.iter_rows(values_only=True))
+        self.assertEqual(rows[0][:3], ('Customer Number', 'First Name', 'Last Name'))
+        self.assertEqual(sorted(row[1] for row in rows[1:]), [f'First{index}' for index in range(5)])
+        self.assertIn('Last0 <&>', [row[2] for row in rows])
+
+
+class QueryPlanAuditTests(TestCase):
+
+    def test_changelists_and_filters_use_indexes(self):
+        tour = make_tour()
+        for index in range(3):
+            make_booking(make_customer(index), tour)
+
+        output = StringIO()
+        call_command('audit_query_plans', '--ignore-table', 'auth_user', '--ignore-table', 'auth_group', stdout=output)
+        flagged = [line for line in output.getvalue().splitlines() if 'FULL SCAN' in line]
+
+        self.assertTrue(flagged)
+        for line in flagged:
+            self.assertNotIn('changelist', line)
+            self.assertNotIn('filter', line)
+
+    def test_filter_values_are_url_decoded(self):
+        filter_cache.invalidate()
+        make_tour(destination='Kapadokya Göreme')
+        model_admin = TourAdmin(Tour, admin.site)
+        scenarios = {name: params for name, path, params in AuditQueryPlansCommand().changelist_scenarios(model_admin)}
+
+        self.assertEqual(scenarios['tour filter destination'], {'destination': ['Kapadokya Göreme']})
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        self.sukru = make_customer(1, first_name='Şükrü', last_name='Öztürk', passport_number='U12345678')
+        self.abd = make_customer(2, first_name='ʿAbd al-Raḥman', last_name='Al-Ḥusaynī')
+        self.ilker = make_customer(3, first_name='İlker', last_name='Işık')
+
+    def changelist_ids(self, path, term):
+        response = self.client.get(path, {'q': term})
+        return {obj.pk for obj in response.context['cl'].result_list}
+
+    def test_folding(self):
+        self.assertEqual(search.tokenize('ŞÜKRÜ Işık'), ['sukru', 'isik'])
+        self.assertEqual(search.tokenize('ʿAbd al-Raḥman'), ['abd', 'al', 'rahman', 'alrahman'])
+        self.assertEqual(search.fold('أحمد'), search.fold('احمد'))
+
+    def test_customer_search(self):
+        path = '/admin/accounts/customer/'
+        self.assertEqual(self.changelist_ids(path, 'sukru'), {self.sukru.pk})
+        self.assertEqual(self.changelist_ids(path, 'ŞÜKR özt'), {self.sukru.pk})
+        self.assertEqual(self.changelist_ids(path, 'abd alrahman'), {self.abd.pk})
+        self.assertEqual(self.changelist_ids(path, 'al-husayni'), {self.abd.pk})
+        self.assertEqual(self.changelist_ids(path, 'ilker isik'), {self.ilker.pk})
+        self.assertEqual(self.changelist_ids(path, 'u1234'), {self.sukru.pk})
+        self.assertEqual(self.changelist_ids(path, self.ilker.customer_number), {self.ilker.pk})
+        self.assertEqual(self.changelist_ids(path, 'nobody'), set())
+
+    def test_index_follows_saves_and_deletes(self):
+        path = '/admin/accounts/customer/'
+        self.sukru.first_name = 'Mehmet'
+        self.sukru.save()
+        self.assertEqual(self.changelist_ids(path, 'sukru'), set())
+        self.assertEqual(self.changelist_ids(path, 'mehm'), {self.sukru.pk})
+
+        self.sukru.delete()
+        self.assertEqual(self.changelist_ids(path, 'mehm'), set())
+
+    def test_booking_search_matches_customer_or_tour(self):
+        tour = make_tour(name='Kapadokya Balon')
+        booking = make_booking(self.sukru, tour)
+        make_booking(self.ilker, make_tour(2, name='Efes'))
+
+        path = '/admin/accounts/booking/'
+        self.assertEqual(self.changelist_ids(path, 'kapadokya'), {booking.pk})
+        self.assertEqual(self.changelist_ids(path, 'sukru balon'), {booking.pk})
+
+    @override_settings(SEARCH_BACKEND='accounts.search.TokenTableBackend')
+    def test_token_table_backend(self):
+        call_command('rebuild_search_index', stdout=StringIO())
+        path = '/admin/accounts/customer/'
+        self.assertEqual(self.changelist_ids(path, 'sukru ozt'), {self.sukru.pk})
+        self.assertEqual(self.changelist_ids(path, 'al-rahman'), {self.abd.pk})
+        self.assertEqual(self.changelist_ids(path, 'ilk'), {self.ilker.pk})
+
+    def test_imported_customers_are_indexed(self):
+        CustomerImporter().run(read_rows(BytesIO(import_csv(
+            'Gökhan,Çelik,P9,I9,555,gokhan@example.com,M,Turkey,Izmir,,',
+        )), 'customers.csv'))
+        customer = Customer.objects.get(email='gokhan@example.com')
+        self.assertEqual(self.changelist_ids('/admin/accounts/customer/', 'gokhan celik'), {customer.pk})
+
+
+@mock.patch.object(CustomerAdmin, 'list_per_page', 3)
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        self.customers = [make_customer(i) for i in range(10)]
+        # Equal timestamps must be ordered by pk across page boundaries
+        Customer.objects.filter(pk__in=[c.pk for c in self.customers[3:7]]).update(
+            created_at=timezone.make_aware(datetime(2026, 1, 1, 12, 0))
+        )
+        self.expected = list(Customer.objects.order_by('-created_at', '-pk').values_list('pk', flat=True))
+
+    def get(self, query_string='?'):
+        response = self.client.get('/admin/accounts/customer/' + query_string)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def test_walk_forwards_and_backwards(self):
+        cl = self.get()
+        self.assertTrue(cl.keyset)
+        pages = [[obj.pk for obj in cl.result_list]]
+        while cl.next_cursor:
+            cl = self.get(cl.next_page_url)
+            pages.append([obj.pk for obj in cl.result_list])
+        self.assertEqual([pk for page in pages for pk in page], self.expected)
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 1])
+
+        for page in reversed(pages[:-1]):
+            cl = self.get(cl.previous_page_url)
+            self.assertEqual([obj.pk for obj in cl.result_list], page)
+        self.assertIsNone(cl.previous_cursor)
+
+    def test_deep_page_does_not_use_offset(self):
+        cl = self.get()
+        cl = self.get(cl.next_page_url)
+        with CaptureQueriesContext(connection) as queries:
+            cl = self.get(cl.next_page_url)
+        self.assertFalse([q['sql'] for q in queries if 'OFFSET' in q['sql'] and 'accounts_customer' in q['sql']])
+        self.assertEqual([obj.pk for obj in cl.result_list], self.expected[6:9])
+
+    def test_filter_links_drop_the_cursor(self):
+        cl = self.get()
+        cl = self.get(cl.next_page_url + '&gender__exact=M')
+        self.assertNotIn('after=', cl.get_query_string({'gender__exact': 'F'}))
+        self.assertTrue(all(obj.gender == 'M' for obj in cl.result_list))
+
+    def test_column_sort_falls_back_to_numbered_pages(self):
+        cl = self.get('?o=3&p=2')
+        self.assertFalse(cl.keyset)
+        self.assertEqual(cl.page_num, 2)
+        self.assertEqual(len(cl.result_list), 3)
+
+    def test_invalid_cursor_redirects(self):
+        response = self.client.get('/admin/accounts/customer/?after=nonsense')
+        self.assertRedirects(response, '/admin/accounts/customer/?e=1')
+
+    @override_settings(ADMIN_COUNT_CAP=5)
+    def test_count_is_capped(self):
+        cl = self.get('?country__exact=Turkey')
+        self.assertEqual(cl.paginator.count_label, '5+')
+        cl = self.get('?country__exact=Germany')
+        self.assertEqual(cl.paginator.count_label, '4')
+        response = self.client.get('/admin/accounts/customer/?country__exact=Turkey')
+        self.assertContains(response, '5+')
+
+
+class FilterLookupTests(TestCase):
+
+    def setUp(self):
+        filter_cache.invalidate()
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        self.customers = [make_customer(i) for i in range(6)]
+
+    def filter_choices(self, title, query_string=''):
+        response = self.client.get('/admin/accounts/customer/' + query_string)
+        cl = response.context['cl']
+        spec = next(spec for spec in cl.filter_specs if spec.title == title)
+        return [choice['display'] for choice in spec.choices(cl)][1:]
+
+    def test_options_are_cached_with_counts(self):
+        self.assertEqual(self.filter_choices('country'), ['Germany (2)', 'Turkey (4)'])
+        self.assertEqual(self.filter_choices('Sezon'), [f'{timezone.localdate().year} (6)'])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/admin/accounts/customer/')
+        self.assertFalse([q['sql'] for q in queries if 'DISTINCT' in q['sql'] or 'GROUP BY' in q['sql']])
+
+    def test_invalidated_by_model_changes(self):
+        self.assertEqual(self.filter_choices('city'), ['Berlin (2)', 'Istanbul (4)'])
+        with self.captureOnCommitCallbacks(execute=True):
+            make_customer(6, city='Ankara')
+        self.assertEqual(self.filter_choices('city'), ['Ankara (1)', 'Berlin (2)', 'Istanbul (4)'])
+
+    @override_settings(FILTER_LOOKUP_CACHE={'COUNTS': False})
+    def test_counts_can_be_turned_off(self):
+        self.assertEqual(self.filter_choices('country'), ['Germany', 'Turkey'])
+
+    def test_tour_filter_uses_exists(self):
+        tour = make_tour(name='Efes')
+        make_booking(self.customers[0], tour)
+        make_booking(self.customers[0], tour)
+        make_booking(self.customers[1], tour)
+        self.assertEqual(self.filter_choices('Tur'), ['Efes (2)'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/accounts/customer/', {'tour': tour.pk})
+        self.assertEqual({obj.pk for obj in response.context['cl'].result_list}, {c.pk for c in self.customers[:2]})
+        sql = [q['sql'] for q in queries if 'accounts_booking' in q['sql']]
+        self.assertTrue(sql)
+        self.assertTrue(all('EXISTS' in statement and 'DISTINCT' not in statement for statement in sql))
+
+    def test_many_tours_are_searched_lazily(self):
+        tours = [make_tour(i, name=f'Tour {i}') for i in range(12)]
+        kapadokya = make_tour(99, name='Kapadokya Balon')
+
+        self.assertEqual(self.filter_choices('Tur'), [])
+        self.assertEqual(self.filter_choices('Tur', f'?tour={tours[3].pk}'), ['Tour 3'])
+        response = self.client.get('/admin/accounts/customer/')
+        self.assertContains(response, 'admin/accounts/customer/tour-filter-options/')
+
+        response = self.client.get('/admin/accounts/customer/tour-filter-options/', {'q': 'kapad'})
+        self.assertEqual(response.json(), {'results': [{'id': kapadokya.pk, 'text': 'Kapadokya Balon'}]})
+
+
+class ChangelistQueryTests(TestCase):
+
+    def setUp(self):
+        filter_cache.invalidate()
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+        self.tour = make_tour()
+
+    def populate(self, start, stop):
+        for i in range(start, stop):
+            customer = make_customer(i)
+            make_booking(customer, make_tour(i + 100, name=f'Tour {i}') if i % 2 else self.tour)
+            User.objects.create_user(f'user{i}', f'user{i}@example.com', 'password')
+
+    def changelist_queries(self, path):
+        with CaptureQueriesContext(connection) as queries, forbid_lazy_loads():
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_forbid_lazy_loads(self):
+        booking = make_booking(make_customer(1), self.tour)
+        booking = Booking.objects.only('pk', 'customer').get(pk=booking.pk)
+        with forbid_lazy_loads():
+            with self.assertRaises(LazyLoadError):
+                booking.customer
+            with self.assertRaises(LazyLoadError):
+                booking.total_price
+        self.assertEqual(booking.total_price, Decimal('100.00'))
+
+    def test_changelist_query_count_is_constant(self):
+        paths = ['/admin/accounts/booking/', '/admin/accounts/customer/', '/admin/auth/user/']
+        self.populate(0, 5)
+        # Filter options are cached on the first render
+        self.changelist_queries('/admin/accounts/customer/')
+        few = [self.changelist_queries(path) for path in paths]
+        self.populate(5, 30)
+        filter_cache.invalidate()
+        self.changelist_queries('/admin/accounts/customer/')
+        many = [self.changelist_queries(path) for path in paths]
+        self.assertEqual(few, many)
+
+
+class ConnectionPoolTests(TestCase):
+
+    def make_pool(self, **options):
+        pool = ConnectionPool(
+            lambda: sqlite3.connect(':memory:', check_same_thread=False),
+            check=PooledDatabaseWrapperMixin.check_pooled_connection,
+            reset=PooledDatabaseWrapperMixin.reset_pooled_connection,
+            **options,
+        )
+        self.addCleanup(pool.close_all)
+        return pool
+
+    def test_connections_reused(self):
+        pool = self.make_pool()
+        first = pool.acquire()
+        pool.release(first)
+        self.assertIs(pool.acquire(), first)
+        stats = pool.stats()
+        self.assertEqual((stats['opened'], stats['checkouts'], stats['in_use']), (1, 2, 1))
+
+    def test_checkout_waits_then_times_out(self):
+        pool = self.make_pool(MAX_SIZE=1, TIMEOUT=0.05)
+        connection = pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+
+        threading.Timer(0.01, pool.release, [connection]).start()
+        pool.config['TIMEOUT'] = 5
+        self.assertIs(pool.acquire(), connection)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        self.assertGreaterEqual(pool.stats()['waits'], 2)
+
+    def test_broken_and_expired_connections_replaced(self):
+        pool = self.make_pool()
+        # Dropped by the server while idle in the pool
+        broken = pool.acquire()
+        pool.release(broken)
+        broken.close()
+        replacement = pool.acquire()
+        self.assertIsNot(replacement, broken)
+        self.assertEqual(pool.stats()['failed_checks'], 1)
+
+        pool.config['MAX_LIFETIME'] = 0
+        pool.release(replacement)
+        self.assertIsNot(pool.acquire(), replacement)
+        self.assertEqual(pool.stats()['opened'], 3)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_pooled_backend(self):
+        database = tempfile.NamedTemporaryFile(suffix='.sqlite3')
+        self.addCleanup(database.close)
+        settings_dict = {
+            **connection.settings_dict,
+            'ENGINE': 'crm.db.backends.sqlite3',
+            'NAME': database.name,
+            'CONN_MAX_AGE': 0,
+            'POOL': {'MAX_SIZE': 2},
+        }
+        wrapper = PooledSQLiteWrapper(settings_dict, alias='pooled')
+        for _ in range(3):
+            with wrapper.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            wrapper.close()
+        pool = wrapper.pool()
+        self.addCleanup(pool.close_all)
+        self.assertEqual(pool_stats()['pooled']['opened'], 1)
+        self.assertEqual(pool_stats()['pooled']['checkouts'], 3)
+
+
+@override_settings(READ_REPLICAS={'ALIASES': ['replica1'], 'STICKY_SECONDS': None})
+class ReplicaRouterTests(TestCase):
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def read_db(self):
+        # Tests run inside a transaction, which alone keeps reads on the primary
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            return self.router.db_for_read(Customer)
+
+    def test_opted_in_reads_use_a_replica(self):
+        self.assertEqual(self.read_db(), 'default')
+        with routers.replica_reads():
+            self.assertEqual(self.read_db(), 'replica1')
+            self.assertEqual(self.router.db_for_read(Customer), 'default')
+            self.assertEqual(self.router.db_for_write(Customer), 'default')
+        self.assertFalse(self.router.allow_migrate('replica1', 'accounts'))
+
+    def test_cached_values_computed_on_primary(self):
+        make_customer(1)
+        aliases = []
+
+        def record(router, model, **hints):
+            with mock.patch.object(connection, 'in_atomic_block', False):
+                aliases.append(routers.read_alias())
+            return 'default'
+
+        with routers.replica_reads():
+            self.assertEqual(self.read_db(), 'replica1')
+            with mock.patch.object(ReplicaRouter, 'db_for_read', record):
+                compute_dashboard_metrics()
+                cached_lookups('customer:test', lambda: list(Customer.objects.values_list('country', flat=True)))
+        self.assertTrue(aliases)
+        self.assertEqual(set(aliases), {'default'})
+
+    def test_session_pinned_after_write(self):
+        session = {}
+        with routers.replica_reads():
+            with routers.track_writes(routers.is_pinned(session)) as state:
+                self.assertEqual(self.read_db(), 'replica1')
+                make_tour()
+                self.assertEqual(self.read_db(), 'default')
+            self.assertTrue(state.wrote)
+            routers.pin(session)
+
+            with routers.track_writes(routers.is_pinned(session)) as state:
+                self.assertEqual(self.read_db(), 'default')
+                Tour.objects.count()
+            self.assertFalse(state.wrote)
+
+    @override_settings(READ_REPLICAS={'ALIASES': ['replica1'], 'STICKY_SECONDS': 30})
+    def test_sticky_window(self):
+        session = {}
+        routers.pin(session)
+        self.assertTrue(routers.is_pinned(session))
+        session[routers.PINNED_SESSION_KEY] -= 31
+        self.assertFalse(routers.is_pinned(session))
+
+    def test_get_changelists_opt_in(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        make_customer(1)
+        customer_reads = []
+        db_for_read = ReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            if model is Customer:
+                customer_reads.append(routers._replica_reads.get())
+            return db_for_read(router, model, **hints)
+
+        # Filter options are cached from the primary on the first render
+        self.client.get('/admin/accounts/customer/')
+        with mock.patch.object(ReplicaRouter, 'db_for_read', record):
+            self.client.get('/admin/accounts/customer/')
+            self.assertTrue(customer_reads and all(customer_reads))
+            customer_reads.clear()
+            self.client.get(f'/admin/accounts/customer/{Customer.objects.get().pk}/change/')
+            self.assertTrue(customer_reads and not any(customer_reads))
+
+
+@override_settings(READ_REPLICAS={'ALIASES': ['replica'], 'STICKY_SECONDS': None})
+class ReplicaDatabaseTests(TransactionTestCase):
+    """Routing against a second SQLite database with its own schema and rows, not a mirror"""
+    # Resolved when the class is set up, once the replica alias exists
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        name = os.path.join(directory.name, 'replica.sqlite3')
+        connections.settings['replica'] = {
+            **connections.settings['default'],
+            'NAME': name,
+            'TEST': {**connections.settings['default']['TEST'], 'NAME': name, 'MIRROR': None},
+        }
+        # Created before READ_REPLICAS applies: the router keeps migrate off replicas
+        connections['replica'].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        cls.addClassCleanup(cls.remove_replica)
+        super().setUpClass()
+
+    @classmethod
+    def remove_replica(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+
+    def setUp(self):
+        # flush skips the tables the router keeps off replicas
+        with connections['replica'].cursor() as cursor:
+            cursor.execute('DELETE FROM accounts_tour')
+        # Rows that replication has not caught up with exist on the primary only
+        make_tour(name='Primary tour')
+        Tour.objects.using('replica').bulk_create([Tour(
+            name='Replica tour', description='Description', destination='Cappadocia', duration_days=3,
+            price=Decimal('100.00'), start_date=date(2026, 5, 1), end_date=date(2026, 5, 4), max_participants=50,
+        )])
+
+    def test_opted_in_reads_use_the_replica(self):
+        self.assertEqual(Tour.objects.get().name, 'Primary tour')
+        with routers.replica_reads():
+            self.assertEqual(Tour.objects.get().name, 'Replica tour')
+            with transaction.atomic():
+                self.assertEqual(Tour.objects.get().name, 'Primary tour')
+
+    def test_logging_in_does_not_pin_the_session(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        response = self.client.post('/accounts/login/', {'username': 'admin', 'password': 'password'})
+        self.assertRedirects(response, '/admin/', fetch_redirect_response=False)
+        self.assertIsNotNone(User.objects.get().last_login)
+        self.assertFalse(routers.is_pinned(self.client.session))
+        self.assertContains(self.client.get('/admin/accounts/tour/'), 'Replica tour')
+
+    def test_session_pinned_to_primary_after_write(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+
+        response = self.client.get('/admin/accounts/tour/')
+        self.assertContains(response, 'Replica tour')
+        self.assertNotContains(response, 'Primary tour')
+
+        response = self.client.post('/admin/accounts/tour/add/', {
+            'name': 'New tour', 'description': 'Description', 'destination': 'Ephesus', 'duration_days': 2,
+            'price': '80.00', 'start_date': '2026-06-01', 'end_date': '2026-06-03', 'max_participants': 20,
+            'status': 'scheduled',
+        })
+        self.assertEqual(response.status_code, 302)
+
+        response = self.client.get('/admin/accounts/tour/')
+        self.assertContains(response, 'Primary tour')
+        self.assertContains(response, 'New tour')
+        self.assertNotContains(response, 'Replica tour')
+
+
+class SessionTests(TestCase):
+
+    def test_purge_in_batches(self):
+        now = timezone.now()
+        for index in range(5):
+            Session.objects.create(
+                session_key=f'expired{index}', session_data='', expire_date=now - timezone.timedelta(days=index + 1),
+            )
+        Session.objects.create(session_key='active', session_data='', expire_date=now + timezone.timedelta(days=1))
+
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('purge_expired_sessions', '--batch-size', '2', '--sleep', '0', stdout=out)
+        self.assertIn('5 expired sessions deleted in 3 batches', out.getvalue())
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['active'])
+        deletes = [query['sql'] for query in queries if query['sql'].startswith('DELETE')]
+        self.assertEqual(len(deletes), 3)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+    def test_cached_db_sessions_skip_the_table(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        self.client.get('/admin/')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/admin/')
+        self.assertFalse([query for query in queries if 'django_session' in query['sql']])
+
+
+class BookingAutocompleteTests(TestCase):
+
+    def setUp(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+
+    def autocomplete(self, field_name, term):
+        response = self.client.get('/admin/autocomplete/', {
+            'app_label': 'accounts', 'model_name': 'booking', 'field_name': field_name, 'term': term,
+        })
+        return [result['text'] for result in response.json()['results']]
+
+    def test_booking_form_does_not_list_every_customer(self):
+        for index in range(1, 4):
+            make_customer(index)
+        make_tour()
+        response = self.client.get('/admin/accounts/booking/add/')
+        self.assertContains(response, 'data-ajax--url="/admin/autocomplete/"', count=2)
+        self.assertNotContains(response, 'First2 Last2')
+        self.assertNotContains(response, 'Tour 1')
+
+    def test_customer_search(self):
+        for index in range(1, 4):
+            make_customer(index)
+        self.assertEqual(self.autocomplete('customer', 'P000002'), ['First2 Last2'])
+        self.assertEqual(self.autocomplete('customer', 'last3'), ['First3 Last3'])
+
+    def test_tour_search_lists_upcoming_tours(self):
+        today = timezone.localdate()
+        make_tour(1, start_date=today - timezone.timedelta(days=30), end_date=today)
+        make_tour(2, start_date=today + timezone.timedelta(days=60), destination='Ephesus')
+        make_tour(3, start_date=today + timezone.timedelta(days=10))
+
+        self.assertEqual(self.autocomplete('tour', ''), ['Tour 3 - Cappadocia', 'Tour 2 - Ephesus'])
+        self.assertEqual(self.autocomplete('tour', 'ephes'), ['Tour 2 - Ephesus'])
+        start = today + timezone.timedelta(days=10)
+        self.assertEqual(self.autocomplete('tour', start.isoformat()), ['Tour 3 - Cappadocia'])
+        self.assertEqual(self.autocomplete('tour', f'{start:%Y-%m} cappadocia'), ['Tour 3 - Cappadocia'])
+
+    def test_changed_booking_keeps_its_started_tour(self):
+        today = timezone.localdate()
+        started = make_tour(1, start_date=today - timezone.timedelta(days=2), end_date=today + timezone.timedelta(days=1))
+        make_tour(2, start_date=today + timezone.timedelta(days=10), destination='Ephesus')
+        booking = make_booking(make_customer(1), started)
+
+        response = self.client.get(f'/admin/accounts/booking/{booking.pk}/change/')
+        self.assertContains(response, f'data-ajax--url="/admin/autocomplete/?booking={booking.pk}"')
+        response = self.client.get('/admin/autocomplete/', {
+            'app_label': 'accounts', 'model_name': 'booking', 'field_name': 'tour', 'term': '', 'booking': booking.pk,
+        })
+        self.assertEqual([result['text'] for result in response.json()['results']], ['Tour 1 - Cappadocia', 'Tour 2 - Ephesus'])
+        # The add form still offers upcoming tours only
+        self.assertEqual(self.autocomplete('tour', ''), ['Tour 2 - Ephesus'])
+
+
+class TourCapacityTests(TestCase):
+
+    def test_saving_a_stale_tour_keeps_the_seat_count(self):
+        tour = make_tour(max_participants=5)
+        stale = Tour.objects.get()
+        make_booking(make_customer(1), tour, number_of_participants=4)
+
+        stale.name = 'Renamed'
+        stale.save()
+        tour.refresh_from_db()
+        self.assertEqual((tour.name, tour.seats_booked), ('Renamed', 4))
+        with self.assertRaises(TourCapacityError):
+            make_booking(make_customer(2), tour, number_of_participants=4)
+
+    def test_bookings_count_seats(self):
+        tour = make_tour(max_participants=5)
+        customer = make_customer(1)
+        booking = make_booking(customer, tour, number_of_participants=3)
+        tour.refresh_from_db()
+        self.assertEqual((tour.seats_booked, tour.seats_available), (3, 2))
+
+        with self.assertRaises(TourCapacityError):
+            make_booking(make_customer(2), tour, number_of_participants=3)
+        tour.refresh_from_db()
+        self.assertEqual(tour.seats_booked, 3)
+
+        booking.number_of_participants = 5
+        booking.save()
+        tour.refresh_from_db()
+        self.assertEqual(tour.seats_booked, 5)
+
+    def test_moving_and_deleting_bookings_release_seats(self):
+        first, second = make_tour(1, max_participants=5), make_tour(2, max_participants=5)
+        customer = make_customer(1)
+        booking = make_booking(customer, first, number_of_participants=4)
+
+        booking = Booking.objects.get(pk=booking.pk)
+        booking.tour = second
+        booking.save(update_fields=['tour'])
+        self.assertEqual(list(Tour.objects.order_by('pk').values_list('seats_booked', flat=True)), [0, 4])
+
+        make_booking(customer, first, number_of_participants=2)
+        customer.delete()
+        self.assertEqual(list(Tour.objects.order_by('pk').values_list('seats_booked', flat=True)), [0, 0])
+
+    def test_admin_form_reports_full_tour(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        tour = make_tour(max_participants=2)
+        make_booking(make_customer(1), tour, number_of_participants=2)
+        customer = make_customer(2)
+
+        response = self.client.post('/admin/accounts/booking/add/', {
+            'customer': customer.pk, 'tour': tour.pk, 'number_of_participants': 1,
+            'total_price': '100.00', 'amount_paid': '0.00', 'payment_status': 'pending',
+        })
+        self.assertContains(response, 'Only 0 seats left on Tour 1 - Cappadocia.')
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_reconcile_tour_seats(self):
+        tour = make_tour()
+        make_booking(make_customer(1), tour, number_of_participants=3)
+        Tour.objects.update(seats_booked=7)
+
+        with self.assertRaises(CommandError):
+            call_command('reconcile_tour_seats', check=True, stdout=StringIO())
+        out = StringIO()
+        call_command('reconcile_tour_seats', stdout=out)
+        self.assertIn('stored 7, actual 3', out.getvalue())
+        tour.refresh_from_db()
+        self.assertEqual(tour.seats_booked, 3)
+
+
+class OutstandingBalanceTests(TestCase):
+
+    def setUp(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+
+    def test_balance_is_kept_on_save(self):
+        booking = make_booking(make_customer(1), make_tour(), total_price=Decimal('300.00'))
+        self.assertEqual(Booking.objects.get().outstanding_balance, Decimal('300.00'))
+
+        Payment.objects.create(booking=booking, amount=Decimal('120.00'), method='cash')
+        booking.total_price = Decimal('320.00')
+        booking.save(update_fields=['total_price'])
+        self.assertEqual(
+            (booking.amount_paid, booking.outstanding_balance, booking.payment_status),
+            (Decimal('120.00'), Decimal('200.00'), 'partial'),
+        )
+        self.assertEqual(Booking.objects.get().outstanding_balance, Decimal('200.00'))
+
+    def test_changelist_filters_and_sorts_by_amount_owed(self):
+        tour = make_tour()
+        for index, paid in enumerate(['100.00', '50.00', '0.00']):
+            make_booking(make_customer(index), tour, total_price=Decimal('700.00') if index == 2 else Decimal('100.00'),
+                         amount_paid=Decimal(paid))
+
+        response = self.client.get('/admin/accounts/booking/', {'owed': 'any'})
+        self.assertEqual(
+            sorted(booking.outstanding_balance for booking in response.context['cl'].result_list),
+            [Decimal('50.00'), Decimal('700.00')],
+        )
+        response = self.client.get('/admin/accounts/booking/', {'owed': '500'})
+        self.assertEqual([booking.outstanding_balance for booking in response.context['cl'].result_list],
+                         [Decimal('700.00')])
+
+        # The action checkbox is column 0
+        column = BookingAdmin.list_display.index('outstanding_balance') + 1
+        response = self.client.get('/admin/accounts/booking/', {'o': f'-{column}'})
+        self.assertEqual([booking.outstanding_balance for booking in response.context['cl'].result_list],
+                         [Decimal('700.00'), Decimal('50.00'), Decimal('0.00')])
+
+    def test_top_debtors(self):
+        first, second = make_tour(1), make_tour(2)
+        a, b, c = make_customer(1), make_customer(2), make_customer(3)
+        make_booking(a, first, total_price=Decimal('300.00'), amount_paid=Decimal('100.00'))
+        make_booking(a, second, total_price=Decimal('150.00'))
+        make_booking(b, first, total_price=Decimal('400.00'))
+        make_booking(c, first, amount_paid=Decimal('100.00'), payment_status='paid')
+
+        response = self.client.get('/admin/accounts/booking/top-debtors/')
+        self.assertEqual(
+            [(row['customer'].pk, row['owed'], row['bookings']) for row in response.context['rows']],
+            [(b.pk, Decimal('400.00'), 1), (a.pk, Decimal('350.00'), 2)],
+        )
+        self.assertContains(response, '€400.00')
+        self.assertNotContains(response, 'First3 Last3')
+
+
+class PaymentLedgerTests(TestCase):
+
+    def test_amount_paid_on_create_opens_the_ledger(self):
+        booking = make_booking(make_customer(1), make_tour(), total_price=Decimal('300.00'),
+                               amount_paid=Decimal('300.00'), payment_status='pending')
+        self.assertEqual(
+            (booking.amount_paid, booking.outstanding_balance, booking.payment_status),
+            (Decimal('300.00'), Decimal('0.00'), 'paid'),
+        )
+        self.assertEqual(list(booking.payments.values_list('amount', 'note')), [(Decimal('300.00'), 'Opening balance')])
+        self.assertEqual(payments.ledger_total(None, timezone.now() + timezone.timedelta(seconds=1)), Decimal('300.00'))
+
+        # A status passed without a payment is not taken
+        unpaid = make_booking(make_customer(2), make_tour(2), payment_status='paid')
+        self.assertEqual((unpaid.amount_paid, unpaid.payment_status), (Decimal('0.00'), 'pending'))
+        self.assertFalse(unpaid.payments.exists())
+
+    def test_payments_move_the_booking(self):
+        booking = make_booking(make_customer(1), make_tour(), total_price=Decimal('300.00'))
+        payment = Payment.objects.create(booking=booking, amount=Decimal('100.00'), method='cash')
+        booking.refresh_from_db()
+        self.assertEqual(
+            (booking.amount_paid, booking.outstanding_balance, booking.payment_status),
+            (Decimal('100.00'), Decimal('200.00'), 'partial'),
+        )
+
+        Payment.objects.create(booking=booking, amount=Decimal('200.00'), method='card')
+        booking.refresh_from_db()
+        self.assertEqual((booking.outstanding_balance, booking.payment_status), (Decimal('0.00'), 'paid'))
+
+        with self.assertRaises(ValueError):
+            payment.save()
+        with self.assertRaises(ValueError):
+            payment.delete()
+
+    def test_refunding_everything_paid_marks_the_booking_refunded(self):
+        booking = make_booking(make_customer(1), make_tour(), total_price=Decimal('300.00'))
+        Payment.objects.create(booking=booking, amount=Decimal('300.00'), method='card')
+        Payment.objects.create(booking=booking, amount=Decimal('-100.00'), method='card')
+        booking.refresh_from_db()
+        self.assertEqual((booking.amount_paid, booking.payment_status), (Decimal('200.00'), 'partial'))
+
+        Payment.objects.create(booking=booking, amount=Decimal('-200.00'), method='card')
+        booking.refresh_from_db()
+        self.assertEqual(
+            (booking.amount_paid, booking.outstanding_balance, booking.payment_status),
+            (Decimal('0.00'), Decimal('300.00'), 'refunded'),
+        )
+
+    def test_saving_a_stale_booking_keeps_payments_recorded_meanwhile(self):
+        booking = make_booking(make_customer(1), make_tour(), total_price=Decimal('300.00'))
+        stale = Booking.objects.get()
+        Payment.objects.create(booking=booking, amount=Decimal('300.00'), method='card')
+
+        stale.notes = 'Window seat'
+        stale.save()
+        self.assertEqual(
+            Booking.objects.values_list('amount_paid', 'outstanding_balance', 'payment_status', 'notes').get(),
+            (Decimal('300.00'), Decimal('0.00'), 'paid', 'Window seat'),
+        )
+
+        stale.total_price = Decimal('400.00')
+        stale.save()
+        self.assertEqual(
+            (stale.amount_paid, stale.outstanding_balance, stale.payment_status),
+            (Decimal('300.00'), Decimal('100.00'), 'partial'),
+        )
+
+    def test_group_payment_updates_bookings_paying_the_same_amount_at_once(self):
+        tour = make_tour()
+        bookings = [make_booking(make_customer(index), tour) for index in range(5)]
+
+        with CaptureQueriesContext(connection) as queries:
+            payments.record_payments([(booking, Decimal('40.00')) for booking in bookings], 'bank_transfer')
+        updates = [query for query in queries if query['sql'].startswith('UPDATE "accounts_booking"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Payment.objects.count(), 5)
+        self.assertEqual(
+            set(Booking.objects.values_list('amount_paid', 'payment_status')), {(Decimal('40.00'), 'partial')}
+        )
+
+    def test_revenue_between_reads_snapshots_and_the_tail(self):
+        booking = make_booking(make_customer(1), make_tour(), total_price=Decimal('1000.00'))
+        for day, amount in [(1, '100.00'), (2, '50.00'), (4, '25.00'), (6, '10.00')]:
+            paid_at = timezone.make_aware(datetime(2026, 3, day, 12))
+            Payment.objects.create(booking=booking, amount=Decimal(amount), method='cash', paid_at=paid_at)
+
+        self.assertEqual(payments.take_snapshots(until=date(2026, 3, 4)), 4)
+        self.assertEqual(payments.take_snapshots(until=date(2026, 3, 4)), 0)
+        self.assertEqual(payments.revenue_between(date(2026, 3, 2), date(2026, 3, 6)), Decimal('85.00'))
+        self.assertEqual(payments.revenue_between(date(2026, 3, 1), date(2026, 3, 1)), Decimal('100.00'))
+
+        # A payment dated before the latest snapshot moves the snapshots after it
+        Payment.objects.create(booking=booking, amount=Decimal('5.00'), method='cash',
+                               paid_at=timezone.make_aware(datetime(2026, 3, 2, 9)))
+        with self.assertNumQueries(1):
+            self.assertEqual(payments.total_through(date(2026, 3, 4)), Decimal('180.00'))
+        self.assertEqual(payments.revenue_between(date(2026, 3, 2), date(2026, 3, 6)), Decimal('90.00'))
+
+        snapshots = list(PaymentSnapshot.objects.values_list('date', 'total'))
+        payments.rebuild_snapshots(until=date(2026, 3, 4))
+        self.assertEqual(list(PaymentSnapshot.objects.values_list('date', 'total')), snapshots)
+
+    def test_dashboard_shows_revenue_this_month(self):
+        booking = make_booking(make_customer(1), make_tour(), total_price=Decimal('1000.00'))
+        now = timezone.now()
+        Payment.objects.create(booking=booking, amount=Decimal('600.00'), method='card',
+                               paid_at=now - timezone.timedelta(days=40))
+        Payment.objects.create(booking=booking, amount=Decimal('150.00'), method='card')
+        Payment.objects.create(booking=booking, amount=Decimal('75.50'), method='cash')
+        payments.take_snapshots()
+
+        self.assertEqual(compute_dashboard_metrics()['revenue_this_month'], '€225.50')
+
+    def test_record_payments_admin_action(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        tour = make_tour()
+        first = make_booking(make_customer(1), tour, total_price=Decimal('300.00'))
+        second = make_booking(make_customer(2), tour, total_price=Decimal('200.00'), amount_paid=Decimal('50.00'))
+        selected = {'action': 'record_payments', '_selected_action': [first.pk, second.pk]}
+
+        response = self.client.post('/admin/accounts/booking/', selected)
+        self.assertContains(response, '2 bookings selected, €450.00 outstanding.')
+
+        response = self.client.post('/admin/accounts/booking/', {
+            **selected, 'apply': '1', 'pay': 'balance', 'method': 'card',
+            'paid_at_0': '2026-03-01', 'paid_at_1': '10:00:00',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            sorted(Payment.objects.values_list('booking', 'amount')),
+            [(first.pk, Decimal('300.00')), (second.pk, Decimal('50.00')), (second.pk, Decimal('150.00'))],
+        )
+        self.assertEqual(set(Booking.objects.values_list('payment_status', flat=True)), {'paid'})
+
+        response = self.client.post('/admin/accounts/booking/', {
+            **selected, 'apply': '1', 'pay': 'refund', 'method': 'bank_transfer',
+            'paid_at_0': '2026-03-05', 'paid_at_1': '10:00:00',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            set(Booking.objects.values_list('amount_paid', 'payment_status')), {(Decimal('0.00'), 'refunded')}
+        )
+        self.assertEqual(Payment.objects.filter(amount__lt=0).count(), 2)
+
+        response = self.client.get(f'/admin/accounts/booking/{first.pk}/change/')
+        self.assertContains(response, '300.00')
+        self.assertNotContains(response, 'name="amount_paid"')
+        self.assertNotContains(response, 'name="payment_status"')
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+
+    def test_parallel_bookings_never_oversell(self):
+        tour = make_tour(max_participants=10)
+        customers = [make_customer(index) for index in range(25)]
+        barrier = threading.Barrier(len(customers))
+        results = []
+
+        def book(customer):
+            try:
+                barrier.wait()
+                for attempt in range(50):
+                    try:
+                        make_booking(customer, tour)
+                        results.append('booked')
+                        return
+                    except TourCapacityError:
+                        results.append('full')
+                        return
+                    except OperationalError:
+                        # SQLite lets one writer at a time, the others retry
+                        time.sleep(0.01)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=book, args=[customer]) for customer in customers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        tour.refresh_from_db()
+        self.assertEqual(results.count('booked'), 10)
+        self.assertEqual(results.count('full'), 15)
+        self.assertEqual(tour.seats_booked, 10)
+        self.assertEqual(Booking.objects.filter(tour=tour).count(), 10)
+
+
+class QueryInstrumentationTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+
+    @override_settings(QUERY_INSTRUMENTATION={'SAMPLE_RATE': 0})
+    def test_not_sampled(self):
+        response = self.client.get('/admin/accounts/customer/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotContains(response, 'query-overlay')
+
+    @override_settings(QUERY_INSTRUMENTATION={'SAMPLE_RATE': 1, 'SLOW_REQUEST_MS': 0})
+    def test_sampled_request_is_timed_and_logged(self):
+        make_customer(1)
+        with self.assertLogs('crm.queries', 'WARNING') as logs:
+            response = self.client.get('/admin/accounts/customer/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", total;dur=[\d.]+$')
+
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['path'], '/admin/accounts/customer/')
+        self.assertEqual(entry['status'], 200)
+        self.assertGreater(entry['queries'], 0)
+        self.assertTrue(all(query['sql'] for query in entry['slowest']))
+        self.assertTrue(any(query['origin'] for query in entry['slowest']))
+
+    @override_settings(QUERY_INSTRUMENTATION={'SAMPLE_RATE': 1})
+    def test_fast_requests_are_not_logged(self):
+        with self.assertNoLogs('crm.queries'):
+            self.client.get('/admin/accounts/customer/')
+
+    @override_settings(QUERY_INSTRUMENTATION={'OVERLAY': True})
+    def test_staff_overlay(self):
+        response = self.client.get('/admin/accounts/customer/')
+        self.assertContains(response, 'id="query-overlay"')
+        self.assertIn('Server-Timing', response)
+
+        self.client.logout()
+        response = self.client.get('/admin/accounts/customer/')
+        self.assertNotIn('Server-Timing', response)
+
+
+class UserProfileWriteTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.user = User.objects.create_user('reader', 'reader@example.com', 'password')
+
+    def profile_writes(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        return [
+            q['sql'] for q in queries
+            if q['sql'].startswith(('UPDATE', 'INSERT')) and 'accounts_userprofile' in q['sql']
+        ]
+
+    def test_login_does_not_write_the_profile(self):
+        self.assertEqual(self.profile_writes(lambda: self.client.login(username='reader', password='password')), [])
+
+    def test_unchanged_profile_is_not_written(self):
+        user = User.objects.select_related('profile').get(pk=self.user.pk)
+        self.assertEqual(self.profile_writes(user.save), [])
+
+        user.profile.phone = '+90555000000'
+        writes = self.profile_writes(user.save)
+        self.assertEqual(len(writes), 1)
+        self.assertNotIn('"gender"', writes[0])
+        self.assertEqual(UserProfile.objects.get(user=user).phone, '+90555000000')
+        self.assertEqual(self.profile_writes(user.save), [])
+
+    def test_list_editable_toggle_writes_the_profile_once(self):
+        self.client.force_login(self.admin)
+        data = {
+            'form-TOTAL_FORMS': '1', 'form-INITIAL_FORMS': '1',
+            'form-0-id': str(self.user.pk), '_save': 'Save',
+        }
+        writes = self.profile_writes(lambda: self.client.post('/admin/auth/user/?q=reader', data))
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(UserProfile.objects.get(user=self.user).status, 'passive')
+
+    def test_bulk_status_change_is_batched(self):
+        users = [User.objects.create_user(f'user{i}', f'user{i}@example.com', 'password') for i in range(5)]
+        self.client.force_login(self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/admin/auth/user/', {
+                'action': 'deactivate_users',
+                '_selected_action': [user.pk for user in users],
+            })
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(User.objects.filter(is_active=False).count(), 5)
+        self.assertEqual(UserProfile.objects.filter(status='passive').count(), 5)
+
+
+def make_jpeg(size=(1200, 900), color='navy'):
+    output = BytesIO()
+    Image.new('RGB', size, color).save(output, 'JPEG')
+    return output.getvalue()
+
+
+class TemporaryMediaMixin:
+    """Photos stored on the local file system under a throwaway MEDIA_ROOT"""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(
+            DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+            MEDIA_ROOT=media_root.name,
+            MEDIA_URL='/media/',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class ThumbnailTests(TemporaryMediaMixin, TestCase):
+
+    def thumbnail_size(self, name, key):
+        with default_storage.open(images.thumbnail_name(name, key)) as file, Image.open(file) as image:
+            return image.size
+
+    def test_thumbnails_generated_on_upload(self):
+        customer = make_customer(1, photo=SimpleUploadedFile('scan.jpg', make_jpeg(), 'image/jpeg'))
+        name = customer.photo.name
+        self.assertEqual(self.thumbnail_size(name, 40), (40, 40))
+        self.assertEqual(self.thumbnail_size(name, 80), (80, 80))
+        self.assertEqual(self.thumbnail_size(name, 600), (600, 450))
+
+        user = User.objects.create_user('reader', 'reader@example.com', 'password')
+        user.profile.photo = SimpleUploadedFile('me.png', make_jpeg((300, 600)), 'image/png')
+        user.profile.save()
+        self.assertEqual(self.thumbnail_size(user.profile.photo.name, 600), (300, 600))
+
+    def test_admin_serves_thumbnails(self):
+        customer = make_customer(1, photo=SimpleUploadedFile('scan.jpg', make_jpeg(), 'image/jpeg'))
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        small = images.thumbnail_name(customer.photo.name, 40)
+        large = images.thumbnail_name(customer.photo.name, 80)
+
+        response = self.client.get('/admin/accounts/customer/')
+        self.assertContains(response, f'srcset="/media/{small} 1x, /media/{large} 2x"')
+        self.assertContains(response, 'loading="lazy"')
+        self.assertNotContains(response, f'src="/media/{customer.photo.name}"')
+
+        response = self.client.get(f'/admin/accounts/customer/{customer.pk}/change/')
+        self.assertContains(response, images.thumbnail_name(customer.photo.name, 600))
+
+    def test_backfill_command(self):
+        customer = make_customer(1)
+        name = default_storage.save('customer_photos/old.jpg', ContentFile(make_jpeg()))
+        Customer.objects.filter(pk=customer.pk).update(photo=name)
+
+        out = StringIO()
+        call_command('generate_thumbnails', '--missing', stdout=out)
+        self.assertIn('customers: 1 generated, 0 skipped, 0 failed', out.getvalue())
+        self.assertEqual(self.thumbnail_size(name, 40), (40, 40))
+
+        out = StringIO()
+        call_command('generate_thumbnails', '--missing', stdout=out)
+        self.assertIn('customers: 0 generated, 1 skipped, 0 failed', out.getvalue())
+
+    @override_settings(PHOTO_UPLOAD={'MAX_DIMENSION': 1000, 'FORMAT': 'JPEG', 'QUALITY': 80})
+    def test_upload_normalized(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90 degrees clockwise
+        exif[0x010F] = 'PhoneMaker'
+        scan = BytesIO()
+        Image.new('RGB', (3000, 2000), 'navy').save(scan, 'PNG', exif=exif)
+
+        with self.assertLogs('accounts.images', 'INFO') as logs:
+            customer = make_customer(1, photo=SimpleUploadedFile('scan.png', scan.getvalue(), 'image/png'))
+        self.assertRegex(customer.photo.name, r'^customer_photos/[0-9a-f]{64}\.jpg$')
+        with default_storage.open(customer.photo.name) as file, Image.open(file) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (667, 1000))
+            self.assertFalse(image.getexif())
+        self.assertEqual(self.thumbnail_size(customer.photo.name, 600), (534, 800))
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['event'], 'photo_normalized')
+        self.assertEqual(record['original_bytes'], len(scan.getvalue()))
+        self.assertEqual(record['normalized_bytes'], default_storage.size(customer.photo.name))
+        self.assertEqual(record['original_size'], [3000, 2000])
+        self.assertEqual(record['normalized_size'], [667, 1000])
+
+    def test_unreadable_upload_kept(self):
+        with self.assertLogs('accounts.images', 'WARNING'):
+            self.assertIsNone(images.normalize_upload(SimpleUploadedFile('scan.jpg', b'not an image')))
+
+        # Saved as it is, without thumbnails
+        with self.assertLogs('accounts.images', 'WARNING'):
+            customer = make_customer(1, photo=SimpleUploadedFile('scan.pdf', b'not an image', 'application/pdf'))
+        with default_storage.open(customer.photo.name) as file:
+            self.assertEqual(file.read(), b'not an image')
+        self.assertEqual(default_storage.listdir('customer_photos')[1], [os.path.basename(customer.photo.name)])
+        self.assertEqual(StoredPhoto.objects.get(name=customer.photo.name).references, 1)
+
+
+class PhotoDeduplicationTests(TemporaryMediaMixin, TestCase):
+
+    def upload(self, color='navy'):
+        return SimpleUploadedFile('scan.jpg', make_jpeg(color=color), 'image/jpeg')
+
+    def stored_files(self):
+        return sorted(default_storage.listdir('customer_photos')[1])
+
+    def references(self, name):
+        return StoredPhoto.objects.get(name=name).references
+
+    def test_identical_uploads_stored_once(self):
+        first = make_customer(1, photo=self.upload())
+        with mock.patch.object(FileSystemStorage, '_save') as save:
+            second = make_customer(2, photo=self.upload())
+        save.assert_not_called()
+
+        name = first.photo.name
+        self.assertEqual(second.photo.name, name)
+        self.assertRegex(name, r'^customer_photos/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(self.references(name), 2)
+        self.assertEqual(len(self.stored_files()), 1 + len(images.THUMBNAILS))
+
+        user = User.objects.create_user('reader', 'reader@example.com', 'password')
+        user.profile.photo = self.upload()
+        user.profile.save()
+        self.assertEqual(user.profile.photo.name, name)
+        self.assertEqual(self.references(name), 3)
+
+    def test_failed_save_gives_claimed_reference_back(self):
+        name = make_customer(1, photo=self.upload()).photo.name
+        user = User.objects.create_user('reader', 'reader@example.com', 'password')
+
+        # The user already has a profile, so the INSERT fails after claim()
+        with self.assertRaises(IntegrityError):
+            UserProfile(user=user, photo=self.upload()).save()
+        self.assertEqual(self.references(name), 1)
+
+    def test_file_deleted_with_last_reference(self):
+        first = make_customer(1, photo=self.upload())
+        second = make_customer(2, photo=self.upload())
+        name = first.photo.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(self.references(name), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.photo = self.upload('maroon')
+            second.save()
+        self.assertFalse(StoredPhoto.objects.filter(name=name).exists())
+        self.assertEqual(self.stored_files(), sorted(
+            os.path.basename(n) for n in [second.photo.name] + [
+                images.thumbnail_name(second.photo.name, key) for key in images.THUMBNAILS
+            ]
+        ))
+
+        # Saves that leave the photo alone keep the count
+        second.city = 'Izmir'
+        second.save()
+        Customer.objects.get(pk=second.pk).save()
+        self.assertEqual(self.references(second.photo.name), 1)
+
+    def test_merge_command(self):
+        customers = [make_customer(index) for index in range(1, 4)]
+        names = [default_storage.save('customer_photos/old.jpg', ContentFile(make_jpeg())) for customer in customers]
+        other = default_storage.save('customer_photos/other.jpg', ContentFile(make_jpeg(color='maroon')))
+        for customer, name in zip(customers, names):
+            Customer.objects.filter(pk=customer.pk).update(photo=name)
+        Customer.objects.filter(pk=customers[2].pk).update(photo=other)
+
+        out = StringIO()
+        call_command('merge_duplicate_photos', '--dry-run', stdout=out)
+        self.assertIn('1 duplicate photos would be merged', out.getvalue())
+        self.assertTrue(default_storage.exists(names[1]))
+
+        call_command('merge_duplicate_photos', stdout=StringIO())
+        photo_names = set(Customer.objects.values_list('photo', flat=True))
+        self.assertEqual(photo_names, {names[0], other})
+        self.assertFalse(default_storage.exists(names[1]))
+        self.assertTrue(default_storage.exists(names[2]))
+        self.assertEqual(self.references(names[0]), 2)
+        self.assertEqual(self.references(other), 1)
+        with default_storage.open(names[0]) as file:
+            self.assertEqual(StoredPhoto.objects.get(name=names[0]).sha256, photos.content_hash(file))
+
+
+class SigningStorage(FileSystemStorage):
+    """Stand-in for S3: every url() call signs a new URL"""
+    querystring_expire = 3600
+    signed = 0
+
+    def url(self, name):
+        SigningStorage.signed += 1
+        return f'{super().url(name)}?signature={SigningStorage.signed}'
+
+
+class SignedURLCacheTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        settings_override = override_settings(
+            DEFAULT_FILE_STORAGE='crm.storage.SignedURLCacheStorage',
+            SIGNED_URL_CACHE={'STORAGE': 'accounts.tests.SigningStorage'},
+            MEDIA_ROOT=self.media_root,
+            MEDIA_URL='/media/',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_url_reused_across_renders_and_workers(self):
+        storage = SignedURLCacheStorage()
+        name = storage.save('customer_photos/scan.jpg', ContentFile(b'scan'))
+        url = storage.url(name)
+        self.assertEqual(storage.url(name), url)
+        # Another worker sharing the cache
+        self.assertEqual(SignedURLCacheStorage().url(name), url)
+        self.assertEqual(storage.url_timeout, 3000)
+
+    def test_new_url_after_overwrite_or_delete(self):
+        storage = SignedURLCacheStorage()
+        name = storage.save('customer_photos/scan.jpg', ContentFile(b'scan'))
+        url = storage.url(name)
+        storage.delete(name)
+        self.assertFalse(storage.exists(name))
+        self.assertNotEqual(storage.url(name), url)
+
+    def test_not_cached_within_expiry_margin(self):
+        storage = SignedURLCacheStorage(EXPIRY_MARGIN=3600)
+        self.assertNotEqual(storage.url('a.jpg'), storage.url('a.jpg'))
+
+    def test_changelist_urls_are_stable(self):
+        make_customer(1, photo=SimpleUploadedFile('scan.jpg', make_jpeg(), 'image/jpeg'))
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        first = self.client.get('/admin/accounts/customer/').content
+        signed = SigningStorage.signed
+        self.assertEqual(self.client.get('/admin/accounts/customer/').content.count(b'signature='), first.count(b'signature='))
+        self.assertEqual(SigningStorage.signed, signed)
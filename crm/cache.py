@@ -0,0 +1,91 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class VersionedCache:
+    """
+    Cache for values derived from the database.
+
+    Entries are stored under a namespace version number; invalidating bumps
+    the version so every stored entry is orphaned at once and expires on its
+    own. Only the worker holding the recompute lock rebuilds an entry, the
+    others serve the last good value (or wait briefly when there is none).
+
+    Configuration is read from a settings dict on every call so any CACHES
+    alias can be used: local-memory or file-based on a single box, or a
+    shared backend (memcached, redis) across gunicorn workers.
+    """
+
+    defaults = {
+        'ALIAS': 'default',
+        'TIMEOUT': 300,
+        'LOCK_TIMEOUT': 30,
+        'WAIT_TIMEOUT': 5,
+    }
+
+    def __init__(self, namespace, settings_name):
+        self.namespace = namespace
+        self.settings_name = settings_name
+
+    @property
+    def config(self):
+        return {**self.defaults, **getattr(settings, self.settings_name, {})}
+
+    @property
+    def cache(self):
+        return caches[self.config['ALIAS']]
+
+    def _key(self, *parts):
+        return ':'.join([self.namespace, *map(str, parts)])
+
+    def version(self):
+        key = self._key('version')
+        version = self.cache.get(key)
+        if version is None:
+            # Seed from the clock so an evicted counter never reuses an old version
+            self.cache.add(key, time.time_ns(), None)
+            version = self.cache.get(key)
+        return version
+
+    def invalidate(self):
+        key = self._key('version')
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, time.time_ns(), None)
+
+    def get_or_set(self, key, compute):
+        config = self.config
+        cache = self.cache
+        version = self.version()
+        value_key = self._key(key, version)
+        stale_key = self._key(key, 'stale')
+
+        value = cache.get(value_key)
+        if value is not None:
+            return value
+
+        lock_key = self._key(key, 'lock', version)
+        locked = cache.add(lock_key, 1, config['LOCK_TIMEOUT'])
+        if not locked:
+            # Another worker is recomputing this version
+            value = cache.get(stale_key)
+            if value is not None:
+                return value
+            deadline = time.monotonic() + config['WAIT_TIMEOUT']
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                value = cache.get(value_key)
+                if value is not None:
+                    return value
+
+        try:
+            value = compute()
+            cache.set(value_key, value, config['TIMEOUT'])
+            cache.set(stale_key, value, None)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        return value
@@ -1,59 +1,101 @@
-from django.db.models import Sum, Count, Q
+from django.db.models import Q, Sum
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from accounts import ages
+from crm.cache import VersionedCache
+from crm.routers import primary_reads
 
-def dashboard_callback(request, context):
-    from accounts.models import Customer, Tour, Booking
-
-    # Calculate metrics
-    total_customers = Customer.objects.count()
-    total_tours = Tour.objects.count()
-    total_revenue = Booking.objects.filter(payment_status='paid').aggregate(
-        total=Sum('amount_paid')
-    )['total'] or 0
-    accounts_receivable = Booking.objects.exclude(payment_status='paid').aggregate(
-        total=Sum('total_price')
-    )['total'] or 0
-    pending_payments = Booking.objects.exclude(payment_status='paid').aggregate(
-        paid=Sum('amount_paid')
-    )['paid'] or 0
-    accounts_receivable = accounts_receivable - pending_payments
-
-    # Customers by country
-    customers_by_country = list(Customer.objects.values('country').annotate(
-        count=Count('id')
-    ).order_by('-count')[:10])
-
-    # Customers by city
-    customers_by_city = list(Customer.objects.values('city').annotate(
-        count=Count('id')
-    ).order_by('-count')[:10])
-
-    # Customers by age groups
-    age_groups = {
-        '18-25': Customer.objects.filter(age__gte=18, age__lte=25).count(),
-        '26-35': Customer.objects.filter(age__gte=26, age__lte=35).count(),
-        '36-45': Customer.objects.filter(age__gte=36, age__lte=45).count(),
-        '46-55': Customer.objects.filter(age__gte=46, age__lte=55).count(),
-        '56+': Customer.objects.filter(age__gte=56).count(),
+# Invalidated by Customer/Tour/Booking save and delete signals (accounts.models)
+dashboard_cache = VersionedCache('dashboard', 'DASHBOARD_CACHE')
+
+
+def customer_metrics():
+    """Customer demographics read from the CustomerRollup table and the birth_date index"""
+    from accounts.models import Customer, CustomerRollup
+
+    rows = CustomerRollup.objects.filter(dimension='gender', count__gt=0)
+    counts = {(row.dimension, row.value): row.count for row in rows}
+
+    gender_codes = [code for code, label in Customer.GENDER_CHOICES]
+    gender_codes += sorted(value for dimension, value in counts if dimension == 'gender' and value not in gender_codes)
+    gender_stats = [
+        {'gender': code, 'count': counts[('gender', code)]}
+        for code in gender_codes
+        if ('gender', code) in counts
+    ]
+
+    # Every customer has exactly one gender row, so their sum is the total
+    total_customers = sum(row['count'] for row in gender_stats)
+
+    age_groups = ages.age_group_counts()
+
+    top = CustomerRollup.objects.filter(count__gt=0).order_by('-count', 'value')
+    customers_by_country = [
+        {'country': value, 'count': count}
+        for value, count in top.filter(dimension='country').values_list('value', 'count')[:10]
+    ]
+    customers_by_city = [
+        {'city': value, 'count': count}
+        for value, count in top.filter(dimension='city').values_list('value', 'count')[:10]
+    ]
+
+    return {
+        'total_customers': total_customers,
+        'customers_by_country': customers_by_country,
+        'customers_by_city': customers_by_city,
+        'age_groups': age_groups,
+        'gender_stats': gender_stats,
     }
 
-    # Customers by gender
-    gender_stats = list(Customer.objects.values('gender').annotate(
-        count=Count('id')
-    ))
 
-    context.update({
+def booking_metrics():
+    """Revenue and receivables in one aggregation, answered from booking_balance_idx"""
+    from accounts.models import Booking
+
+    totals = Booking.objects.aggregate(
+        total_revenue=Sum('amount_paid', filter=Q(payment_status='paid')),
+        accounts_receivable=Sum('outstanding_balance', filter=~Q(payment_status='paid')),
+    )
+    return {
+        'total_revenue': totals['total_revenue'] or 0,
+        'accounts_receivable': totals['accounts_receivable'] or 0,
+    }
+
+
+def payment_metrics():
+    """Payments received this month, from the ledger snapshots (accounts.payments)"""
+    from accounts import payments
+
+    today = timezone.localdate()
+    return {'revenue_this_month': payments.revenue_between(today.replace(day=1), today)}
+
+
+# Cached until the next invalidation, so never read from a lagging replica
+@primary_reads()
+def compute_dashboard_metrics():
+    """Build the dashboard context with a fixed number of queries"""
+    from accounts.models import Tour
+
+    customers = customer_metrics()
+    bookings = booking_metrics()
+    received = payment_metrics()
+
+    return {
         "dashboard_stats": {
-            "total_customers": total_customers,
-            "total_tours": total_tours,
-            "total_revenue": f"€{total_revenue:,.2f}",
-            "accounts_receivable": f"€{accounts_receivable:,.2f}",
+            "total_customers": customers['total_customers'],
+            "total_tours": Tour.objects.count(),
+            "total_revenue": f"€{bookings['total_revenue']:,.2f}",
+            "accounts_receivable": f"€{bookings['accounts_receivable']:,.2f}",
         },
-        "customers_by_country": customers_by_country,
-        "customers_by_city": customers_by_city,
-        "age_groups": age_groups,
-        "gender_stats": gender_stats,
-    })
+        "revenue_this_month": f"€{received['revenue_this_month']:,.2f}",
+        "customers_by_country": customers['customers_by_country'],
+        "customers_by_city": customers['customers_by_city'],
+        "age_groups": customers['age_groups'],
+        "gender_stats": customers['gender_stats'],
+    }
 
+
+def dashboard_callback(request, context):
+    context.update(dashboard_cache.get_or_set('metrics', compute_dashboard_metrics))
     return context
@@ -0,0 +1,11 @@
+"""MySQL (PyMySQL) backend drawing its connections from crm.db.pool"""
+from django.db.backends.mysql import base
+
+from crm.db.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+
+    @staticmethod
+    def check_pooled_connection(connection):
+        connection.ping(reconnect=False)
@@ -0,0 +1,8 @@
+"""SQLite backend drawing its connections from crm.db.pool, to try the pool locally"""
+from django.db.backends.sqlite3 import base
+
+from crm.db.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    pass
@@ -0,0 +1,225 @@
+"""
+Per-process database connection pool.
+
+Without it every request (CONN_MAX_AGE = 0) or every thread (CONN_MAX_AGE > 0)
+opens its own connection, paying the TCP, TLS and authentication handshake.
+The crm.db.backends.* engines check connections out of a ConnectionPool
+instead and hand them back when Django closes them, so one process keeps at
+most MAX_SIZE open connections and reuses them across requests and threads.
+
+Configured with a "POOL" dict in the DATABASES entry (see DEFAULTS). A
+checkout waits up to TIMEOUT seconds for a free connection and then raises
+PoolTimeout. Idle connections are health-checked on checkout and replaced
+after MAX_IDLE seconds idle or MAX_LIFETIME seconds open. Pools are created
+lazily in each process, so forked workers never share sockets.
+"""
+import os
+import threading
+import time
+from collections import Counter, deque
+
+from django.db.utils import OperationalError
+
+DEFAULTS = {
+    'MAX_SIZE': 10,
+    'TIMEOUT': 5.0,
+    'MAX_IDLE': 300,
+    'MAX_LIFETIME': 3600,
+    'HEALTH_CHECKS': True,
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of DB-API connections made by ``connect()``. ``check``
+    raises for a connection that is no longer usable, ``reset`` clears a
+    connection's session before reuse.
+    """
+
+    def __init__(self, connect, check=None, reset=None, **options):
+        self.connect = connect
+        self.check = check
+        self.reset = reset
+        self.config = {**DEFAULTS, **options}
+        self.size = 0
+        self.idle = deque()  # (connection, opened_at, released_at)
+        self.opened_at = {}
+        self.counters = Counter()
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        deadline = time.monotonic() + self.config['TIMEOUT']
+        while True:
+            connection, reused = self._checkout(deadline)
+            if not reused:
+                return connection
+            if self.config['HEALTH_CHECKS'] and self.check is not None:
+                try:
+                    self.check(connection)
+                except Exception:
+                    with self.condition:
+                        self.counters['failed_checks'] += 1
+                    self._discard(connection)
+                    continue
+            return connection
+
+    def _checkout(self, deadline):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                while self.idle:
+                    # Most recently used first, so surplus connections age out
+                    connection, opened_at, released_at = self.idle.pop()
+                    if self._expired(opened_at, released_at, now):
+                        self._discard(connection, locked=True)
+                        continue
+                    self.counters['checkouts'] += 1
+                    return connection, True
+                if self.size < self.config['MAX_SIZE']:
+                    self.size += 1
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    self.counters['timeouts'] += 1
+                    raise PoolTimeout(
+                        f"No database connection free after {self.config['TIMEOUT']}s "
+                        f"(pool of {self.config['MAX_SIZE']})"
+                    )
+                self.counters['waits'] += 1
+                self.condition.wait(remaining)
+
+        # Opened outside the lock, other threads keep checking out meanwhile
+        try:
+            connection = self.connect()
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.opened_at[id(connection)] = time.monotonic()
+            self.counters['opened'] += 1
+            self.counters['checkouts'] += 1
+        return connection, False
+
+    def _expired(self, opened_at, released_at, now):
+        return (
+            now - released_at > self.config['MAX_IDLE']
+            or now - opened_at > self.config['MAX_LIFETIME']
+        )
+
+    def release(self, connection, discard=False):
+        """Return ``connection``; ``discard`` closes it (after errors)"""
+        if not discard and self.reset is not None:
+            try:
+                self.reset(connection)
+            except Exception:
+                discard = True
+        if discard:
+            self._discard(connection)
+            return
+        with self.condition:
+            opened_at = self.opened_at.get(id(connection), 0)
+            self.idle.append((connection, opened_at, time.monotonic()))
+            self.condition.notify()
+
+    def _discard(self, connection, locked=False):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        if locked:
+            self._forget(connection)
+        else:
+            with self.condition:
+                self._forget(connection)
+
+    def _forget(self, connection):
+        self.opened_at.pop(id(connection), None)
+        self.size -= 1
+        self.counters['closed'] += 1
+        self.condition.notify()
+
+    def close_all(self):
+        """Close the idle connections; checked out ones close when released"""
+        with self.condition:
+            while self.idle:
+                connection, opened_at, released_at = self.idle.pop()
+                self._discard(connection, locked=True)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'size': self.size,
+                'idle': len(self.idle),
+                'in_use': self.size - len(self.idle),
+                'max_size': self.config['MAX_SIZE'],
+                **{name: self.counters[name] for name in (
+                    'opened', 'closed', 'checkouts', 'waits', 'timeouts', 'failed_checks',
+                )},
+            }
+
+
+def get_pool(alias, name, factory):
+    """The pool for ``alias`` in this process, made by ``factory()`` on first use"""
+    key = (os.getpid(), alias, name)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = factory()
+        return pool
+
+
+def pool_stats():
+    """{alias: stats} of the pools of this process"""
+    pid = os.getpid()
+    with _pools_lock:
+        pools = [(alias, pool) for (pool_pid, alias, name), pool in _pools.items() if pool_pid == pid]
+    return {alias: pool.stats() for alias, pool in pools}
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    DatabaseWrapper mixin: get_new_connection() checks out of the process pool
+    and closing hands the connection back. Combine with a backend's wrapper
+    (crm.db.backends.mysql, crm.db.backends.sqlite3).
+    """
+
+    def pool(self, conn_params=None):
+        def factory():
+            base = super(PooledDatabaseWrapperMixin, self).get_new_connection
+            return ConnectionPool(
+                lambda: base(conn_params or self.get_connection_params()),
+                check=self.check_pooled_connection,
+                reset=self.reset_pooled_connection,
+                **self.settings_dict.get('POOL', {}),
+            )
+        return get_pool(self.alias, self.settings_dict['NAME'], factory)
+
+    def get_new_connection(self, conn_params):
+        return self.pool(conn_params).acquire()
+
+    def _close(self):
+        if self.connection is not None:
+            # A connection that raised may be broken, the pool opens a new one
+            self.pool().release(self.connection, discard=self.errors_occurred)
+
+    @staticmethod
+    def check_pooled_connection(connection):
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def reset_pooled_connection(connection):
+        # Ends a transaction left open by a connection closed inside atomic()
+        connection.rollback()
@@ -0,0 +1,77 @@
+"""
+Detect lazy loads, the source of N+1 queries on changelists.
+
+Inside ``forbid_lazy_loads()`` any model instance that goes back to the
+database for a related object (foreign key, one-to-one in either direction)
+or for a field left out by only()/defer() raises LazyLoadError instead, so a
+missing select_related()/only() fails a test rather than costing one query
+per row. The check is a context variable: other threads and requests are not
+affected and the descriptors only pay for it on a cache miss.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models.fields.related_descriptors import (
+    ForwardManyToOneDescriptor,
+    ReverseOneToOneDescriptor,
+)
+from django.db.models.query_utils import DeferredAttribute
+
+_forbidden = ContextVar('forbid_lazy_loads', default=False)
+_installed = False
+
+
+class LazyLoadError(RuntimeError):
+    pass
+
+
+def _check(instance, what):
+    if _forbidden.get():
+        raise LazyLoadError(f'Lazy load of {type(instance).__name__}.{what} (pk={instance.pk!r})')
+
+
+def _install():
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    get_object = ForwardManyToOneDescriptor.get_object
+
+    def forward_get_object(self, instance):
+        # Only called when the related object is not cached on the instance
+        _check(instance, self.field.name)
+        return get_object(self, instance)
+
+    reverse_get = ReverseOneToOneDescriptor.__get__
+
+    def reverse_one_to_one_get(self, instance, cls=None):
+        if instance is not None and not self.related.is_cached(instance):
+            _check(instance, self.related.get_accessor_name())
+        return reverse_get(self, instance, cls)
+
+    deferred_get = DeferredAttribute.__get__
+
+    def deferred_attribute_get(self, instance, cls=None):
+        if (
+            instance is not None
+            and self.field.attname not in instance.__dict__
+            and self._check_parent_chain(instance) is None
+        ):
+            _check(instance, self.field.attname)
+        return deferred_get(self, instance, cls)
+
+    ForwardManyToOneDescriptor.get_object = forward_get_object
+    ReverseOneToOneDescriptor.__get__ = reverse_one_to_one_get
+    DeferredAttribute.__get__ = deferred_attribute_get
+
+
+@contextmanager
+def forbid_lazy_loads():
+    """Raise LazyLoadError on any lazy related-object or deferred-field load in this block"""
+    _install()
+    token = _forbidden.set(True)
+    try:
+        yield
+    finally:
+        _forbidden.reset(token)
@@ -0,0 +1,177 @@
+"""
+Per-request SQL instrumentation.
+
+A sampled request runs with a database execute wrapper that records every
+statement with its duration and the project code that issued it. The totals
+go out as a Server-Timing header, requests over the QUERY_INSTRUMENTATION
+thresholds are logged as JSON lines to the "crm.queries" logger, and staff
+users get a summary overlay on admin pages. A request that is not sampled
+only pays for one random() call.
+"""
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.template.loader import render_to_string
+from django.urls import reverse
+
+from crm import routers
+from crm.db.pool import pool_stats
+
+logger = logging.getLogger('crm.queries')
+
+DEFAULTS = {
+    'SAMPLE_RATE': 0.0,
+    'SLOW_REQUEST_MS': 500,
+    'SLOW_QUERY_MS': 100,
+    'TOP_QUERIES': 5,
+    'OVERLAY': False,
+}
+
+
+def query_origin():
+    """``path:line in function`` of the innermost project frame on the stack"""
+    base_dir = str(settings.BASE_DIR)
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(base_dir) and filename != __file__ and 'site-packages' not in filename:
+            return f'{os.path.relpath(filename, base_dir)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return ''
+
+
+class QueryRecorder:
+    """Execute wrapper collecting (alias, sql, milliseconds, origin) for each statement"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            self.queries.append((context['connection'].alias, sql, duration, query_origin()))
+
+    def record(self):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+    @property
+    def total_ms(self):
+        return sum(duration for alias, sql, duration, origin in self.queries)
+
+    def duplicates(self, limit):
+        """(count, sql) of statements run more than once, most repeated first"""
+        counts = Counter(sql for alias, sql, duration, origin in self.queries)
+        return [(count, sql) for sql, count in counts.most_common(limit) if count > 1]
+
+    def slowest(self, limit):
+        return sorted(self.queries, key=lambda query: query[2], reverse=True)[:limit]
+
+
+class QueryInstrumentationMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    @property
+    def config(self):
+        return {**DEFAULTS, **getattr(settings, 'QUERY_INSTRUMENTATION', {})}
+
+    def __call__(self, request):
+        config = self.config
+        overlay = config['OVERLAY'] and self.is_staff_admin_request(request)
+        if not overlay and not (config['SAMPLE_RATE'] and random.random() < config['SAMPLE_RATE']):
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with recorder.record():
+            response = self.get_response(request)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        response['Server-Timing'] = (
+            f'db;dur={recorder.total_ms:.1f};desc="{len(recorder.queries)} queries", '
+            f'total;dur={elapsed_ms:.1f}'
+        )
+        self.log(request, response, recorder, elapsed_ms, config)
+        if overlay:
+            self.add_overlay(request, response, recorder, config)
+        return response
+
+    @staticmethod
+    def is_staff_admin_request(request):
+        if not request.path.startswith(reverse('admin:index')):
+            return False
+        user = getattr(request, 'user', None)
+        return bool(user and user.is_staff)
+
+    def log(self, request, response, recorder, elapsed_ms, config):
+        slowest = recorder.slowest(config['TOP_QUERIES'])
+        slow_query = slowest and slowest[0][2] >= config['SLOW_QUERY_MS']
+        if recorder.total_ms < config['SLOW_REQUEST_MS'] and not slow_query:
+            return
+        logger.warning(json.dumps({
+            'event': 'slow_request',
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(elapsed_ms, 1),
+            'db_ms': round(recorder.total_ms, 1),
+            'queries': len(recorder.queries),
+            'duplicates': [
+                {'count': count, 'sql': sql} for count, sql in recorder.duplicates(config['TOP_QUERIES'])
+            ],
+            'slowest': [
+                {'ms': round(duration, 1), 'db': alias, 'sql': sql, 'origin': origin}
+                for alias, sql, duration, origin in slowest
+            ],
+            'pools': pool_stats(),
+        }))
+
+    def add_overlay(self, request, response, recorder, config):
+        if getattr(response, 'streaming', False) or not response.get('Content-Type', '').startswith('text/html'):
+            return
+        content = response.content.decode(response.charset)
+        if '</body>' not in content:
+            return
+        overlay = render_to_string('admin/query_overlay.html', {
+            'queries': len(recorder.queries),
+            'db_ms': recorder.total_ms,
+            'duplicates': recorder.duplicates(config['TOP_QUERIES']),
+            'slowest': recorder.slowest(config['TOP_QUERIES']),
+            'pools': pool_stats(),
+        }, request=request)
+        index = content.rindex('</body>')
+        response.content = content[:index] + overlay + content[index:]
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = len(response.content)
+
+
+class ReplicaPinningMiddleware:
+    """Read-your-writes for crm.routers: a session that wrote reads from the primary"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not routers.replica_aliases():
+            return self.get_response(request)
+        session = getattr(request, 'session', None)
+        with routers.track_writes(pinned=routers.is_pinned(session)) as state:
+            response = self.get_response(request)
+        if state.wrote and session is not None:
+            routers.pin(session)
+        return response
@@ -0,0 +1,149 @@
+"""
+Read replica routing.
+
+Writes, and reads inside a transaction, always go to the primary ("default").
+Other reads go to one of READ_REPLICAS['ALIASES'] only where the caller opted
+in with replica_reads(): exports, GET changelists and the admin's read-only
+views, which can live with a replica a moment behind.
+
+Values cached across requests (dashboard metrics, filter options) are computed
+under primary_reads() instead: they are recomputed right after the write that
+invalidated them, and a lagging replica would put the old value back in the
+cache until the next invalidation.
+
+ReplicaPinningMiddleware gives read-your-writes: once a request writes, its
+session reads from the primary for READ_REPLICAS['STICKY_SECONDS'] (or the
+rest of the session when that is None), so a user never misses their own change.
+Session rows and the last_login stamp written by logging in do not count:
+they are never read through a replica, and counting them would pin every
+session from its login on.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PINNED_SESSION_KEY = '_db_pinned_until'
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# Auth bookkeeping, matched with identifier quotes removed
+BOOKKEEPING_STATEMENTS = (
+    'INSERT INTO django_session ',
+    'UPDATE django_session ',
+    'DELETE FROM django_session ',
+    'UPDATE auth_user SET last_login = %s WHERE ',
+)
+
+_replica_reads = ContextVar('replica_reads', default=False)
+_request_state = ContextVar('replica_request_state', default=None)
+
+
+class RequestState:
+    """Execute wrapper on the primary noting whether a request wrote anything"""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+    def __call__(self, execute, sql, params, many, context):
+        # Not db_for_write(): admin change forms open a transaction for the write
+        # router even on GET, only a statement that changes rows counts
+        if not self.wrote and sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS) and not is_bookkeeping(sql):
+            self.wrote = True
+        return execute(sql, params, many, context)
+
+
+def is_bookkeeping(sql):
+    return sql.lstrip().replace('"', '').replace('`', '').startswith(BOOKKEEPING_STATEMENTS)
+
+
+def replica_aliases():
+    return getattr(settings, 'READ_REPLICAS', {}).get('ALIASES', [])
+
+
+@contextmanager
+def replica_reads():
+    """Let reads in this block (or decorated function) go to a replica"""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Keep reads in this block (or decorated function) on the primary, also inside replica_reads()"""
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def read_alias():
+    """Database a read in the current context goes to"""
+    aliases = replica_aliases()
+    state = _request_state.get()
+    if (
+        not aliases
+        or not _replica_reads.get()
+        or (state is not None and (state.pinned or state.wrote))
+        or connections[DEFAULT_DB_ALIAS].in_atomic_block
+    ):
+        return DEFAULT_DB_ALIAS
+    return random.choice(aliases)
+
+
+@contextmanager
+def track_writes(pinned=False):
+    """Request scope: yields a RequestState whose ``wrote`` tells if the block wrote"""
+    state = RequestState(pinned)
+    token = _request_state.set(state)
+    try:
+        with connections[DEFAULT_DB_ALIAS].execute_wrapper(state):
+            yield state
+    finally:
+        _request_state.reset(token)
+
+
+def is_pinned(session):
+    if session is None or PINNED_SESSION_KEY not in session:
+        return False
+    until = session[PINNED_SESSION_KEY]
+    return until is None or until > time.time()
+
+
+def pin(session):
+    sticky = getattr(settings, 'READ_REPLICAS', {}).get('STICKY_SECONDS')
+    if sticky is None:
+        # Pinned for good already, spare the session write
+        if PINNED_SESSION_KEY not in session or session[PINNED_SESSION_KEY] is not None:
+            session[PINNED_SESSION_KEY] = None
+    else:
+        session[PINNED_SESSION_KEY] = time.time() + sticky
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema through replication
+        if db in replica_aliases():
+            return False
+        return None
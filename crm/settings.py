@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 from django.templatetags.static import static
@@ -57,6 +58,8 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "crm.middleware.QueryInstrumentationMiddleware",
+    "crm.middleware.ReplicaPinningMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -98,12 +101,94 @@ DATABASES = {
         "PASSWORD": os.getenv('DB_PASSWORD', ''),
         "HOST": os.getenv('DB_HOST', 'localhost'),
         "PORT": os.getenv('DB_PORT', '3306'),
-        "OPTIONS": {
-            "charset": "utf8mb4",
+        "OPTIONS": {},
+        # Keep a connection open across requests for this many seconds (0 closes
+        # it after every request), checking it is still usable before reuse
+        "CONN_MAX_AGE": int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        "CONN_HEALTH_CHECKS": os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True',
+        # Per-process connection pool (crm.db.pool), used when DB_ENGINE is
+        # crm.db.backends.mysql or crm.db.backends.sqlite3. Pair it with
+        # DB_CONN_MAX_AGE=0 so connections go back to the pool after each request.
+        "POOL": {
+            "MAX_SIZE": int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+            "TIMEOUT": float(os.getenv('DB_POOL_TIMEOUT', '5')),
+            "MAX_IDLE": int(os.getenv('DB_POOL_MAX_IDLE', '300')),
+            "MAX_LIFETIME": int(os.getenv('DB_POOL_MAX_LIFETIME', '3600')),
+            "HEALTH_CHECKS": os.getenv('DB_POOL_HEALTH_CHECKS', 'True') == 'True',
         },
     }
 }
 
+if 'mysql' in DATABASES['default']['ENGINE']:
+    DATABASES['default']['OPTIONS']['charset'] = 'utf8mb4'
+
+# Read replicas (crm.routers): DB_REPLICAS lists their hosts, or database files
+# with SQLite, comma separated. Exports and GET changelists read from them
+# (cached dashboard and filter values never do); a session that wrote reads
+# from the primary for STICKY_SECONDS afterwards (unset: for the rest of the
+# session).
+READ_REPLICAS = {
+    "ALIASES": [],
+    "STICKY_SECONDS": int(os.environ['DB_REPLICA_STICKY_SECONDS']) if os.getenv('DB_REPLICA_STICKY_SECONDS') else None,
+}
+for index, replica in enumerate(filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1):
+    alias = f'replica{index}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        "NAME" if 'sqlite' in DATABASES['default']['ENGINE'] else "HOST": replica.strip(),
+        "OPTIONS": dict(DATABASES['default']['OPTIONS']),
+        "TEST": {"MIRROR": 'default'},
+    }
+    READ_REPLICAS["ALIASES"].append(alias)
+
+DATABASE_ROUTERS = ['crm.routers.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Local memory by default; point CACHE_BACKEND/CACHE_LOCATION at a file-based
+# cache for a single box or a shared backend (memcached, redis) so all
+# gunicorn workers see the same entries.
+
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        "LOCATION": os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Sessions: "db" (django_session on every request), "cached_db" (read through
+# the "sessions" cache, still written to the table) or "cache" (cache only, lost
+# when it evicts or restarts). The sessions cache must be shared by all workers
+# (memcached, redis) unless a single process serves the site.
+CACHES["sessions"] = {
+    "BACKEND": os.getenv('SESSION_CACHE_BACKEND', CACHES["default"]["BACKEND"]),
+    "LOCATION": os.getenv('SESSION_CACHE_LOCATION', CACHES["default"]["LOCATION"]),
+    "KEY_PREFIX": 'session',
+}
+SESSION_ENGINE = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+}[os.getenv('SESSION_STORE', 'db')]
+SESSION_CACHE_ALIAS = 'sessions'
+
+# Dashboard metrics cache (crm.cache.VersionedCache). TIMEOUT is a safety net,
+# entries are normally invalidated by model signals.
+DASHBOARD_CACHE = {
+    "ALIAS": os.getenv('DASHBOARD_CACHE_ALIAS', 'default'),
+    "TIMEOUT": int(os.getenv('DASHBOARD_CACHE_TIMEOUT', '300')),
+    "LOCK_TIMEOUT": int(os.getenv('DASHBOARD_CACHE_LOCK_TIMEOUT', '30')),
+}
+
+# Changelist filter options cache (accounts.filters), invalidated like the
+# dashboard. COUNTS shows the number of rows next to each option.
+FILTER_LOOKUP_CACHE = {
+    "ALIAS": os.getenv('FILTER_LOOKUP_CACHE_ALIAS', 'default'),
+    "TIMEOUT": int(os.getenv('FILTER_LOOKUP_CACHE_TIMEOUT', '600')),
+    "COUNTS": os.getenv('FILTER_LOOKUP_COUNTS', 'True') == 'True',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -159,10 +244,79 @@ AWS_DEFAULT_ACL = None  # Use bucket's default ACL
 AWS_S3_FILE_OVERWRITE = False
 AWS_QUERYSTRING_AUTH = True  # Generate signed URLs for private files
 
-# Media files (Uploads) - Using S3
-DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+# Media files (Uploads) - Using S3, with signed URLs cached by crm.storage
+DEFAULT_FILE_STORAGE = 'crm.storage.SignedURLCacheStorage'
+AWS_QUERYSTRING_EXPIRE = int(os.getenv('AWS_QUERYSTRING_EXPIRE', '3600'))
+SIGNED_URL_CACHE = {
+    "STORAGE": 'storages.backends.s3boto3.S3Boto3Storage',
+    "ALIAS": os.getenv('SIGNED_URL_CACHE_ALIAS', 'default'),
+    # A cached URL is replaced this many seconds before it expires
+    "EXPIRY_MARGIN": int(os.getenv('SIGNED_URL_EXPIRY_MARGIN', '600')),
+}
 MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/{AWS_LOCATION}/'
 
+# Uploaded customer and user photos are re-encoded before storage
+# (accounts.images.normalize_upload). FORMAT is a Pillow format: JPEG or WEBP.
+PHOTO_UPLOAD = {
+    "MAX_DIMENSION": int(os.getenv('PHOTO_MAX_DIMENSION', '2400')),
+    "FORMAT": os.getenv('PHOTO_FORMAT', 'JPEG'),
+    "QUALITY": int(os.getenv('PHOTO_QUALITY', '82')),
+}
+
+# Uploads larger than this are streamed to a temporary file, not kept in memory
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(os.getenv('FILE_UPLOAD_MAX_MEMORY_SIZE', str(2 * 1024 * 1024)))
+
+# Bulk customer import (accounts.importers)
+CUSTOMER_IMPORT_BATCH_SIZE = int(os.getenv('CUSTOMER_IMPORT_BATCH_SIZE', '500'))
+CUSTOMER_IMPORT_REPORT_DIR = os.getenv(
+    'CUSTOMER_IMPORT_REPORT_DIR', os.path.join(tempfile.gettempdir(), 'alaf-customer-imports')
+)
+
+# Rows fetched per query by the admin CSV/XLSX exports (accounts.exports)
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '2000'))
+
+# Changelist search index (accounts.search): 'auto' uses SQLite FTS5 on SQLite
+# and the SearchToken table elsewhere, or give a backend's dotted path
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'auto')
+
+# Filtered admin changelists count at most this many rows and show "10,000+"
+# (accounts.pagination.EstimatedCountPaginator)
+ADMIN_COUNT_CAP = int(os.getenv('ADMIN_COUNT_CAP', '10000'))
+
+# Per-request SQL instrumentation (crm.middleware). SAMPLE_RATE is the share
+# of requests instrumented; sampled requests get a Server-Timing header and are
+# logged to "crm.queries" when their DB time or a single query reaches the
+# thresholds. OVERLAY instruments every admin page of staff users and shows a
+# summary panel on it.
+QUERY_INSTRUMENTATION = {
+    "SAMPLE_RATE": float(os.getenv('QUERY_SAMPLE_RATE', '0')),
+    "SLOW_REQUEST_MS": float(os.getenv('QUERY_SLOW_REQUEST_MS', '500')),
+    "SLOW_QUERY_MS": float(os.getenv('QUERY_SLOW_QUERY_MS', '100')),
+    "TOP_QUERIES": 5,
+    "OVERLAY": os.getenv('QUERY_OVERLAY', str(DEBUG)) == 'True',
+}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "crm.queries": {
+            "handlers": ["console"],
+            "level": os.getenv('QUERY_LOG_LEVEL', 'INFO'),
+            "propagate": False,
+        },
+        # PHOTO_LOG_LEVEL=INFO logs the before/after size of every normalized upload
+        "accounts.images": {
+            "handlers": ["console"],
+            "level": os.getenv('PHOTO_LOG_LEVEL', 'WARNING'),
+            "propagate": False,
+        },
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
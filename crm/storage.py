@@ -0,0 +1,113 @@
+"""
+Media storage with cached signed URLs.
+
+With AWS_QUERYSTRING_AUTH every url() call signs a new URL, so the same photo
+gets a different address on every render and browsers never reuse it.
+SignedURLCacheStorage wraps the real storage (SIGNED_URL_CACHE['STORAGE']) and
+keeps each signed URL in a shared cache until EXPIRY_MARGIN seconds before it
+expires; every render and every worker hands out the same URL meanwhile.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.storage import Storage
+from django.utils.module_loading import import_string
+
+DEFAULTS = {
+    'STORAGE': 'django.core.files.storage.FileSystemStorage',
+    'ALIAS': 'default',
+    # Lifetime of URLs from storages that do not say (unsigned URLs never expire)
+    'TIMEOUT': 3600,
+    'EXPIRY_MARGIN': 600,
+    'KEY_PREFIX': 'signed-url',
+}
+
+
+class SignedURLCacheStorage(Storage):
+    """Delegates to the wrapped storage; url() is served from the cache"""
+
+    def __init__(self, storage=None, **options):
+        self.config = {**DEFAULTS, **getattr(settings, 'SIGNED_URL_CACHE', {}), **options}
+        self.storage = storage if storage is not None else import_string(self.config['STORAGE'])()
+
+    def __getattr__(self, name):
+        # Backend specific attributes (bucket_name, location, ...)
+        if name == 'storage':
+            raise AttributeError(name)
+        return getattr(self.storage, name)
+
+    @property
+    def cache(self):
+        return caches[self.config['ALIAS']]
+
+    @property
+    def url_timeout(self):
+        expire = getattr(self.storage, 'querystring_expire', None) or self.config['TIMEOUT']
+        return max(expire - self.config['EXPIRY_MARGIN'], 0)
+
+    def cache_key(self, name):
+        # Hashed: names may be longer than memcached keys or contain spaces
+        location = getattr(self.storage, 'bucket_name', None) or getattr(self.storage, 'location', '')
+        digest = hashlib.sha1(f'{location}:{name}'.encode()).hexdigest()
+        return f"{self.config['KEY_PREFIX']}:{digest}"
+
+    def url(self, name):
+        timeout = self.url_timeout
+        if not timeout:
+            return self.storage.url(name)
+        key = self.cache_key(name)
+        url = self.cache.get(key)
+        if url is None:
+            url = self.storage.url(name)
+            self.cache.set(key, url, timeout)
+        return url
+
+    def forget_url(self, name):
+        self.cache.delete(self.cache_key(name))
+
+    def open(self, name, mode='rb'):
+        return self.storage.open(name, mode)
+
+    def save(self, name, content, max_length=None):
+        # The wrapped storage picks the final name, an overwrite gets a new URL
+        name = self.storage.save(name, content, max_length=max_length)
+        self.forget_url(name)
+        return name
+
+    def delete(self, name):
+        self.storage.delete(name)
+        self.forget_url(name)
+
+    def exists(self, name):
+        return self.storage.exists(name)
+
+    def listdir(self, path):
+        return self.storage.listdir(path)
+
+    def size(self, name):
+        return self.storage.size(name)
+
+    def path(self, name):
+        return self.storage.path(name)
+
+    def get_valid_name(self, name):
+        return self.storage.get_valid_name(name)
+
+    def get_alternative_name(self, file_root, file_ext):
+        return self.storage.get_alternative_name(file_root, file_ext)
+
+    def get_available_name(self, name, max_length=None):
+        return self.storage.get_available_name(name, max_length=max_length)
+
+    def generate_filename(self, filename):
+        return self.storage.generate_filename(filename)
+
+    def get_accessed_time(self, name):
+        return self.storage.get_accessed_time(name)
+
+    def get_created_time(self, name):
+        return self.storage.get_created_time(name)
+
+    def get_modified_time(self, name):
+        return self.storage.get_modified_time(name)